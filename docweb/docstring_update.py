@@ -5,11 +5,13 @@ Update docstrings from XML files and generate patches
 
 import lxml.etree as etree
 import tempfile, os, subprocess, sys, shutil, traceback, difflib, datetime, re
+import hashlib
 
 from django.db import transaction
 from django.conf import settings
 
-from pydocweb.docweb.utils import strip_spurious_whitespace, merge_3way
+from pydocweb.docweb.utils import (strip_spurious_whitespace, merge_3way,
+                                   chunked, PhaseTimer)
 from pydocweb.docweb.models import *
 
 class MalformedPydocXML(RuntimeError):
@@ -17,95 +19,325 @@ class MalformedPydocXML(RuntimeError):
 
 # -----------------------------------------------------------------------------
 
-@transaction.commit_on_success
-def update_docstrings_from_xml(site, stream):
+def update_docstrings_from_xml(site, stream, incremental=False,
+                               merge_pool=None):
     """
     Read XML from stream and update database accordingly.
 
+    Parameters
+    ----------
+    site : Site
+        Site whose docstrings to update.
+    stream : file
+        Stream containing pydoc XML.
+    incremental : bool, optional
+        If True, skip entries whose fingerprint matches the one stored
+        on the previous pull, and refresh the label and toctree caches
+        only for the docstrings that changed.
+    merge_pool : multiprocessing.Pool, optional
+        Worker processes for computing the merges when there are many
+        of them, see `update_docstrings`. By default, all merges are
+        computed in this process.
+
+    Returns
+    -------
+    timer : PhaseTimer
+        Time spent in each phase of the update.
+
     """
     try:
-        _update_docstrings_from_xml(site, stream)
+        timer = _update_docstrings_from_xml(site, stream,
+                                            incremental=incremental,
+                                            merge_pool=merge_pool)
     except (TypeError, ValueError, AttributeError, KeyError), e:
+        PullMetadata.clear_cache()
         msg = traceback.format_exc()
         raise MalformedPydocXML(str(e) + "\n\n" +  msg)
+    except:
+        # The pull was rolled back
+        PullMetadata.clear_cache()
+        raise
+    return timer
 
-def _update_docstrings_from_xml(site, stream):
-    tree = etree.parse(stream)
-    root = tree.getroot()
+_XML_DOCSTRING_TAGS = ('module', 'class', 'callable', 'object', 'dir', 'file')
 
-    timestamp = datetime.datetime.now()
+# Docstring fields whose values come directly from the XML
+_VCS_FIELDS = ['type_code', 'type_name', 'argspec', 'objclass', 'bases',
+               'file_name', 'line_number', 'source_doc']
 
-    known_entries = {}
-    for el in root:
-        if el.tag not in ('module', 'class', 'callable', 'object', 'dir',
-                          'file'):
-            continue
-        known_entries[el.attrib['id']] = True
+def _column(field):
+    return Docstring._meta.get_field(field).column
 
-    for el in root:
-        if el.tag not in ('module', 'class', 'callable', 'object', 'dir',
-                          'file'):
-            continue
+def _parse_xml_entry(el):
+    """
+    Convert a docstring element in pydoc XML to a dict of Docstring
+    field values, plus a 'refs' list of (alias, target) pairs.
 
-        bases = []
-        for b in el.findall('base'):
-            bases.append(b.attrib['ref'])
-        bases = " ".join(bases)
-        if not bases:
-            bases = None
+    """
+    bases = []
+    for b in el.findall('base'):
+        bases.append(b.attrib['ref'])
+    bases = " ".join(bases)
+    if not bases:
+        bases = None
+
+    if el.text:
+        docstring = strip_spurious_whitespace(el.text.decode('string-escape'))
+    else:
+        docstring = u""
+
+    if not isinstance(docstring, unicode):
+        try:
+            docstring = docstring.decode('utf-8')
+        except UnicodeError:
+            docstring = docstring.decode('iso-8859-1')
 
-        if el.text:
-            docstring = strip_spurious_whitespace(el.text.decode('string-escape'))
-        else:
-            docstring = u""
+    try:
+        line = int(el.get('line'))
+    except (ValueError, TypeError):
+        line = None
+
+    entry = dict(name=el.attrib['id'],
+                 type_code=el.tag,
+                 type_name=el.get('type'),
+                 argspec=el.get('argspec'),
+                 objclass=el.get('objclass'),
+                 bases=bases,
+                 file_name=el.get('file'),
+                 line_number=line,
+                 source_doc=docstring,
+                 refs=[(ref.attrib['name'], ref.attrib['ref'])
+                       for ref in el.findall('ref')])
+    entry['source_hash'] = _entry_fingerprint(entry)
+    return entry
+
+def _entry_fingerprint(entry):
+    """
+    Compute a hash of everything a pull stores for an XML entry.
 
-        if not isinstance(docstring, unicode):
-            try:
-                docstring = docstring.decode('utf-8')
-            except UnicodeError:
-                docstring = docstring.decode('iso-8859-1')
+    """
+    items = [entry[f] for f in _VCS_FIELDS] + sorted(entry['refs'])
+    data = []
+    for item in items:
+        if isinstance(item, tuple):
+            item = u"%s\1%s" % item
+        elif item is None:
+            item = u"\2"
+        elif not isinstance(item, unicode):
+            item = unicode(str(item), 'utf-8')
+        data.append(item)
+    return hashlib.md5(u"\0".join(data).encode('utf-8')).hexdigest()
+
+def _iter_xml_elements(stream, tags):
+    """
+    Iterate over the top-level elements of pydoc XML with the given
+    tags, without building the whole document tree in memory.
 
-        try:
-            line = int(el.get('line'))
-        except (ValueError, TypeError):
-            line = None
-
-        doc, created = Docstring.on_site.get_or_create(name=el.attrib['id'],
-                                                       site=site)
-        doc.type_code = el.tag
-        doc.type_name = el.get('type')
-        doc.argspec = el.get('argspec')
-        doc.objclass = el.get('objclass')
-        doc.bases = bases
-        doc.file_name = el.get('file')
-        doc.line_number = line
-        doc.timestamp = timestamp
-        doc.source_doc = docstring
-
-        if created:
-            # New docstring
-            doc.merge_status = MERGE_NONE
-            doc.base_doc = doc.source_doc
-            doc.dirty = False
-        elif docstring != doc.base_doc:
-            # Source has changed, try to merge from base
-            doc.save()
-            doc.get_merge() # update merge status
-        else:
-            doc.merge_status = MERGE_NONE
+    Each element is cleared after the consumer has processed it.
 
-        doc.dirty = (doc.source_doc != doc.text)
-        doc.contents.all().delete()
-        doc.save()
+    """
+    for event, el in etree.iterparse(stream, events=('end',)):
+        parent = el.getparent()
+        if parent is None or parent.getparent() is not None:
+            # root element, or not a top-level entry
+            continue
+        if el.tag in tags:
+            yield el
+        # free the processed elements
+        el.clear()
+        while el.getprevious() is not None:
+            del parent[0]
+
+def _load_existing_docstrings(cursor, site, names):
+    """
+    Load the import-relevant columns of the given docstrings of a site,
+    and their aliases, in two queries.
 
-        # -- Contents
+    """
+    in_ = ", ".join(["%s"]*len(names))
+
+    fields = _VCS_FIELDS + ['source_hash', 'base_doc', 'merge_status',
+                            'timestamp', 'cur_revno', 'cur_text']
+    cursor.execute("SELECT name, %s FROM docweb_docstring "
+                   "WHERE site_id = %%s AND name IN (%s)"
+                   % (", ".join(_column(f) for f in fields), in_),
+                   [site.id] + names)
+    existing = {}
+    for row in cursor.fetchall():
+        existing[row[0]] = dict(zip(fields, row[1:]))
 
-        for ref in el.findall('ref'):
-            alias = DocstringAlias()
-            alias.target = ref.attrib['ref']
-            alias.parent = doc
-            alias.alias = ref.attrib['name']
-            alias.save()
+    cursor.execute("""
+    SELECT a.parent_id, a.alias, a.target
+    FROM docweb_docstringalias AS a
+    WHERE a.parent_id IN (%s)
+    """ % in_, names)
+    aliases = {}
+    for parent, alias, target in cursor.fetchall():
+        aliases.setdefault(parent, []).append((alias, target))
+    return existing, aliases
+
+# Number of XML entries processed at a time
+_IMPORT_BATCH_SIZE = 500
+
+@transaction.commit_on_success
+def _update_docstrings_from_xml(site, stream, incremental=False,
+                                merge_pool=None):
+    from django.db import connection
+    cursor = connection.cursor()
+
+    timer = PhaseTimer()
+    timestamp = datetime.datetime.now()
+    db_timestamp = connection.ops.value_to_db_datetime(timestamp)
+
+    # another process may have pulled since this one cached the timestamp
+    PullMetadata.clear_cache()
+    prev_timestamp = PullMetadata.get_timestamp(site)
+    db_prev_timestamp = connection.ops.value_to_db_datetime(prev_timestamp)
+
+    written_fields = _VCS_FIELDS + ['source_hash']
+    vcs_columns = [_column(f) for f in written_fields]
+
+    seen_names = set()
+    revived_names = []
+    merge_names = []
+    changed_names = set()
+
+    # -- Stream the XML in batches, diffing each against the database
+
+    elements = _iter_xml_elements(stream, _XML_DOCSTRING_TAGS)
+    timer.mark('setup')
+    while True:
+        entries = {}
+        for el in elements:
+            entry = _parse_xml_entry(el)
+            entries[entry['name']] = entry
+            if len(entries) >= _IMPORT_BATCH_SIZE:
+                break
+        if not entries:
+            break
+        timer.mark('parse')
+
+        existing, existing_aliases = _load_existing_docstrings(
+            cursor, site, entries.keys())
+        timer.mark('load')
+
+        new_rows = []
+        changed_rows = []
+        alias_parents = []
+        alias_rows = []
+
+        for name, entry in entries.iteritems():
+            old = existing.get(name)
+            seen_names.add(name)
+
+            if old is not None and old['timestamp'] == prev_timestamp:
+                if incremental and old['source_hash'] == entry['source_hash']:
+                    # Untouched since the previous pull
+                    continue
+            elif old is not None:
+                # Obsolete docstring reappeared
+                revived_names.append(name)
+                changed_names.add(name)
+
+            if old is None:
+                # New docstring
+                new_rows.append([name, site.id, db_timestamp,
+                                 entry['source_doc'], MERGE_NONE, False,
+                                 REVIEW_NEEDS_EDITING, False]
+                                + [entry[f] for f in written_fields])
+                changed_names.add(name)
+            else:
+                values = dict((f, entry[f]) for f in written_fields)
+                if entry['source_doc'] != old['base_doc']:
+                    # Source has changed, try to merge from base (below)
+                    values['merge_status'] = old['merge_status']
+                    merge_names.append(name)
+                else:
+                    values['merge_status'] = MERGE_NONE
+
+                if old['cur_revno'] is None:
+                    text = entry['source_doc']
+                else:
+                    text = old['cur_text']
+                values['dirty'] = (entry['source_doc'] != text)
+
+                if [k for k, v in values.iteritems() if old.get(k, v) != v]:
+                    changed_rows.append([values[f] for f in written_fields]
+                                        + [values['merge_status'],
+                                           values['dirty'], name])
+                    changed_names.add(name)
+
+            # -- Contents
+            old_refs = existing_aliases.get(name, [])
+            if sorted(entry['refs']) != sorted(old_refs):
+                if old is not None:
+                    alias_parents.append(name)
+                for alias, target in entry['refs']:
+                    alias_rows.append([name, target, alias])
+                changed_names.add(name)
+                changed_names.update(target for alias, target in old_refs)
+                changed_names.update(target for alias, target in entry['refs'])
+
+        del entries, existing, existing_aliases
+        timer.mark('diff')
+
+        # -- Write changes in batches
+
+        if new_rows:
+            columns = ['name', 'site_id', 'timestamp', 'base_doc',
+                       'merge_status', 'dirty', 'review',
+                       'cur_ok_to_apply'] + vcs_columns
+            cursor.executemany(
+                "INSERT INTO docweb_docstring (%s) VALUES (%s)"
+                % (", ".join(columns), ", ".join(["%s"]*len(columns))),
+                new_rows)
+        if changed_rows:
+            cursor.executemany(
+                "UPDATE docweb_docstring SET %s, merge_status = %%s, "
+                "dirty = %%s WHERE name = %%s"
+                % ", ".join("%s = %%s" % c for c in vcs_columns),
+                changed_rows)
+        if alias_parents:
+            cursor.execute(
+                "DELETE FROM docweb_docstringalias WHERE parent_id IN (%s)"
+                % ", ".join(["%s"]*len(alias_parents)), alias_parents)
+        if alias_rows:
+            cursor.executemany(
+                "INSERT INTO docweb_docstringalias (parent_id, target, alias) "
+                "VALUES (%s, %s, %s)", alias_rows)
+        timer.mark('write')
+
+    # -- Move all docstrings present in VCS to the new timestamp: bump
+    #    everything that was current, then put back the ones that are gone
+
+    removed_names = []
+    if prev_timestamp is not None:
+        cursor.execute("SELECT name FROM docweb_docstring "
+                       "WHERE site_id = %s AND timestamp = %s",
+                       [site.id, db_prev_timestamp])
+        removed_names = [row[0] for row in cursor.fetchall()
+                         if row[0] not in seen_names]
+        changed_names.update(removed_names)
+
+        cursor.execute("UPDATE docweb_docstring SET timestamp = %s "
+                       "WHERE site_id = %s AND timestamp = %s",
+                       [db_timestamp, site.id, db_prev_timestamp])
+    del seen_names
+
+    for names, ts in [(removed_names, db_prev_timestamp),
+                      (revived_names, db_timestamp)]:
+        for chunk in chunked(names):
+            cursor.execute(
+                "UPDATE docweb_docstring SET timestamp = %%s "
+                "WHERE name IN (%s)" % ", ".join(["%s"]*len(chunk)),
+                [ts] + chunk)
+    PullMetadata.set_timestamp(site, timestamp)
+    timer.mark('write')
+
+    # -- Merge only docstrings whose source changed
+
+    _update_merge_status(cursor, site, merge_names, merge_pool)
+    timer.mark('merge')
 
     # -- Handle obsoletion of 'file' pages missing in VCS
 
@@ -118,9 +350,12 @@ def _update_docstrings_from_xml(site, stream):
             doc.timestamp = timestamp
             doc.dirty = True
             doc.save()
+            changed_names.add(doc.name)
             if doc.base_doc != doc.source_doc:
                 doc.get_merge()
 
+    timer.mark('obsolete files')
+
     # -- Handle obsoletion of 'dir' pages missing in VCS
 
     for doc in Docstring.on_site.filter(type_code='dir',
@@ -140,15 +375,133 @@ def _update_docstrings_from_xml(site, stream):
                 alias.parent = doc
                 alias.alias = child.name.split('/')[-1]
                 alias.save()
+                changed_names.add(child.name)
             doc.save()
+            changed_names.add(doc.name)
+
+    timer.mark('obsolete dirs')
+
+    # -- Docstrings and aliases were written with raw SQL; the new
+    #    token becomes visible to other processes with the commit
+    DocstringNameIndex.invalidate(site)
+
+    # -- Update label and toctree caches
+
+    old_labels = _get_labels(cursor, site, changed_names)
+
+    if incremental:
+        _refresh_label_cache(cursor, site, db_timestamp, changed_names)
+        _cache_file_pages(cursor, site, db_timestamp, changed_names)
+    else:
+        _rebuild_label_cache(cursor, site, db_timestamp)
+        _cache_file_pages(cursor, site, db_timestamp)
 
-    # -- Update label cache
+    # -- Raw SQL needs a manual flush
+    transaction.commit_unless_managed()
+    timer.mark('label cache')
+
+    # -- Update the full-text search index
+
+    if incremental:
+        SearchIndex.index_docstrings(site, changed_names)
+    else:
+        SearchIndex.index_docstrings(site)
+        SearchIndex.index_wiki_pages(site)
+    timer.mark('search index')
+
+    # -- Invalidate rendered pages of the changed docstrings, and those
+    #    linking to them or to labels that were added or removed
+
+    new_labels = _get_labels(cursor, site, changed_names)
+    RenderCache.invalidate(changed_names)
+    RenderCache.invalidate_dependents(
+        site, changed_names.union(old_labels.symmetric_difference(new_labels)))
+    timer.mark('render cache')
+
+    return timer
+
+#: Fewer merges than this are computed without the process pool
+_MERGE_POOL_MIN = 100
+
+def _update_merge_status(cursor, site, names, pool=None):
+    """
+    Recompute the merge status of the given docstrings, writing back
+    only the ones that changed.
 
+    The texts are collected first, and the merges computed in the
+    given process pool if there are many of them.
+
+    """
+    rows = []
+    for chunk in chunked(names):
+        cursor.execute("""
+        SELECT name, COALESCE(cur_text, source_doc), base_doc, source_doc,
+               cur_revno, merge_status
+        FROM docweb_docstring
+        WHERE site_id = %%s AND name IN (%s)
+        """ % ", ".join(["%s"]*len(chunk)), [site.id] + chunk)
+        rows.extend(cursor.fetchall())
+
+    results = _compute_merges([row[1:5] for row in rows], pool)
+
+    updates = []
+    for row, (new_status, new_base_doc, result) in zip(rows, results):
+        name, text, base_doc, source_doc, cur_revno, merge_status = row
+        if (new_status, new_base_doc) != (merge_status, base_doc):
+            updates.append((new_status, new_base_doc, name))
+
+    for chunk in chunked(updates):
+        cursor.executemany("UPDATE docweb_docstring "
+                           "SET merge_status = %s, base_doc = %s "
+                           "WHERE name = %s", chunk)
+
+def _compute_merges(tasks, pool=None):
+    """Run compute_merge for a list of argument tuples"""
+    if pool is None or len(tasks) < _MERGE_POOL_MIN:
+        return map(_compute_merge_task, tasks)
+    return pool.map(_compute_merge_task, tasks, chunksize=50)
+
+def _create_merge_pool(processes):
+    """
+    Start `processes` merge worker processes (None: one per CPU).
+
+    Returns None if `processes` is 1 or multiprocessing is not
+    available. The database connection is closed first, so that the
+    workers do not inherit it; it is reopened on the next query.
+
+    """
+    if processes == 1:
+        return None
+    try:
+        import multiprocessing
+    except ImportError:
+        return None
+    from django.db import connection
+    connection.close()
+    return multiprocessing.Pool(processes)
+
+def _compute_merge_task(args):
+    return compute_merge(*args)
+
+def _get_labels(cursor, site, targets):
+    """Return the set of cached labels pointing to the given targets"""
+    labels = set()
+    for chunk in chunked(targets):
+        cursor.execute("""
+        SELECT label FROM docweb_labelcache
+        WHERE site_id = %%s AND target IN (%s)
+        """ % ", ".join(["%s"]*len(chunk)), [site.id] + chunk)
+        labels.update(row[0] for row in cursor.fetchall())
+    return labels
+
+def _rebuild_label_cache(cursor, site, db_timestamp):
+    """
+    Regenerate the label cache of docstring names and aliases of all
+    current docstrings of the site.
+
+    """
     LabelCache.clear(site=site)
     
-    from django.db import connection, transaction
-    cursor = connection.cursor()
-
     # -- Insert docstring names at once using raw SQL (fast!)
 
     # direct names
@@ -157,43 +510,163 @@ def _update_docstrings_from_xml(site, stream):
     SELECT d.name, d.name, d.name, %s
     FROM docweb_docstring AS d
     WHERE d.site_id = %s AND d.timestamp = %s
-    """, [site.id, site.id, timestamp])
+    """, [site.id, site.id, db_timestamp])
 
     # 1st dereference level (normal docstrings)
     cursor.execute(port_sql("""
-    INSERT INTO docweb_labelcache (label, target, title, site_id)
-    SELECT d.name || '.' || a.alias, a.target, a.alias, %s
+    SELECT d.name || '.' || a.alias, a.target, a.alias
     FROM docweb_docstring AS d
     LEFT JOIN docweb_docstringalias AS a
     ON d.name = a.parent_id
     WHERE d.name || '.' || a.alias != a.target AND d.type_ != 'dir'
           AND d.site_id = %s AND d.timestamp = %s
-    """), [site.id, site.id, timestamp])
+    """), [site.id, db_timestamp])
+    LabelCache.cache_many(site, cursor.fetchall())
     
     # 1st dereference level (for .rst pages; they can have only 1 level)
     cursor.execute(port_sql("""
-    INSERT INTO docweb_labelcache (label, target, title, site_id)
-    SELECT d.name || '/' || a.alias, a.target, a.alias, %s
+    SELECT d.name || '/' || a.alias, a.target, a.alias
     FROM docweb_docstring AS d
     LEFT JOIN docweb_docstringalias AS a
     ON d.name = a.parent_id
     WHERE d.name || '/' || a.alias != a.target AND d.type_ = 'dir'
           AND d.site_id = %s AND d.timestamp = %s
-    """), [site.id, site.id, timestamp])
+    """), [site.id, db_timestamp])
+    LabelCache.cache_many(site, cursor.fetchall())
 
-    # -- Raw SQL needs a manual flush
-    transaction.commit_unless_managed()
+def _refresh_label_cache(cursor, site, db_timestamp, targets):
+    """
+    Regenerate the label cache entries of docstring names and aliases
+    pointing to the given targets.
 
-    # -- Do the part of the work that's not possible using SQL only
-    for doc in Docstring.get_non_obsolete().filter(type_code='file').all():
-        LabelCache.cache_docstring_labels(doc)
-        ToctreeCache.cache_docstring(doc)
-        doc._update_title()
+    """
+    for chunk in chunked(targets):
+        in_ = ", ".join(["%s"]*len(chunk))
+
+        cursor.execute("""
+        DELETE FROM docweb_labelcache WHERE site_id = %%s AND target IN (%s)
+        """ % in_, [site.id] + chunk)
+
+        # direct names
+        cursor.execute("""
+        SELECT d.name, d.name, d.name
+        FROM docweb_docstring AS d
+        WHERE d.site_id = %%s AND d.timestamp = %%s AND d.name IN (%s)
+        """ % in_, [site.id, db_timestamp] + chunk)
+        LabelCache.cache_many(site, cursor.fetchall())
+
+        # 1st dereference level (normal docstrings)
+        cursor.execute(port_sql("""
+        SELECT d.name || '.' || a.alias, a.target, a.alias
+        FROM docweb_docstring AS d
+        LEFT JOIN docweb_docstringalias AS a
+        ON d.name = a.parent_id
+        WHERE d.name || '.' || a.alias != a.target AND d.type_ != 'dir'
+              AND d.site_id = %%s AND d.timestamp = %%s
+              AND a.target IN (%s)
+        """ % in_), [site.id, db_timestamp] + chunk)
+        LabelCache.cache_many(site, cursor.fetchall())
+
+        # 1st dereference level (for .rst pages)
+        cursor.execute(port_sql("""
+        SELECT d.name || '/' || a.alias, a.target, a.alias
+        FROM docweb_docstring AS d
+        LEFT JOIN docweb_docstringalias AS a
+        ON d.name = a.parent_id
+        WHERE d.name || '/' || a.alias != a.target AND d.type_ = 'dir'
+              AND d.site_id = %%s AND d.timestamp = %%s
+              AND a.target IN (%s)
+        """ % in_), [site.id, db_timestamp] + chunk)
+        LabelCache.cache_many(site, cursor.fetchall())
+
+def _cache_file_pages(cursor, site, db_timestamp, names=None):
+    """
+    Update the labels, toctree relations and titles of the current
+    'file' pages of the site, or of those among `names`.
 
-def update_docstrings(site):
+    The page texts are read in one query and parsed in memory; labels
+    are inserted after the docstring names and aliases, which take
+    precedence.
+
+    """
+    query = """
+    SELECT name, COALESCE(cur_text, source_doc), title
+    FROM docweb_docstring
+    WHERE site_id = %s AND timestamp = %s AND type_ = 'file'
+    """
+    rows = []
+    if names is None:
+        cursor.execute(query, [site.id, db_timestamp])
+        rows.extend(cursor.fetchall())
+    else:
+        for chunk in chunked(names):
+            cursor.execute(query + " AND name IN (%s)" % ", ".join(
+                ["%s"]*len(chunk)), [site.id, db_timestamp] + chunk)
+            rows.extend(cursor.fetchall())
+
+    index = DocstringNameIndex.get(site)
+    labels = []
+    toctree_rows = []
+    title_rows = []
+    for name, text, old_title in rows:
+        labels.extend((label, name, label)
+                      for label in LabelCache.parse_labels(text))
+        toctree_rows.extend((name, child) for child in
+                            ToctreeCache.resolve_children(name, text, index))
+        title = Docstring.parse_title(name, text)
+        if title != old_title:
+            title_rows.append((title, name))
+
+    LabelCache.cache_many(site, labels)
+
+    old_children = []
+    for chunk in chunked([row[0] for row in rows]):
+        in_ = ", ".join(["%s"]*len(chunk))
+        if names is not None:
+            cursor.execute("""
+            SELECT child_id FROM docweb_toctreecache WHERE parent_id IN (%s)
+            """ % in_, chunk)
+            old_children.extend(row[0] for row in cursor.fetchall())
+        cursor.execute("""
+        DELETE FROM docweb_toctreecache WHERE parent_id IN (%s)
+        """ % in_, chunk)
+    for chunk in chunked(toctree_rows):
+        cursor.executemany("""
+        INSERT INTO docweb_toctreecache (parent_id, child_id)
+        VALUES (%s, %s)
+        """, chunk)
+
+    if names is None:
+        ToctreeCache.update_ancestors(site)
+    else:
+        # only the pages listed by the changed pages may have moved
+        ToctreeCache.update_ancestors(
+            site, old_children + [child for _, child in toctree_rows])
+
+    for chunk in chunked(title_rows):
+        cursor.executemany("UPDATE docweb_docstring SET title = %s "
+                           "WHERE name = %s", chunk)
+
+def update_docstrings(site, incremental=False, merge_processes=1):
     """
     Update docstrings from sources.
 
+    See `update_docstrings_from_xml` for the meaning of `incremental`.
+
+    Parameters
+    ----------
+    merge_processes : int or None, optional
+        Number of worker processes computing the merges when a pull
+        changes many docstrings; None means one per CPU. The workers
+        are forked before the update starts, after closing the database
+        connection, so use this only in command-line pulls, outside
+        any transaction.
+
+    Returns
+    -------
+    timer : PhaseTimer
+        Time spent in each phase of the update.
+
     """
 
     base_xml_fn = base_xml_file_name(site)
@@ -205,11 +678,16 @@ def update_docstrings(site):
     finally:
         os.chdir(pwd)
     
+    pool = _create_merge_pool(merge_processes)
     f = open(base_xml_fn, 'rb')
     try:
-        update_docstrings_from_xml(site, f)
+        return update_docstrings_from_xml(site, f, incremental=incremental,
+                                          merge_pool=pool)
     finally:
         f.close()
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 def base_xml_file_name(site):
     base_part = re.sub('[^a-z]', '', site.domain)
@@ -229,11 +707,8 @@ def import_docstring_revisions_from_xml(stream):
         raise MalformedPydocXML(str(e) + "\n\n" +  msg)
 
 def _import_docstring_revisions_from_xml(stream):
-    tree = etree.parse(stream)
-    root = tree.getroot()
-    for el in root:
-        if el.tag not in ('module', 'class', 'callable', 'object'): continue
-
+    for el in _iter_xml_elements(stream, ('module', 'class', 'callable',
+                                          'object')):
         try:
             doc = Docstring.on_site.get(name=el.attrib['id'])
         except Docstring.DoesNotExist:
@@ -250,44 +725,102 @@ def dump_docs_as_xml(stream, revs=None, only_text=False):
     Write an XML dump containing the given docstrings to the given stream.
     
     """
+    for chunk in iter_docs_as_xml(revs, only_text=only_text):
+        stream.write(chunk)
+
+# Number of docstrings fetched at a time when dumping
+_DUMP_BATCH_SIZE = 500
+
+def iter_docs_as_xml(revs=None, only_text=False):
+    """
+    Generate an XML dump of the given docstrings piece by piece.
+
+    Parameters
+    ----------
+    revs : iterable of Docstring or DocstringRevision, optional
+        Items to dump. Default: all non-obsolete docstrings, fetched
+        in batches so that memory use does not grow with site size.
+    only_text : bool, optional
+        Whether to omit everything but names, file names and texts.
+
+    Yields
+    ------
+    chunk : str
+        Next piece of the XML document.
+
+    """
+    yield '<?xml version="1.0" encoding="utf-8"?><pydoc>'
     if revs is None:
-        revs = Docstring.get_non_obsolete()
-    
-    new_root = etree.Element('pydoc')
-    new_xml = etree.ElementTree(new_root)
-    for rev in revs:
+        batches = _iter_non_obsolete_batches()
+    else:
+        batches = chunked(revs, _DUMP_BATCH_SIZE)
+
+    for batch in batches:
+        if only_text:
+            contents = {}
+        else:
+            contents = _get_batch_contents(batch)
+
+        for rev in batch:
+            if isinstance(rev, Docstring):
+                doc = rev
+                text = doc.text
+            else:
+                doc = rev.docstring
+                text = rev.text
+
+            el = etree.Element(doc.type_code)
+            el.attrib['id'] = doc.name
+            el.text = text.encode('utf-8').encode('string-escape')
+
+            if doc.file_name:
+                el.attrib['file'] = doc.file_name
+
+            if not only_text:
+                if doc.argspec:
+                    el.attrib['argspec'] = doc.argspec
+                if doc.objclass:
+                    el.attrib['objclass'] = doc.objclass
+                if doc.type_name:
+                    el.attrib['type'] = doc.type_name
+                if doc.line_number:
+                    el.attrib['line'] = str(doc.line_number)
+                if doc.bases:
+                    for b in doc.bases.split():
+                        etree.SubElement(el, 'base', dict(ref=b))
+                for alias, target in contents.get(doc.name, []):
+                    etree.SubElement(el, 'ref', dict(name=alias, ref=target))
+
+            yield etree.tostring(el)
+    yield '</pydoc>'
+
+def _iter_non_obsolete_batches():
+    docs = Docstring.get_non_obsolete().order_by('name')
+    last_name = None
+    while True:
+        if last_name is None:
+            batch = list(docs[:_DUMP_BATCH_SIZE])
+        else:
+            batch = list(docs.filter(name__gt=last_name)[:_DUMP_BATCH_SIZE])
+        if not batch:
+            break
+        yield batch
+        last_name = batch[-1].name
+
+def _get_batch_contents(batch):
+    """Fetch the aliases of a batch of Docstrings/DocstringRevisions"""
+    names = []
+    for rev in batch:
         if isinstance(rev, Docstring):
-            doc = rev
-            text = doc.text
+            names.append(rev.name)
         else:
-            doc = rev.docstring
-            text = rev.text
-        
-        el = etree.SubElement(new_root, doc.type_code)
-        el.attrib['id'] = rev.name
-        el.text = text.encode('utf-8').encode('string-escape')
-
-        if doc.file_name:
-            el.attrib['file'] = doc.file_name
-
-        if only_text: continue
-        
-        if doc.argspec:
-            el.attrib['argspec'] = doc.argspec
-        if doc.objclass:
-            el.attrib['objclass'] = doc.objclass
-        if doc.type_name:
-            el.attrib['type'] = doc.type_name
-        if doc.line_number:
-            el.attrib['line'] = str(doc.line_number)
-        if doc.bases:
-            for b in doc.bases.split():
-                etree.SubElement(el, 'base', dict(ref=b))
-        for c in doc.contents.all():
-            etree.SubElement(el, 'ref', dict(name=c.alias, ref=c.target))
-    
-    stream.write('<?xml version="1.0" encoding="utf-8"?>')
-    new_xml.write(stream)
+            names.append(rev.docstring_id)
+    contents = {}
+    aliases = DocstringAlias.objects.filter(parent__in=names).order_by('id')
+    for parent, alias, target in aliases.values_list('parent', 'alias',
+                                                     'target'):
+        contents.setdefault(parent, []).append((alias, target))
+    return contents
 
 def patch_against_source(site, revs=None):
     """
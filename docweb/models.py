@@ -1,4 +1,4 @@
-import datetime, cgi, os, tempfile, re
+import datetime, cgi, os, tempfile, re, math
 
 from django.db import models
 from django.db import transaction
@@ -8,7 +8,8 @@ from django.contrib.auth.models import User, Group
 from django.contrib.sites.models import Site
 from django.contrib.sites.managers import CurrentSiteManager
 
-from pydocweb.docweb.utils import strip_spurious_whitespace, merge_3way
+from pydocweb.docweb.utils import (strip_spurious_whitespace, merge_3way,
+                                   chunked, count_words_changed, PhaseTimer)
 
 MAX_NAME_LEN = 256
 
@@ -29,6 +30,14 @@ MERGE_NONE = 0
 MERGE_MERGE = 1
 MERGE_CONFLICT = 2
 
+# Review status of a docstring after its text is edited
+EDITED_REVIEW_CODES = {
+    REVIEW_NEEDS_EDITING: REVIEW_BEING_WRITTEN,
+    REVIEW_NEEDS_WORK: REVIEW_REVISED,
+    REVIEW_NEEDS_PROOF: REVIEW_REVISED,
+    REVIEW_PROOFED: REVIEW_REVISED
+}
+
 REVIEW_STATUS_NAMES = {
     -1: 'Unimportant',
     0: 'Needs editing',
@@ -105,10 +114,23 @@ class Docstring(models.Model):
                                       help_text="Line number in source file")
     timestamp   = models.DateTimeField(default=datetime.datetime.now,
                                        help_text="Time of last VCS pull")
+    source_hash = models.CharField(max_length=32, null=True,
+                                   help_text="Fingerprint of VCS data in last pull")
 
     title       = models.CharField(max_length=MAX_NAME_LEN, null=True,
                                    help_text="Title of the page (if present)")
 
+    # Denormalized copy of the latest DocstringRevision; NULL cur_revno
+    # means there are no revisions, and the VCS docstring is current.
+    cur_revno   = models.IntegerField(null=True,
+                                      help_text="Number of the latest revision")
+    cur_text    = models.TextField(null=True,
+                                   help_text="Text of the latest revision")
+    cur_review_code = models.IntegerField(null=True, db_column="cur_review",
+                                          help_text="Review status of the latest revision")
+    cur_ok_to_apply = models.BooleanField(default=False,
+                                          help_text="OK to apply flag of the latest revision")
+
     # contents  = [DocstringAlias...]
     # revisions = [DocstringRevision...]
     # comments  = [ReviewComment...]
@@ -127,91 +149,139 @@ class Docstring(models.Model):
     class MergeConflict(RuntimeError): pass
 
     def _get_review(self):
-        try:
-            return self.revisions.all()[0].review_code
-        except IndexError:
+        if self.cur_revno is None:
             return self.review_code
+        return self.cur_review_code
 
     def _set_review(self, value):
-        try:
-            last_rev = self.revisions.all()[0]
-            last_rev.review_code = value
-            if value in (REVIEW_PROOFED, REVIEW_NEEDS_PROOF):
-                last_rev.ok_to_apply = True
-            last_rev.save()
-        except IndexError:
+        if value != self.review:
+            # pages showing the review status of this one
+            RenderCache.invalidate_dependents(self.site, [self.name])
+        if self.cur_revno is None:
             self.review_code = value
+            return
+        ok_to_apply = self.cur_ok_to_apply
+        if value in (REVIEW_PROOFED, REVIEW_NEEDS_PROOF):
+            ok_to_apply = True
+        DocstringRevision.objects.filter(revno=self.cur_revno).update(
+            review_code=value, ok_to_apply=ok_to_apply)
+        Docstring.objects.filter(name=self.name).update(
+            cur_review_code=value, cur_ok_to_apply=ok_to_apply)
+        old_value = self.cur_review_code
+        self.cur_review_code = value
+        self.cur_ok_to_apply = ok_to_apply
+        update_weekly_review(self.site, self.name, self.cur_revno,
+                             old_value, value)
 
     review = property(_get_review, _set_review)
 
     def _get_ok_to_apply(self):
-        try:
-            return self.revisions.all()[0].ok_to_apply
-        except IndexError:
+        if self.cur_revno is None:
             # no revisions: OK to apply, since it's a no-op
             return True
+        return self.cur_ok_to_apply
 
     def _set_ok_to_apply(self, value):
-        try:
-            last_rev = self.revisions.all()[0]
-            last_rev.ok_to_apply = value
-            last_rev.save()
-        except IndexError:
-            pass
+        if self.cur_revno is None:
+            return
+        DocstringRevision.objects.filter(revno=self.cur_revno).update(
+            ok_to_apply=value)
+        Docstring.objects.filter(name=self.name).update(
+            cur_ok_to_apply=value)
+        self.cur_ok_to_apply = value
 
     ok_to_apply = property(_get_ok_to_apply, _set_ok_to_apply)
 
+    def _set_current_revision(self, rev):
+        """
+        Update the denormalized latest-revision fields from `rev`.
+        Does not save the docstring.
+
+        """
+        self.cur_revno = rev.revno
+        self.cur_text = rev.text
+        self.cur_review_code = rev.review_code
+        self.cur_ok_to_apply = rev.ok_to_apply
+
     # --
 
     @property
     def is_obsolete(self):
-        return (self.timestamp != Docstring.get_current_timestamp())
+        return (self.timestamp != Docstring.get_current_timestamp(self.site))
 
     @classmethod
-    def get_current_timestamp(self):
-        return Docstring.on_site.order_by('-timestamp')[0].timestamp
+    def get_current_timestamp(cls, site=None):
+        """
+        Return the timestamp of the latest pull, which non-obsolete
+        docstrings carry, or None if there are no docstrings.
+
+        """
+        if site is None:
+            site = Site.objects.get_current()
+        return PullMetadata.get_timestamp(site)
 
     @property
     def child_objects(self):
-        return self._get_contents('object')
+        return self.get_children().get('object', [])
 
     @property
     def child_callables(self):
-        return self._get_contents('callable')
+        return self.get_children().get('callable', [])
 
     @property
     def child_modules(self):
-        return self._get_contents('module')
+        return self.get_children().get('module', [])
 
     @property
     def child_classes(self):
-        return self._get_contents('class')
+        return self.get_children().get('class', [])
 
     @property
     def child_dirs(self):
-        return self._get_contents('dir')
+        return self.get_children().get('dir', [])
 
     @property
     def child_files(self):
-        return self._get_contents('file')
+        return self.get_children().get('file', [])
+
+    def get_children(self):
+        """
+        Return the children of the docstring grouped by type, fetched
+        with a single query.
+
+        Returns
+        -------
+        children : dict of str => list of DocstringAlias
+            Aliases of the docstring, by the type code of their
+            target, sorted by alias. The aliases have the additional
+            attributes `direct_child` and `status_code` (review status
+            of the target).
+
+        """
+        if getattr(self, '_children', None) is not None:
+            return self._children
 
-    def _get_contents(self, type_code, site=None):
-        if site is None:
-            site = Site.objects.get_current()
         from django.db import connection
         cursor = connection.cursor()
-        cursor.execute("""\
-        SELECT a.alias FROM docweb_docstringalias AS a, docweb_docstring AS d
-        WHERE d.name = a.target AND a.parent_id = %s AND d.type_ = %s""",
-        [self.name, type_code])
-        names = [n[0] for n in cursor.fetchall()]
-        objs = DocstringAlias.objects.filter(parent=self,
-                                             parent__site=site,
-                                             alias__in=names)
-        objs = list(objs)
-        for obj in objs:
-            obj.direct_child = obj.target and obj.target.startswith(self.name)
-        return objs
+        cursor.execute("""
+        SELECT a.id, a.alias, a.target, d.type_,
+               COALESCE(d.cur_review, d.review)
+        FROM docweb_docstringalias AS a, docweb_docstring AS d
+        WHERE d.name = a.target AND a.parent_id = %s AND d.site_id = %s
+        """, [self.name, self.site_id])
+
+        children = {}
+        for alias_id, alias, target, type_code, review_code in \
+                cursor.fetchall():
+            obj = DocstringAlias(id=alias_id, parent=self, alias=alias,
+                                 target=target)
+            obj.direct_child = target.startswith(self.name)
+            obj.status_code = REVIEW_STATUS_CODES[review_code]
+            children.setdefault(type_code, []).append(obj)
+        for items in children.values():
+            items.sort(key=lambda obj: obj.alias)
+        self._children = children
+        return children
 
     def edit(self, new_text, author, comment):
         """
@@ -225,7 +295,13 @@ class Docstring(models.Model):
         Docstring.MergeConflict
             If the new text still contains conflict markers.
 
+        Returns
+        -------
+        timer : PhaseTimer
+            Time spent in each step of the edit.
+
         """
+        timer = PhaseTimer()
         new_text = strip_spurious_whitespace(new_text)
 
         if self.type_code == 'dir':
@@ -234,35 +310,34 @@ class Docstring(models.Model):
         if ('<<<<<<' in new_text or '>>>>>>' in new_text):
             raise RuntimeError('New text still contains merge conflict markers')
 
+        old_text = self.text
+        changed = (new_text != old_text)
+
         # assume any merge was OK
         self.merge_status = MERGE_NONE
         self.base_doc = self.source_doc
-        self.save()
 
         # Update dirtiness
         self.dirty = (self.source_doc != new_text)
 
         # Editing 'file' docstrings can resurrect them from obsoletion,
         # or hide them (ie. remove their connection to their parent 'dir')
+        revived = hidden = False
         if self.type_code == 'file' and new_text and self.is_obsolete:
             # make not obsolete
             self.timestamp = Docstring.get_current_timestamp()
-            self.save()
-            self._add_to_parent()
+            revived = True
         elif self.type_code == 'file' and not new_text:
             # hide
             self._remove_aliases()
+            hidden = True
+        timer.mark('prepare')
 
         # Add a revision (if necessary)
-        if new_text != self.text:
-            new_review_code = {
-                REVIEW_NEEDS_EDITING: REVIEW_BEING_WRITTEN,
-                REVIEW_NEEDS_WORK: REVIEW_REVISED,
-                REVIEW_NEEDS_PROOF: REVIEW_REVISED,
-                REVIEW_PROOFED: REVIEW_REVISED
-            }.get(self.review, self.review)
-
-            if self.revisions.count() == 0:
+        if changed:
+            new_review_code = EDITED_REVIEW_CODES.get(self.review, self.review)
+
+            if self.cur_revno is None:
                 # Store the VCS revision the initial edit was based on,
                 # for making statistics later on.
                 base_rev = DocstringRevision(docstring=self,
@@ -280,15 +355,59 @@ class Docstring(models.Model):
                                     comment=comment,
                                     review_code=new_review_code,
                                     ok_to_apply=False)
+            rev.words_changed = count_words_changed(old_text, new_text)
             rev.save()
+            self._set_current_revision(rev)
+            timer.mark('revision')
 
         # Save
+        if changed:
+            self._update_title(save=False)
         self.save()
+        if revived:
+            self._add_to_parent()
+        timer.mark('save')
 
-        # Update cross-reference and toctree caches
-        LabelCache.cache_docstring(self)
-        ToctreeCache.cache_docstring(self)
-        self._update_title()
+        if changed:
+            update_weekly_stats(self.site, rev.timestamp)
+            timer.mark('statistics')
+
+            SearchIndex.index_docstrings(self.site, [self.name])
+            timer.mark('search index')
+
+        # Update cross-reference and toctree caches, which depend only
+        # on the aliases and labels and toctrees in 'file' pages
+        if revived or hidden or (changed and
+                                 self._get_cache_signature(old_text) !=
+                                 self._get_cache_signature(new_text)):
+            LabelCache.cache_docstring(self)
+            ToctreeCache.cache_docstring(self)
+            timer.mark('label and toctree cache')
+
+        # Pages showing the title, text or review status of this page
+        # need to be re-rendered
+        if changed:
+            RenderCache.invalidate_dependents(self.site, [self.name])
+            timer.mark('render cache')
+
+        return timer
+
+    def _get_cache_signature(self, text):
+        """
+        Return the parts of `text` the label and toctree caches
+        depend on.
+
+        """
+        if self.type_code != 'file':
+            return None
+        return (LabelCache._label_re.findall(text),
+                LabelCache._directive_re.findall(text),
+                ToctreeCache._parse_toctree_autosummary(text))
+
+    def _get_labels(self):
+        """Return the set of cross-reference labels pointing to this page"""
+        return set(LabelCache.objects.filter(target=self.name).values_list(
+            'label', flat=True))
 
     def _add_to_parent(self):
         """
@@ -306,7 +425,7 @@ class Docstring(models.Model):
         parent_name = '/'.join(self.name.split('/')[:-1])
         try:
             parent = Docstring.on_site.get(name=parent_name)
-            parent.timestamp = Docstring.get_current_timestamp()
+            parent.timestamp = Docstring.get_current_timestamp(self.site)
             parent.save()
             parent._add_to_parent()
             try:
@@ -335,7 +454,7 @@ class Docstring(models.Model):
     _title_re = re.compile(r'^.*?\s*([#*=]{4,}\n)?(?P<title>[a-zA-Z0-9][^\n]+)\n[#*=]{4,}\s*',
                            re.I|re.S)
 
-    def _update_title(self):
+    def _update_title(self, save=True):
         """
         Update the 'title' field.
 
@@ -346,12 +465,17 @@ class Docstring(models.Model):
         if self.type_code != 'file':
             return
 
-        m = self._title_re.match(self.text)
+        self.title = self.parse_title(self.name, self.text)
+        if save:
+            self.save()
+
+    @classmethod
+    def parse_title(cls, name, text):
+        """Return the title of a 'file' page with the given name and text"""
+        m = cls._title_re.match(text)
         if m:
-            self.title = m.groupdict()['title'].strip()
-        else:
-            self.title = self.name
-        self.save()
+            return m.groupdict()['title'].strip()
+        return name
 
     def get_merge(self):
         """
@@ -364,37 +488,12 @@ class Docstring(models.Model):
             None if no merge is needed, else return the merge result.
 
         """
-        if self.base_doc == self.source_doc:
-            # Nothing to merge
-            if self.merge_status != MERGE_NONE:
-                self.merge_status = MERGE_NONE
-                self.save()
-            return None
-
-        if self.revisions.count() == 0:
-            # No local edits
-            self.merge_status = MERGE_NONE
-            self.base_doc = self.source_doc
-            self.save()
-            return None
-
-        if self.text == self.source_doc:
-            # Local text agrees with VCS source, no merge needed
-            self.merge_status = MERGE_NONE
-            self.base_doc = self.source_doc
+        merge_status, base_doc, result = compute_merge(
+            self.text, self.base_doc, self.source_doc, self.cur_revno)
+        if (merge_status, base_doc) != (self.merge_status, self.base_doc):
+            self.merge_status = merge_status
+            self.base_doc = base_doc
             self.save()
-            return None
-
-        result, conflicts = merge_3way(
-            strip_spurious_whitespace(self.text) + "\n",
-            strip_spurious_whitespace(self.base_doc) + "\n",
-            strip_spurious_whitespace(self.source_doc) + "\n")
-        result = strip_spurious_whitespace(result)
-        if not conflicts:
-            self.merge_status = MERGE_MERGE
-        else:
-            self.merge_status = MERGE_CONFLICT
-        self.save()
         return result
 
     def automatic_merge(self, author):
@@ -406,6 +505,117 @@ class Docstring(models.Model):
             if self.merge_status == MERGE_MERGE:
                 self.edit(result, author, 'Merged')
 
+    @classmethod
+    @transaction.commit_on_success
+    def accept_merges(cls, site, names, author):
+        """
+        Perform the automatic merges of the given docstrings in bulk.
+
+        Equivalent to `automatic_merge` on each of them, except that the
+        new revisions are inserted in one batch and the caches refreshed
+        once at the end.
+
+        Returns
+        -------
+        errors : list of str
+            Messages for docstrings that could not be merged.
+
+        """
+        from django.db import connection
+        cursor = connection.cursor()
+
+        rows = []
+        for chunk in chunked(list(names)):
+            cursor.execute("""
+            SELECT name, type_, COALESCE(cur_text, source_doc), base_doc,
+                   source_doc, cur_revno, COALESCE(cur_review, review)
+            FROM docweb_docstring
+            WHERE site_id = %%s AND merge_status = %%s AND name IN (%s)
+            """ % ", ".join(["%s"]*len(chunk)),
+            [site.id, MERGE_MERGE] + chunk)
+            rows.extend(cursor.fetchall())
+
+        timestamp = datetime.datetime.now()
+        db_timestamp = connection.ops.value_to_db_datetime(timestamp)
+
+        errors = []
+        file_names = []
+        status_rows = []
+        revision_rows = []
+        edited = {}
+
+        for name, type_code, text, base_doc, source_doc, cur_revno, \
+                review_code in rows:
+            if type_code == 'file':
+                # editing these can revive or hide them: do it one by one
+                file_names.append(name)
+                continue
+
+            merge_status, base_doc, result = compute_merge(
+                text, base_doc, source_doc, cur_revno)
+            if merge_status != MERGE_MERGE:
+                status_rows.append((merge_status, base_doc, name))
+                continue
+            if type_code == 'dir':
+                errors.append("%s: 'dir' docstrings cannot be edited" % name)
+                continue
+
+            new_text = strip_spurious_whitespace(result)
+            status_rows.append((MERGE_NONE, source_doc, name))
+            if new_text != text:
+                new_review_code = EDITED_REVIEW_CODES.get(review_code,
+                                                          review_code)
+                edited[name] = (new_text, new_review_code)
+                revision_rows.append(
+                    (name, new_text, author, 'Merged', db_timestamp,
+                     new_review_code, False,
+                     count_words_changed(text, new_text)))
+
+        for chunk in chunked(revision_rows):
+            cursor.executemany("""
+            INSERT INTO docweb_docstringrevision
+            (docstring_id, text, author, comment, timestamp, review,
+             ok_to_apply, words_changed)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)""", chunk)
+
+        current_rows = []
+        for chunk in chunked(edited.keys()):
+            cursor.execute("""
+            SELECT docstring_id, MAX(revno) FROM docweb_docstringrevision
+            WHERE docstring_id IN (%s) GROUP BY docstring_id
+            """ % ", ".join(["%s"]*len(chunk)), chunk)
+            for name, revno in cursor.fetchall():
+                new_text, new_review_code = edited[name]
+                current_rows.append((revno, new_text, new_review_code,
+                                     False, name))
+
+        for chunk in chunked(status_rows):
+            cursor.executemany("""
+            UPDATE docweb_docstring SET merge_status = %s, base_doc = %s,
+                   dirty = (source_doc != COALESCE(cur_text, source_doc))
+            WHERE name = %s""", chunk)
+        for chunk in chunked(current_rows):
+            cursor.executemany("""
+            UPDATE docweb_docstring SET cur_revno = %s, cur_text = %s,
+                   cur_review = %s, cur_ok_to_apply = %s,
+                   dirty = (source_doc != cur_text)
+            WHERE name = %s""", chunk)
+
+        # -- Refresh caches once
+
+        if edited:
+            SearchIndex.index_docstrings(site, edited.keys())
+            RenderCache.invalidate_dependents(site, edited.keys())
+            update_weekly_stats(site, timestamp)
+
+        for doc in cls.objects.filter(site=site, name__in=file_names):
+            try:
+                doc.automatic_merge(author)
+            except RuntimeError, e:
+                errors.append("%s: %s" % (doc.name, str(e)))
+
+        return errors
+
     def get_rev_text(self, revno):
         """Get text in given revision of the docstring.
 
@@ -441,10 +651,9 @@ class Docstring(models.Model):
     @property
     def text(self):
         """Return the current text in the docstring, latest revision or VCS"""
-        try:
-            return self.revisions.all()[0].text
-        except IndexError:
+        if self.cur_revno is None:
             return self.source_doc
+        return self.cur_text
 
     @classmethod
     def resolve(cls, name):
@@ -460,42 +669,11 @@ class Docstring(models.Model):
             If not found
 
         """
-        def _get(name):
-            try: return cls.on_site.get(name=name)
-            except cls.DoesNotExist: return None
-
-        if '/' in name:
-            sep = '/'
-        else:
-            sep = '.'
-
-        doc = _get(name)
-        if doc is not None: return doc
-
-        parts = name.split(sep)
-        parent = None
-        seen = {}
-        j = 0
-        while j < len(parts):
-            try_name = sep.join(parts[:j+1])
-            if try_name in seen:
-                # infinite loop: break it
-                parts = name.split(sep)
-                break
-            seen[try_name] = True
-            doc = _get(try_name)
-            if doc is not None:
-                parent = doc
-            elif parent is not None:
-                try:
-                    ref = parent.contents.get(alias=parts[j])
-                    target_parts = ref.target.split(sep)
-                    parts = target_parts + parts[(j+1):]
-                    j = len(target_parts)
-                except DocstringAlias.DoesNotExist:
-                    parent = None
-            j += 1
-        return cls.on_site.get(name=sep.join(parts))
+        site = Site.objects.get_current()
+        real_name = DocstringNameIndex.get(site).resolve(name)
+        if real_name is None:
+            raise cls.DoesNotExist()
+        return cls.on_site.get(name=real_name)
 
     def __str__(self):
         return "%s" % self.name
@@ -503,47 +681,73 @@ class Docstring(models.Model):
     @classmethod
     def fulltext_search(cls, s, invert=False, obj_type=None):
         """
-        Fulltext search using an SQL LIKE clause
+        Fulltext search of current docstring texts and names.
+
+        See `SearchIndex.search` for the query syntax.
 
         Returns
         -------
-        it : iterator
-            Iterator of matching docstring names
+        results : list of (name, score)
+            Matching docstrings, best matches first.
 
         """
-        site_id = Site.objects.get_current().id
-        if invert:
-            not_ = "NOT"
-        else:
-            not_ = ""
+        site = Site.objects.get_current()
+        docs = cls.on_site.all()
         if obj_type in ('module', 'class', 'callable', 'object'):
-            where_ = "type_ = '%s' AND" % obj_type
+            docs = docs.filter(type_code=obj_type)
+        else:
+            obj_type = None
+
+        if s.strip():
+            results = SearchIndex.search(site, SearchIndex.DOCSTRING, s,
+                                         total=docs.count())
         else:
-            where_ = ""
+            # docstrings with no text
+            from django.db import connection
+            cursor = connection.cursor()
+            cursor.execute("""
+            SELECT name FROM docweb_docstring
+            WHERE site_id = %s AND COALESCE(cur_text, source_doc) = ''
+            """, [site.id])
+            results = [(name, 0) for name, in cursor.fetchall()]
+            results.sort()
+
+        names = None
+        if obj_type is not None or invert:
+            names = set(docs.values_list('name', flat=True))
+        if obj_type is not None:
+            results = [r for r in results if r[0] in names]
+        if invert:
+            names.difference_update(r[0] for r in results)
+            results = [(name, 0) for name in sorted(names)]
+        return results
+
+    @classmethod
+    def get_review_index(cls, site=None):
+        """
+        Return the name, type code and current review code of all
+        non-obsolete docstrings of the site, in a single query.
+
+        Returns
+        -------
+        rows : list of (name, type_code, review_code)
+
+        """
+        if site is None:
+            site = Site.objects.get_current()
         from django.db import connection
         cursor = connection.cursor()
-        cursor.execute("""\
-        SELECT d.name FROM docweb_docstring AS d
-        LEFT JOIN docweb_docstringrevision AS r ON d.name = r.docstring_id
-        WHERE %s %s (d.name LIKE %%s OR r.text LIKE %%s)
-        AND d.site_id = %%s
-        GROUP BY d.name
-        """ % (where_, not_,), [s, s, site_id])
-        res =  cursor.fetchall()
-        cursor.execute("""\
-        SELECT name FROM docweb_docstring
-        WHERE name NOT IN (SELECT DISTINCT docstring_id FROM docweb_docstringrevision)
-        AND %s %s (name LIKE %%s OR source_doc LIKE %%s) AND site_id = %%s
-
-        """ % (where_, not_,), [s, s, site_id])
-        return res + cursor.fetchall()
+        cursor.execute("""
+        SELECT name, type_, COALESCE(cur_review, review)
+        FROM docweb_docstring
+        WHERE site_id = %s AND timestamp = %s
+        """, [site.id, cls.get_current_timestamp(site)])
+        return cursor.fetchall()
 
     @classmethod
     def get_non_obsolete(cls):
-        site = Site.objects.get_current()
-        try:
-            timestamp = Docstring.on_site.order_by('-timestamp')[0].timestamp
-        except IndexError:
+        timestamp = cls.get_current_timestamp()
+        if timestamp is None:
             # no docstrings
             return cls.on_site.all()
         return cls.on_site.filter(timestamp=timestamp)
@@ -605,6 +809,9 @@ class DocstringRevision(models.Model):
                                       help_text="Review status")
     ok_to_apply = models.BooleanField(
         default=False, help_text="Reviewer deemed suitable for inclusion")
+    words_changed = models.FloatField(
+        null=True, help_text="Words changed relative to the previous "
+                             "revision (NULL for the first one)")
 
     # comments = [ReviewComment...]
 
@@ -612,12 +819,269 @@ class DocstringRevision(models.Model):
         get_latest_by = "timestamp"
         ordering = ['-revno']
 
+def compute_merge(text, base_doc, source_doc, cur_revno):
+    """
+    Compute the 3-way merge of a docstring's latest text with changes
+    in VCS.
+
+    Parameters
+    ----------
+    text : str
+        Current text of the docstring
+    base_doc, source_doc : str
+        VCS text the latest revision was based on, and the current one
+    cur_revno : {int, None}
+        Number of the latest revision, None if there are no revisions
+
+    Returns
+    -------
+    merge_status : int
+        New merge status
+    base_doc : str
+        New base text
+    result : {None, str}
+        None if no merge is needed, else the merge result.
+
+    """
+    if base_doc == source_doc:
+        # Nothing to merge
+        return MERGE_NONE, base_doc, None
+
+    if cur_revno is None or text == source_doc:
+        # No local edits, or local text agrees with VCS source
+        return MERGE_NONE, source_doc, None
+
+    result, conflicts = merge_3way(
+        strip_spurious_whitespace(text) + "\n",
+        strip_spurious_whitespace(base_doc) + "\n",
+        strip_spurious_whitespace(source_doc) + "\n")
+    result = strip_spurious_whitespace(result)
+    if not conflicts:
+        return MERGE_MERGE, base_doc, result
+    else:
+        return MERGE_CONFLICT, base_doc, result
+
 class DocstringAlias(models.Model):
     parent = models.ForeignKey(Docstring, related_name="contents")
     target = models.CharField(max_length=MAX_NAME_LEN, null=True)
     alias = models.CharField(max_length=MAX_NAME_LEN)
 
 
+
+# -- Pull metadata
+
+class PullMetadata(models.Model):
+    """
+    Timestamp of the latest pull of a site.
+
+    Docstrings present in the latest pull carry its timestamp; the
+    others are obsolete. The row also holds the generation token of
+    the site's `DocstringNameIndex`. Both are cached in each process
+    for the duration of a request.
+
+    """
+    site = models.ForeignKey(Site, unique=True)
+    timestamp = models.DateTimeField()
+    names_token = models.CharField(max_length=64, null=True)
+
+    _cache = {}
+
+    @classmethod
+    def _get(cls, site):
+        """Return (timestamp, names_token) of the site"""
+        try:
+            return cls._cache[site.id]
+        except KeyError:
+            pass
+
+        try:
+            info = cls.objects.get(site=site)
+            value = (info.timestamp, info.names_token)
+        except cls.DoesNotExist:
+            # Not pulled since the table was added
+            try:
+                timestamp = Docstring.objects.filter(site=site).order_by(
+                    '-timestamp').values_list('timestamp', flat=True)[0]
+            except IndexError:
+                # no docstrings
+                timestamp = None
+            value = (timestamp, None)
+
+        cls._cache[site.id] = value
+        return value
+
+    @classmethod
+    def get_timestamp(cls, site):
+        """Return the timestamp of the latest pull, or None"""
+        return cls._get(site)[0]
+
+    @classmethod
+    def get_names_token(cls, site):
+        """Return the generation token of the name index, or None"""
+        return cls._get(site)[1]
+
+    @classmethod
+    def set_names_token(cls, site, token):
+        """
+        Store a new generation token of the name index of the site.
+
+        Returns the token, or None if the site has no docstrings and
+        hence nothing to store it with.
+
+        """
+        from django.db import connection, transaction
+        cursor = connection.cursor()
+        cursor.execute("UPDATE docweb_pullmetadata SET names_token = %s "
+                       "WHERE site_id = %s", [token, site.id])
+        if cursor.rowcount == 0:
+            timestamp = cls.get_timestamp(site)
+            if timestamp is None:
+                return None
+            cursor.execute("""
+            INSERT INTO docweb_pullmetadata (site_id, timestamp, names_token)
+            VALUES (%s, %s, %s)
+            """, [site.id, connection.ops.value_to_db_datetime(timestamp),
+                  token])
+        transaction.commit_unless_managed()
+        cls._cache.pop(site.id, None)
+        return token
+
+    @classmethod
+    def set_timestamp(cls, site, timestamp):
+        """Record the timestamp of a new pull"""
+        info, created = cls.objects.get_or_create(
+            site=site, defaults=dict(timestamp=timestamp))
+        if not created:
+            info.timestamp = timestamp
+            info.save()
+        # re-read, as the database may store it with less precision
+        cls._cache.pop(site.id, None)
+
+    @classmethod
+    def clear_cache(cls):
+        cls._cache.clear()
+
+def _clear_pull_metadata_cache(sender, raw=False, **kw):
+    PullMetadata.clear_cache()
+
+def _clear_pull_metadata_cache_raw(sender, raw=False, **kw):
+    if raw:
+        # Docstrings loaded from fixtures bypass the pull
+        PullMetadata.clear_cache()
+
+from django.core.signals import request_started
+request_started.connect(_clear_pull_metadata_cache)
+models.signals.post_save.connect(_clear_pull_metadata_cache_raw,
+                                 sender=Docstring)
+
+
+# -- In-memory index for resolving docstring names
+
+class DocstringNameIndex(object):
+    """
+    Docstring names and aliases of a site, for resolving references
+    without database access.
+
+    One index per site is kept in each process. The indices are
+    reloaded when the generation token stored in `PullMetadata`
+    changes, which happens via `invalidate` whenever docstrings or
+    aliases are added or removed.
+
+    """
+    _indexes = {}
+
+    def __init__(self, site):
+        self.names = set(Docstring.objects.filter(site=site).values_list(
+            'name', flat=True))
+        self.aliases = {}
+        for parent, alias, target in DocstringAlias.objects.filter(
+                parent__site=site).values_list('parent', 'alias', 'target'):
+            if target is not None:
+                self.aliases.setdefault(parent, {}).setdefault(alias, target)
+
+    @classmethod
+    def get(cls, site):
+        """Return an up-to-date index for the given site"""
+        token = PullMetadata.get_names_token(site)
+        if token is None:
+            token = cls.invalidate(site)
+        entry = cls._indexes.get(site.id)
+        if entry is None or token is None or entry[0] != token:
+            entry = (token, cls(site))
+            cls._indexes[site.id] = entry
+        return entry[1]
+
+    @classmethod
+    def invalidate(cls, site):
+        """Make all processes reload their index of the site"""
+        token = '%s-%d' % (datetime.datetime.now().isoformat(), os.getpid())
+        return PullMetadata.set_names_token(site, token)
+
+    def resolve(self, name):
+        """
+        Resolve a docstring reference, following aliases of parent
+        docstrings. Returns the canonical name, or None if not found.
+
+        """
+        if name in self.names:
+            return name
+
+        if '/' in name:
+            sep = '/'
+        else:
+            sep = '.'
+
+        parts = name.split(sep)
+        parent = None
+        seen = {}
+        j = 0
+        while j < len(parts):
+            try_name = sep.join(parts[:j+1])
+            if try_name in seen:
+                # infinite loop: break it
+                parts = name.split(sep)
+                break
+            seen[try_name] = True
+            if try_name in self.names:
+                parent = try_name
+            elif parent is not None:
+                target = self.aliases.get(parent, {}).get(parts[j])
+                if target is not None:
+                    target_parts = target.split(sep)
+                    parts = target_parts + parts[(j+1):]
+                    j = len(target_parts)
+                else:
+                    parent = None
+            j += 1
+
+        name = sep.join(parts)
+        if name in self.names:
+            return name
+        return None
+
+def _invalidate_name_index(sender, instance, created=True, raw=False, **kw):
+    if not created:
+        # existing docstring or alias saved: no names added
+        return
+    if raw:
+        # loading fixtures clears the PullMetadata cache instead
+        return
+    try:
+        if isinstance(instance, Docstring):
+            site = instance.site
+        else:
+            site = instance.parent.site
+    except Docstring.DoesNotExist:
+        # the parent is being deleted, and invalidates the index itself
+        return
+    DocstringNameIndex.invalidate(site)
+
+for _model in (Docstring, DocstringAlias):
+    models.signals.post_save.connect(_invalidate_name_index, sender=_model)
+    models.signals.post_delete.connect(_invalidate_name_index, sender=_model)
+del _model
+
+
 # -- reStructuredText label cache
 
 class LabelCache(models.Model):
@@ -646,12 +1110,54 @@ class LabelCache(models.Model):
             label.title = title
             label.save()
 
+    @classmethod
+    def cache_many(cls, site, items):
+        """
+        Insert many labels at once.
+
+        Labels already cached for the site are left alone, as are all
+        but the first of duplicate labels in `items`.
+
+        Parameters
+        ----------
+        site : Site
+            Site to insert the labels for.
+        items : iterable of (label, target, title)
+            Labels to insert.
+
+        """
+        from django.db import connection, transaction
+        cursor = connection.cursor()
+
+        rows = []
+        seen = set()
+        for label, target, title in items:
+            if label not in seen:
+                seen.add(label)
+                rows.append((label, target, title, site.id))
+
+        for chunk in chunked(rows):
+            cursor.execute("""
+            SELECT label FROM docweb_labelcache
+            WHERE site_id = %%s AND label IN (%s)
+            """ % ", ".join(["%s"]*len(chunk)),
+                           [site.id] + [row[0] for row in chunk])
+            existing = set(row[0] for row in cursor.fetchall())
+            new_rows = [row for row in chunk if row[0] not in existing]
+            if new_rows:
+                cursor.executemany("""
+                INSERT INTO docweb_labelcache (label, target, title, site_id)
+                VALUES (%s, %s, %s, %s)
+                """, new_rows)
+        transaction.commit_unless_managed()
+
     @classmethod
     def clear(cls, site):
         cls.objects.filter(site=site).delete()
 
     @classmethod
     def cache_docstring(cls, docstring):
+        old_labels = docstring._get_labels()
         cls.objects.filter(target=docstring.name).all().delete()
 
         # -- Cache docstring name
@@ -661,51 +1167,60 @@ class LabelCache(models.Model):
         cls.cache_docstring_labels(docstring)
 
         # -- Cache docstring aliases
-        from django.db import connection, transaction
+        from django.db import connection
         cursor = connection.cursor()
         # 1st dereference level (normal docstrings)
         cursor.execute(port_sql("""
-        INSERT INTO docweb_labelcache (label, target, title, site_id)
-        SELECT d.name || '.' || a.alias, a.target, a.alias, %s
+        SELECT d.name || '.' || a.alias, a.target, a.alias
         FROM docweb_docstring AS d
         LEFT JOIN docweb_docstringalias AS a
         ON d.name = a.parent_id
         WHERE d.name || '.' || a.alias != a.target AND d.type_ != 'dir'
               AND d.site_id = %s AND a.target = %s
-        """), [docstring.site.id, docstring.site.id, docstring.name])
+        """), [docstring.site.id, docstring.name])
+        cls.cache_many(docstring.site, cursor.fetchall())
         # 1st dereference level (.rst pages)
         cursor.execute(port_sql("""
-        INSERT INTO docweb_labelcache (label, target, title, site_id)
-        SELECT d.name || '/' || a.alias, a.target, a.alias, %s
+        SELECT d.name || '/' || a.alias, a.target, a.alias
         FROM docweb_docstring AS d
         LEFT JOIN docweb_docstringalias AS a
         ON d.name = a.parent_id
         WHERE d.name || '/' || a.alias != a.target AND d.type_ = 'dir'
               AND d.site_id = %s AND a.target = %s
-        """), [docstring.site.id, docstring.site.id, docstring.name])
-        transaction.commit_unless_managed()
+        """), [docstring.site.id, docstring.name])
+        cls.cache_many(docstring.site, cursor.fetchall())
+
+        # -- Invalidate rendered pages linking to added or removed labels
+        changed = old_labels.symmetric_difference(docstring._get_labels())
+        if changed:
+            RenderCache.invalidate_dependents(docstring.site, changed)
 
     @classmethod
     def cache_docstring_labels(cls, docstring):
         if docstring.type_code != 'file':
             return
+        # XXX: put something more intelligent to the title field...
+        cls.cache_many(docstring.site,
+                       [(name, docstring.name, name)
+                        for name in cls.parse_labels(docstring.text)])
 
-        text = docstring.text
+    @classmethod
+    def parse_labels(cls, text):
+        """
+        Return the labels defined in the text of a 'file' page: RST
+        labels, and the objects of Sphinx module and object directives.
 
-        for name in cls._label_re.findall(text):
-            # XXX: put something more intelligent to the title field...
-            cls.cache(name, docstring.name, site=docstring.site)
+        """
+        labels = cls._label_re.findall(text)
 
         module = ""
         for directive, name in cls._directive_re.findall(text):
             if directive in ('module', 'currentmodule'):
                 module = name + '.'
-                cls.cache(name, docstring.name, site=docstring.site)
-            elif directive == 'currentmodule':
-                continue
+                labels.append(name)
             else:
-                cls.cache(module + name, docstring.name,
-                          site=docstring.site)
+                labels.append(module + name)
+        return labels
 
     def full_url(self, url_part):
         """Prefix the given URL with this object's site prefix"""
@@ -745,48 +1260,58 @@ class ToctreeCache(models.Model):
         if docstring.type_code != 'file':
             return
 
+        old_children = list(cls.objects.filter(parent=docstring).values_list(
+            'child', flat=True))
         cls.objects.filter(parent=docstring).delete()
 
-        # -- parse
-        toc_children, code_children = cls._parse_toctree_autosummary(
-            docstring.text)
+        index = DocstringNameIndex.get(docstring.site)
+        children = cls.resolve_children(docstring.name, docstring.text, index)
+        for child in children:
+            tocref = cls(parent=docstring, child_id=child)
+            tocref.save()
+
+        cls.update_ancestors(docstring.site, old_children + children)
+
+    @classmethod
+    def resolve_children(cls, name, text, index):
+        """
+        Return the names of the pages listed in the toctree:: and
+        autosummary:: directives of a 'file' page.
+
+        Parameters
+        ----------
+        name : str
+            Name of the 'file' page.
+        text : str
+            Text of the page.
+        index : DocstringNameIndex
+            Names of the docstrings of the site. Unknown pages are skipped.
+
+        """
+        toc_children, code_children = cls._parse_toctree_autosummary(text)
+        children = []
 
         # -- resolve TOC children
-        base_path = '/'.join(docstring.name.split('/')[:-1])
+        base_path = '/'.join(name.split('/')[:-1])
         suffixes = ['', '.rst', '.txt']
         for child in toc_children:
-            doc = None
-
             for suffix in suffixes:
-                try:
-                    path = os.path.join(base_path, child) + suffix
-                    doc = Docstring.on_site.get(name=path)
+                path = os.path.join(base_path, child) + suffix
+                if path in index.names:
+                    children.append(path)
                     break
-                except Docstring.DoesNotExist:
-                    # unknown page, skip it
-                    pass
-
-            if doc is not None:
-                tocref = cls(parent=docstring, child=doc)
-                tocref.save()
 
         # -- resolve code children
         for module, child in code_children:
-            doc = None
-
             for prefix in [module, '']:
                 if prefix is None:
                     continue
-                try:
-                    doc = Docstring.resolve(name=prefix + child)
+                target = index.resolve(prefix + child)
+                if target is not None:
+                    children.append(target)
                     break
-                except Docstring.DoesNotExist:
-                    # unknown page, skip it
-                    pass
 
-            if doc is not None:
-                tocref = cls(parent=docstring, child=doc)
-                tocref.save()
+        return children
 
     @classmethod
     def _parse_toctree_autosummary(cls, text):
@@ -836,25 +1361,282 @@ class ToctreeCache(models.Model):
         return toc_children, code_children
 
 
+    @classmethod
+    def update_ancestors(cls, site, names=None):
+        """
+        Update the materialized ancestry (`ToctreeAncestor`) of the
+        pages of the site from the toctree relations.
+
+        Each page is placed under the first parent listing it; the
+        chains of pages whose ancestry did not change are left alone.
+
+        Parameters
+        ----------
+        site : Site
+        names : list of str, optional
+            Pages whose toctree parents changed. Only these pages and
+            their old and new descendants are recomputed. By default,
+            the whole site is.
+
+        """
+        from django.db import connection, transaction
+        cursor = connection.cursor()
+
+        parents = {}
+        old_chains = {}
+
+        if names is None:
+            cursor.execute("""
+            SELECT t.child_id, t.parent_id
+            FROM docweb_toctreecache AS t, docweb_docstring AS d
+            WHERE d.name = t.parent_id AND d.site_id = %s
+            ORDER BY t.id
+            """, [site.id])
+            for child, parent in cursor.fetchall():
+                parents.setdefault(child, parent)
+
+            cursor.execute("""
+            SELECT docstring_id, ancestor_id FROM docweb_toctreeancestor
+            WHERE site_id = %s ORDER BY depth
+            """, [site.id])
+            for name, ancestor in cursor.fetchall():
+                old_chains.setdefault(name, []).append(ancestor)
+
+            affected = set(parents).union(old_chains)
+        else:
+            affected = cls._get_descendants(cursor, site, names)
+
+            for chunk in chunked(affected):
+                cursor.execute("""
+                SELECT t.child_id, t.parent_id
+                FROM docweb_toctreecache AS t, docweb_docstring AS d
+                WHERE d.name = t.parent_id AND d.site_id = %%s
+                      AND t.child_id IN (%s)
+                ORDER BY t.id
+                """ % ", ".join(["%s"]*len(chunk)), [site.id] + chunk)
+                for child, parent in cursor.fetchall():
+                    parents.setdefault(child, parent)
+
+            # the chains of the unaffected parents are reused as-is
+            lookup = affected.union(parents.values())
+            for chunk in chunked(lookup):
+                cursor.execute("""
+                SELECT docstring_id, ancestor_id FROM docweb_toctreeancestor
+                WHERE site_id = %%s AND docstring_id IN (%s)
+                ORDER BY depth
+                """ % ", ".join(["%s"]*len(chunk)), [site.id] + chunk)
+                for name, ancestor in cursor.fetchall():
+                    old_chains.setdefault(name, []).append(ancestor)
+
+        chains = {}
+        for name in affected:
+            chain = []
+            seen = set([name])
+            parent = parents.get(name)
+            while parent is not None and parent not in seen:
+                # stop at cycles
+                seen.add(parent)
+                chain.append(parent)
+                if parent not in affected:
+                    chain.extend(reversed(old_chains.get(parent, [])))
+                    break
+                parent = parents.get(parent)
+            chain.reverse()
+            chains[name] = chain
+
+        changed = [name for name in affected
+                   if chains[name] != old_chains.get(name, [])]
+
+        for chunk in chunked(changed):
+            cursor.execute("""
+            DELETE FROM docweb_toctreeancestor
+            WHERE site_id = %%s AND docstring_id IN (%s)
+            """ % ", ".join(["%s"]*len(chunk)), [site.id] + chunk)
+
+        rows = [(name, ancestor, depth, site.id)
+                for name in changed
+                for depth, ancestor in enumerate(chains.get(name, []))]
+        for chunk in chunked(rows):
+            cursor.executemany("""
+            INSERT INTO docweb_toctreeancestor
+            (docstring_id, ancestor_id, depth, site_id)
+            VALUES (%s, %s, %s, %s)
+            """, chunk)
+        transaction.commit_unless_managed()
+
+    @classmethod
+    def _get_descendants(cls, cursor, site, names):
+        """
+        Return the given pages together with all pages below them,
+        both in the stored ancestry and in the current toctree relations.
+
+        """
+        result = set(names)
+        for chunk in chunked(list(result)):
+            cursor.execute("""
+            SELECT docstring_id FROM docweb_toctreeancestor
+            WHERE site_id = %%s AND ancestor_id IN (%s)
+            """ % ", ".join(["%s"]*len(chunk)), [site.id] + chunk)
+            result.update(row[0] for row in cursor.fetchall())
+
+        frontier = list(result)
+        while frontier:
+            children = set()
+            for chunk in chunked(frontier):
+                cursor.execute("""
+                SELECT child_id FROM docweb_toctreecache
+                WHERE parent_id IN (%s)
+                """ % ", ".join(["%s"]*len(chunk)), chunk)
+                children.update(row[0] for row in cursor.fetchall())
+            frontier = list(children - result)
+            result.update(frontier)
+        return result
+
     @classmethod
     def get_chain(cls, docstring):
         """
         Return a direct path from root toctree:: item to the given item.
 
         """
-        seen = {}
-        chain = [docstring]
+        ancestors = ToctreeAncestor.objects.filter(
+            docstring=docstring).select_related('ancestor').order_by('depth')
+        return [item.ancestor for item in ancestors] + [docstring]
 
-        while True:
-            seen[chain[0]] = True
-            try:
-                parent = ToctreeCache.objects.filter(child=chain[0])[0].parent
-            except IndexError:
-                break
-            if parent in seen:
-                break
-            chain.insert(0, parent)
-        return chain
+class ToctreeAncestor(models.Model):
+    """
+    Materialized toctree:: ancestry, for breadcrumbs.
+
+    The pages on the path from the root of the toctree to a page,
+    following the relations of both the toctree:: and autosummary::
+    directives. The root has depth 0.
+
+    """
+    docstring = models.ForeignKey(Docstring, related_name="toctree_ancestors")
+    ancestor = models.ForeignKey(Docstring,
+                                 related_name="toctree_descendants")
+    depth = models.IntegerField()
+
+    site = models.ForeignKey(Site)
+
+# -- Rendered HTML cache
+
+class RenderCache(models.Model):
+    """
+    Rendered HTML bodies of docstrings.
+
+    Entries are keyed by the revision number (NULL for the VCS text),
+    the fingerprint of the VCS data, and the renderer version, so that
+    a cached body never corresponds to stale docstring contents.
+    Changes in link targets are handled by invalidating the pages that
+    depend on them, see `RenderDependency`.
+
+    """
+    docstring = models.ForeignKey(Docstring, related_name="render_cache")
+    revno = models.IntegerField(null=True)
+    source_hash = models.CharField(max_length=32)
+    version = models.IntegerField()
+    html = models.TextField()
+
+    @classmethod
+    def _key(cls, docstring, rev, version):
+        if rev is None:
+            revno = None
+        else:
+            revno = rev.revno
+        return dict(docstring=docstring, revno=revno,
+                    source_hash=docstring.source_hash or '',
+                    version=version)
+
+    @classmethod
+    def fetch(cls, docstring, rev, version):
+        """
+        Return the cached HTML body for the given revision (None for
+        VCS text), or None if it is not cached.
+
+        """
+        try:
+            return cls.objects.filter(**cls._key(docstring, rev,
+                                                 version))[0].html
+        except IndexError:
+            return None
+
+    @classmethod
+    def store(cls, docstring, rev, version, html, dependencies=()):
+        """
+        Store a rendered HTML body, and the names (labels or docstring
+        names) whose changes should invalidate it.
+
+        Bodies of other revisions and VCS texts of the docstring are
+        dropped, except the one of its current text, as is any body
+        already stored for the same key by a concurrent render.
+
+        """
+        key = cls._key(docstring, rev, version)
+        new = (key['revno'], key['source_hash'], version)
+        current = (docstring.cur_revno, key['source_hash'], version)
+        stale = []
+        for item_id, revno, source_hash, item_version in \
+                cls.objects.filter(docstring=docstring).values_list(
+                    'id', 'revno', 'source_hash', 'version'):
+            item_key = (revno, source_hash, item_version)
+            if item_key == new or item_key != current:
+                stale.append(item_id)
+        if stale:
+            cls.objects.filter(id__in=stale).delete()
+
+        item = cls(html=html, **key)
+        item.save()
+
+        dependencies = set(dependencies)
+        dependencies.difference_update(
+            RenderDependency.objects.filter(docstring=docstring).values_list(
+                'name', flat=True))
+        if dependencies:
+            from django.db import connection, transaction
+            cursor = connection.cursor()
+            cursor.executemany("""
+            INSERT INTO docweb_renderdependency (docstring_id, name)
+            VALUES (%s, %s)
+            """, [(docstring.name, name) for name in dependencies])
+            transaction.commit_unless_managed()
+
+    @classmethod
+    def invalidate(cls, names):
+        """Drop cached bodies of the given docstrings"""
+        for chunk in chunked(names):
+            cls.objects.filter(docstring__in=chunk).delete()
+            RenderDependency.objects.filter(docstring__in=chunk).delete()
+
+    @classmethod
+    def invalidate_dependents(cls, site, names):
+        """
+        Drop cached bodies of the docstrings whose rendering looked up
+        any of the given names.
+
+        """
+        dependents = set()
+        for chunk in chunked(names):
+            dependents.update(RenderDependency.objects.filter(
+                docstring__site=site, name__in=chunk).values_list(
+                'docstring', flat=True))
+        cls.invalidate(dependents)
+
+    @classmethod
+    def clear(cls, site):
+        cls.objects.filter(docstring__site=site).delete()
+        RenderDependency.objects.filter(docstring__site=site).delete()
+
+class RenderDependency(models.Model):
+    """
+    Names looked up when rendering the cached bodies of a docstring.
+
+    A name is recorded whether or not it resolved, so that the page is
+    invalidated also when a previously missing link target appears.
+
+    """
+    docstring = models.ForeignKey(Docstring,
+                                  related_name="render_dependencies")
+    name = models.CharField(max_length=256, db_index=True)
 
 # -- Wiki pages
 
@@ -871,6 +1653,7 @@ class WikiPage(models.Model):
                                text=new_text,
                                comment=comment)
         rev.save()
+        SearchIndex.index_wiki_page(self, new_text)
 
     @property
     def text(self):
@@ -890,32 +1673,58 @@ class WikiPage(models.Model):
         except cls.DoesNotExist:
             return ""
 
+    @classmethod
+    def get_current_texts(cls, site, empty_only=False):
+        """
+        Return (name, text) of the wiki pages of the site, in one query.
+
+        The text is None for pages without revisions. If `empty_only`,
+        only the pages with no text are returned.
+
+        """
+        from django.db import connection
+        cursor = connection.cursor()
+        query = """
+        SELECT p.name, r.text
+        FROM docweb_wikipage AS p
+        LEFT JOIN docweb_wikipagerevision AS r
+        ON r.revno = (SELECT MAX(r2.revno) FROM docweb_wikipagerevision AS r2
+                      WHERE r2.page_id = p.id)
+        WHERE p.site_id = %s
+        """
+        if empty_only:
+            query += " AND (r.text IS NULL OR r.text = '')"
+        cursor.execute(query, [site.id])
+        return cursor.fetchall()
+
     @classmethod
     def fulltext_search(cls, s, invert=False):
         """
-        Fulltext search using an SQL LIKE clause
+        Fulltext search of current wiki page texts and names.
+
+        See `SearchIndex.search` for the query syntax.
 
         Returns
         -------
-        it : iterator
-            Iterator of matching docstring names
+        results : list of (name, score)
+            Matching wiki pages, best matches first.
 
         """
-        site_id = Site.objects.get_current().id
-        if invert:
-            not_ = "NOT"
+        site = Site.objects.get_current()
+        pages = cls.on_site.all()
+        if s.strip():
+            results = SearchIndex.search(site, SearchIndex.WIKI, s,
+                                         total=pages.count())
         else:
-            not_ = ""
-        from django.db import connection
-        cursor = connection.cursor()
-        cursor.execute("""\
-        SELECT p.name FROM docweb_wikipagerevision AS r
-        LEFT JOIN docweb_wikipage AS p ON r.page_id = p.id
-        WHERE %s (p.name LIKE %%s OR r.text LIKE %%s)
-        AND p.site_id = %%s
-        GROUP BY p.name
-        """ % (not_,), [s, s, site_id])
-        return cursor.fetchall()
+            # pages with no text
+            results = [(name, 0) for name, text
+                       in cls.get_current_texts(site, empty_only=True)]
+            results.sort()
+        if invert:
+            names = set(pages.values_list('name', flat=True))
+            names.difference_update(r[0] for r in results)
+            results = [(name, 0) for name in sorted(names)]
+        return results
 
 class WikiPageRevision(models.Model):
     revno = models.AutoField(primary_key=True)
@@ -929,6 +1738,479 @@ class WikiPageRevision(models.Model):
         get_latest_by = "timestamp"
         ordering = ['-revno']
 
+# -- Full-text search
+
+class SearchIndex(models.Model):
+    """
+    Inverted index of the words in the current texts and the names of
+    docstrings and wiki pages.
+
+    Words in names are stored with a '@' prefix, so that they can be
+    weighted separately.
+
+    """
+    DOCSTRING = 'd'
+    WIKI = 'w'
+
+    site = models.ForeignKey(Site)
+    kind = models.CharField(max_length=1)
+    name = models.CharField(max_length=256)
+    term = models.CharField(max_length=64)
+    weight = models.IntegerField()
+
+    _word_re = re.compile(r'[a-z0-9_]{2,64}')
+
+    # A word in the name counts as this many occurrences in the text
+    NAME_WEIGHT = 10
+
+    @classmethod
+    def _get_terms(cls, name, text):
+        terms = {}
+        for word in cls._word_re.findall((text or '').lower()):
+            terms[word] = terms.get(word, 0) + 1
+        for word in cls._word_re.findall(name.lower()):
+            terms['@' + word] = cls.NAME_WEIGHT
+        return terms
+
+    @classmethod
+    def _store(cls, site, kind, texts):
+        """Replace the index entries of the (name, text) pairs given"""
+        from django.db import connection, transaction
+        cursor = connection.cursor()
+        for chunk in chunked(texts):
+            cursor.execute("""
+            DELETE FROM docweb_searchindex
+            WHERE site_id = %%s AND kind = %%s AND name IN (%s)
+            """ % ", ".join(["%s"]*len(chunk)),
+            [site.id, kind] + [name for name, text in chunk])
+            rows = []
+            for name, text in chunk:
+                for term, weight in cls._get_terms(name, text).iteritems():
+                    rows.append((site.id, kind, name, term, weight))
+            if rows:
+                cursor.executemany("""
+                INSERT INTO docweb_searchindex
+                (site_id, kind, name, term, weight)
+                VALUES (%s, %s, %s, %s, %s)
+                """, rows)
+        transaction.commit_unless_managed()
+
+    @classmethod
+    def index_docstrings(cls, site, names=None):
+        """
+        Update the index entries of the given docstrings, or all
+        docstrings of the site if `names` is None.
+
+        """
+        from django.db import connection
+        cursor = connection.cursor()
+        if names is None:
+            cursor.execute("DELETE FROM docweb_searchindex "
+                           "WHERE site_id = %s AND kind = %s",
+                           [site.id, cls.DOCSTRING])
+            cursor.execute("SELECT name FROM docweb_docstring "
+                           "WHERE site_id = %s", [site.id])
+            names = [row[0] for row in cursor.fetchall()]
+        for chunk in chunked(names):
+            cursor.execute("""
+            SELECT name, COALESCE(cur_text, source_doc) FROM docweb_docstring
+            WHERE site_id = %%s AND name IN (%s)
+            """ % ", ".join(["%s"]*len(chunk)), [site.id] + chunk)
+            cls._store(site, cls.DOCSTRING, cursor.fetchall())
+
+    @classmethod
+    def index_wiki_page(cls, page, text):
+        cls._store(page.site, cls.WIKI, [(page.name, text)])
+
+    @classmethod
+    def index_wiki_pages(cls, site):
+        """Update the index entries of all wiki pages of the site"""
+        cls._store(site, cls.WIKI, WikiPage.get_current_texts(site))
+
+    @classmethod
+    def _parse_query(cls, s):
+        """
+        Return a list of (word, is_prefix), and whether the query
+        contained only wildcards.
+
+        """
+        words = []
+        only_wildcards = True
+        for chunk in s.lower().split():
+            chunk_words = cls._word_re.findall(chunk)
+            if not chunk_words:
+                continue
+            only_wildcards = False
+            is_prefix = chunk.endswith('*') or chunk.endswith('%')
+            for word in chunk_words[:-1]:
+                words.append((word, False))
+            words.append((chunk_words[-1], is_prefix))
+        return words, only_wildcards and bool(s.strip())
+
+    @classmethod
+    def search(cls, site, kind, s, total=None):
+        """
+        Find entries containing all words of the query string.
+
+        Words are case-insensitive, and a trailing ``*`` or ``%``
+        matches all words with the given prefix. A query consisting of
+        wildcards only matches everything. Matches are ranked first by
+        the number of query words found in the name, and then by the
+        number of occurrences of the words weighted by their rarity.
+
+        Parameters
+        ----------
+        site : Site
+        kind : {SearchIndex.DOCSTRING, SearchIndex.WIKI}
+        s : str
+            Query string.
+        total : int, optional
+            Total number of entries, for weighting rare words.
+
+        Returns
+        -------
+        results : list of (name, score)
+            Best matches first.
+
+        """
+        words, match_all = cls._parse_query(s)
+        if match_all:
+            names = cls.objects.filter(site=site, kind=kind).values_list(
+                'name', flat=True).distinct()
+            return [(name, 0) for name in sorted(names)]
+        elif not words:
+            return []
+
+        from django.db import connection
+        cursor = connection.cursor()
+
+        scores = None
+        name_hits = {}
+        for word, is_prefix in words:
+            if is_prefix:
+                cursor.execute("""
+                SELECT name, term, weight FROM docweb_searchindex
+                WHERE site_id = %s AND kind = %s
+                      AND (term LIKE %s ESCAPE '!' OR term LIKE %s ESCAPE '!')
+                """, [site.id, kind, word.replace('_', '!_') + '%',
+                      '@' + word.replace('_', '!_') + '%'])
+            else:
+                cursor.execute("""
+                SELECT name, term, weight FROM docweb_searchindex
+                WHERE site_id = %s AND kind = %s AND term IN (%s, %s)
+                """, [site.id, kind, word, '@' + word])
+            counts = {}
+            in_name = set()
+            for name, term, weight in cursor.fetchall():
+                counts[name] = counts.get(name, 0) + weight
+                if term.startswith('@'):
+                    in_name.add(name)
+
+            # tf-idf -like weighting
+            if total is None or total < len(counts):
+                total = len(counts)
+            if counts:
+                idf = math.log(1.0 + float(total) / len(counts))
+            if scores is not None:
+                for name in counts.keys():
+                    if name not in scores:
+                        del counts[name]
+            if not counts:
+                return []
+
+            new_scores = {}
+            for name, count in counts.iteritems():
+                new_scores[name] = ((scores or {}).get(name, 0)
+                                    + (1 + math.log(count)) * idf)
+                if name in in_name:
+                    name_hits[name] = name_hits.get(name, 0) + 1
+            scores = new_scores
+
+        # Rank by the number of words matching in the name first: the
+        # integer part of the score is that number
+        results = [(name, name_hits.get(name, 0) + score/(1.0 + score))
+                   for name, score in scores.iteritems()]
+        results.sort(key=lambda x: (-x[1], x[0]))
+        return results
+
+    @classmethod
+    def get_snippets(cls, site, kind, names, s, width=160):
+        """
+        Return HTML snippets of the texts of the given entries, showing
+        the first match of the query with the matching words highlighted.
+
+        Returns
+        -------
+        snippets : dict of name => str
+
+        """
+        from django.db import connection
+        cursor = connection.cursor()
+
+        texts = []
+        for chunk in chunked(names):
+            in_ = ", ".join(["%s"]*len(chunk))
+            if kind == cls.DOCSTRING:
+                cursor.execute("""
+                SELECT name, COALESCE(cur_text, source_doc)
+                FROM docweb_docstring
+                WHERE site_id = %%s AND name IN (%s)
+                """ % in_, [site.id] + chunk)
+            else:
+                cursor.execute("""
+                SELECT p.name, r.text
+                FROM docweb_wikipage AS p, docweb_wikipagerevision AS r
+                WHERE r.page_id = p.id AND p.site_id = %%s AND p.name IN (%s)
+                      AND r.revno = (SELECT MAX(revno)
+                                     FROM docweb_wikipagerevision
+                                     WHERE page_id = p.id)
+                """ % in_, [site.id] + chunk)
+            texts.extend(cursor.fetchall())
+
+        words, match_all = cls._parse_query(s)
+        patterns = []
+        for word, is_prefix in words:
+            if is_prefix:
+                patterns.append(re.escape(word) + '[a-z0-9_]*')
+            else:
+                patterns.append(re.escape(word))
+        if patterns:
+            match_re = re.compile(r'(?<![a-z0-9_])(?:%s)(?![a-z0-9_])'
+                                  % '|'.join(patterns), re.I)
+        else:
+            match_re = None
+
+        snippets = {}
+        for name, text in texts:
+            text = re.sub(r'\s+', ' ', text or '').strip()
+            m = None
+            if match_re is not None:
+                m = match_re.search(text)
+            if m is None:
+                start = 0
+            else:
+                start = max(0, m.start() - width//3)
+            end = min(len(text), start + width)
+
+            parts = []
+            if start > 0:
+                parts.append('...')
+            pos = start
+            if match_re is not None:
+                for m in match_re.finditer(text, start, end):
+                    parts.append(cgi.escape(text[pos:m.start()]))
+                    parts.append('<strong class="match">%s</strong>'
+                                 % cgi.escape(m.group(0)))
+                    pos = m.end()
+            parts.append(cgi.escape(text[pos:end]))
+            if end < len(text):
+                parts.append('...')
+            snippets[name] = ''.join(parts)
+        return snippets
+
+# -- Statistics
+
+class WeeklyDocstringStats(models.Model):
+    """
+    Words changed in a docstring during a week, with the first and last
+    revisions of the period and the final review status.
+
+    """
+    site = models.ForeignKey(Site)
+    week = models.DateTimeField()
+    docstring = models.ForeignKey(Docstring, related_name="weekly_stats")
+    words = models.FloatField()
+    start_rev = models.IntegerField(null=True,
+                                    help_text="NULL for the VCS version")
+    end_rev = models.IntegerField()
+    review_code = models.IntegerField(db_column="review")
+
+class WeeklyAuthorStats(models.Model):
+    """
+    Words changed by an author during a week.
+
+    """
+    site = models.ForeignKey(Site)
+    week = models.DateTimeField()
+    author = models.CharField(max_length=256)
+    words = models.FloatField()
+
+def get_week_start(timestamp):
+    """Return the start of the week (Monday 00:00) containing timestamp"""
+    t = datetime.datetime(timestamp.year, timestamp.month, timestamp.day)
+    return t - datetime.timedelta(days=t.weekday())
+
+def compute_weekly_stats(revisions, start_revs=None):
+    """
+    Aggregate revisions into weekly statistics in a single sweep.
+
+    Parameters
+    ----------
+    revisions : iterable of tuples
+        Tuples ``(docstring, revno, author, review_code, words, timestamp)``
+        in order of increasing timestamp.
+    start_revs : dict, optional
+        Last counted revision of each docstring before the first week.
+        Updated in place.
+
+    Returns
+    -------
+    weeks : list of (week, docstrings, authors)
+        For each week with edits, `docstrings` maps names to
+        ``[words, start_rev, end_rev, review_code]`` and `authors`
+        maps authors to the number of words changed.
+
+    """
+    if start_revs is None:
+        start_revs = {}
+
+    weeks = []
+    week_end = None
+    docstrings = authors = None
+
+    for name, revno, author, review_code, words, timestamp in revisions:
+        if week_end is None or timestamp >= week_end:
+            # close the previous week and open a new one
+            if docstrings is not None:
+                for name2, item in docstrings.iteritems():
+                    start_revs[name2] = item[2]
+            week_start = get_week_start(timestamp)
+            week_end = week_start + datetime.timedelta(days=7)
+            docstrings = {}
+            authors = {}
+            weeks.append((week_start, docstrings, authors))
+
+        if review_code == REVIEW_UNIMPORTANT or words <= 0:
+            words = 0
+        authors[author] = authors.get(author, 0) + words
+        item = docstrings.get(name)
+        if item is None:
+            item = docstrings[name] = [0, start_revs.get(name), None, None]
+        item[0] += words
+        item[2] = revno
+        item[3] = review_code
+
+    return weeks
+
+def _store_weekly_stats(site, weeks):
+    from django.db import connection
+    cursor = connection.cursor()
+
+    doc_rows = []
+    author_rows = []
+    for week, docstrings, authors in weeks:
+        for name, (words, start_rev, end_rev, review_code) \
+                in docstrings.iteritems():
+            doc_rows.append((site.id, week, name, words, start_rev, end_rev,
+                             review_code))
+        for author, words in authors.iteritems():
+            author_rows.append((site.id, week, author, words))
+
+    for chunk in chunked(doc_rows):
+        cursor.executemany(
+            "INSERT INTO docweb_weeklydocstringstats "
+            "(site_id, week, docstring_id, words, start_rev, end_rev, review) "
+            "VALUES (%s, %s, %s, %s, %s, %s, %s)", chunk)
+    for chunk in chunked(author_rows):
+        cursor.executemany(
+            "INSERT INTO docweb_weeklyauthorstats "
+            "(site_id, week, author, words) VALUES (%s, %s, %s, %s)", chunk)
+    transaction.commit_unless_managed()
+
+def update_weekly_stats(site, timestamp):
+    """
+    Recompute the weekly statistics for the week containing `timestamp`
+    from the revisions made during it.
+
+    """
+    start = get_week_start(timestamp)
+    end = start + datetime.timedelta(days=7)
+
+    revs = list(DocstringRevision.objects.filter(
+        docstring__site=site, timestamp__gte=start, timestamp__lt=end,
+        words_changed__isnull=False).order_by('timestamp').values_list(
+        'docstring', 'revno', 'author', 'review_code', 'words_changed',
+        'timestamp'))
+
+    # The period starts from the last edit made before it
+    start_revs = {}
+    names = list(set(rev[0] for rev in revs))
+    for chunk in chunked(names):
+        start_revs.update(DocstringRevision.objects.filter(
+            docstring__in=chunk, timestamp__lt=start,
+            words_changed__isnull=False).values_list(
+            'docstring').annotate(models.Max('revno')))
+
+    WeeklyDocstringStats.objects.filter(site=site, week=start).delete()
+    WeeklyAuthorStats.objects.filter(site=site, week=start).delete()
+    _store_weekly_stats(site, compute_weekly_stats(revs, start_revs))
+
+def update_weekly_review(site, name, revno, old_review_code, review_code):
+    """
+    Update the weekly statistics after the review status of `revno`,
+    the latest revision of docstring `name`, changed.
+
+    Only the docstring's row for the week of the revision changes,
+    and the word counts only if the revision became or stopped being
+    unimportant.
+
+    """
+    stats = WeeklyDocstringStats.objects.filter(site=site, docstring=name,
+                                                end_rev=revno)
+    stats.update(review_code=review_code)
+
+    if ((old_review_code == REVIEW_UNIMPORTANT)
+            == (review_code == REVIEW_UNIMPORTANT)):
+        return
+
+    rev = DocstringRevision.objects.get(revno=revno)
+    if rev.words_changed is None or rev.words_changed <= 0:
+        return
+    words = rev.words_changed
+    if review_code == REVIEW_UNIMPORTANT:
+        words = -words
+    stats.update(words=models.F('words') + words)
+    WeeklyAuthorStats.objects.filter(
+        site=site, week=get_week_start(rev.timestamp),
+        author=rev.author).update(words=models.F('words') + words)
+
+def rebuild_weekly_stats(site):
+    """
+    Recompute the words changed in all revisions on the site, and
+    the weekly statistics.
+
+    """
+    from django.db import connection
+    cursor = connection.cursor()
+
+    revisions = DocstringRevision.objects.filter(
+        docstring__site=site).order_by('docstring', 'timestamp').values_list(
+        'docstring', 'revno', 'text', 'timestamp')
+
+    updates = []
+    last_name = None
+    last_text = None
+    for name, revno, text, timestamp in revisions.iterator():
+        if name != last_name:
+            updates.append((None, revno))
+        else:
+            updates.append((count_words_changed(last_text, text), revno))
+        last_name = name
+        last_text = text
+    for chunk in chunked(updates):
+        cursor.executemany("UPDATE docweb_docstringrevision "
+                           "SET words_changed = %s WHERE revno = %s", chunk)
+    transaction.commit_unless_managed()
+
+    revs = DocstringRevision.objects.filter(
+        docstring__site=site, words_changed__isnull=False).order_by(
+        'timestamp').values_list('docstring', 'revno', 'author',
+                                 'review_code', 'words_changed', 'timestamp')
+
+    WeeklyDocstringStats.objects.filter(site=site).delete()
+    WeeklyAuthorStats.objects.filter(site=site).delete()
+    _store_weekly_stats(site, compute_weekly_stats(revs.iterator()))
+
 # -- Reviewing
 
 class ReviewComment(models.Model):
@@ -7,9 +7,10 @@ from django.template import Context
 from django.template.loader import get_template
 
 from django.core.cache import cache
+from django.contrib.sites.models import Site
 import pydocweb.docweb.models as models
 
-from utils import cache_memoize
+from utils import cache_memoize, chunked
 
 #------------------------------------------------------------------------------
 # Rendering
@@ -32,18 +33,25 @@ class RstWriter(docutils.writers.html4css1.Writer):
     output = None
     
     def __init__(self, resolve_to_wiki,
-                 resolve_prefixes=[], resolve_suffixes=[]):
+                 resolve_prefixes=[], resolve_suffixes=[],
+                 dependencies=None):
         docutils.writers.html4css1.Writer.__init__(self)
         self.unknown_reference_resolvers = [self.resolver]
         self.nodes = []
         self.resolve_to_wiki = resolve_to_wiki
         self.resolve_prefixes = resolve_prefixes
         self.resolve_suffixes = resolve_suffixes
+        self.dependencies = dependencies
 
         self.reference_key = ("__reference_cache_" + "#".join(resolve_prefixes)
                               + '@' + "#".join(resolve_suffixes)
                               + '@' + str(resolve_to_wiki))
-        self.reference_cache = cache.get(self.reference_key, {})
+        if dependencies is None:
+            self.reference_cache = cache.get(self.reference_key, {})
+        else:
+            # The output is stored until a dependency changes, so it
+            # must not be based on possibly stale cached references
+            self.reference_cache = {}
 
     def done(self):
         cache.set(self.reference_key, self.reference_cache,
@@ -73,6 +81,25 @@ class RstWriter(docutils.writers.html4css1.Writer):
         self.nodes.append(node)
         return True
 
+    def _candidates(self, name):
+        """Label names tried when resolving `name`"""
+        return ['%s%s%s' % (p, name, s)
+                for p in [''] + self.resolve_prefixes
+                for s in [''] + self.resolve_suffixes]
+
+    def _make_ref(self, name, item):
+        linkname = make_target_id(name)
+        url = reverse('pydocweb.docweb.views_docstring.view',
+                      kwargs=dict(name=item.target)) + '#' + linkname
+        return (item.full_url(url), item.target)
+
+    def _fallback_ref(self, name):
+        """Reference for names not found anywhere, or None"""
+        if self.resolve_to_wiki and name and name[0].lower() != name[0]:
+            return (reverse('pydocweb.docweb.views_wiki.view', args=[name]),
+                    name)
+        return None
+
     def _resolve_name(self, name, is_label=False):
         try:
             # try to get it first from cache
@@ -84,40 +111,173 @@ class RstWriter(docutils.writers.html4css1.Writer):
         except KeyError:
             pass
 
-        names = ['%s%s%s' % (p, name, s)
-                 for p in [''] + self.resolve_prefixes
-                 for s in [''] + self.resolve_suffixes]
-        items = models.LabelCache.on_site.filter(label__in=names)
-        if not items:
-            # try to resolve a docstring (somewhat expensive)
-            for item_name in names:
-                try:
-                    doc = models.Docstring.resolve(item_name)
-                    items = [models.LabelCache(label=name, target=doc.name,
-                                               site=doc.site)]
-                    break
-                except models.Docstring.DoesNotExist:
-                    pass
-        if not items:
+        names = self._candidates(name)
+
+        if self.dependencies is not None:
+            # Record the names tried: the page needs to be re-rendered
+            # if any of them appears, disappears, or changes
+            self.dependencies.update(names)
+
+        item = _pick_label(names,
+                           _fetch_labels(models.LabelCache.on_site, names))
+        if item is None:
+            if self.dependencies is not None:
+                # Resolution may also go through aliases of the parents
+                for item_name in names:
+                    self.dependencies.update(_name_prefixes(item_name))
+
+            # try to resolve a docstring
+            item = _resolve_docstring(name, names)
+        if item is None:
             # try to search cross-site
-            items = models.LabelCache.objects.filter(label__in=names)
-        if items:
-            linkname = make_target_id(name)
-            url = reverse('pydocweb.docweb.views_docstring.view',
-                          kwargs=dict(name=items[0].target)) + '#' + linkname
-            ref = (items[0].full_url(url), items[0].target)
-        elif self.resolve_to_wiki and name and name[0].lower() != name[0]:
-            ref = (reverse('pydocweb.docweb.views_wiki.view', args=[name]),
-                   name)
+            item = _pick_label(names,
+                               _fetch_labels(models.LabelCache.objects, names))
+        if item is not None:
+            ref = self._make_ref(name, item)
         else:
-            self.reference_cache[(name, is_label)] = None
-            raise ValueError()
+            ref = self._fallback_ref(name)
 
         self.reference_cache[(name, is_label)] = ref
+        if ref is None:
+            raise ValueError()
+        if self.dependencies is not None:
+            self.dependencies.add(ref[1])
         return ref
-    
+
+    def prefetch(self, names):
+        """
+        Resolve the given reference names with a few set-based queries,
+        and put the results in the reference cache.
+
+        """
+        names = [name for name in set(names)
+                 if (name, False) not in self.reference_cache]
+        if not names:
+            return
+
+        candidates = dict((name, self._candidates(name)) for name in names)
+        all_candidates = set()
+        for item_names in candidates.itervalues():
+            all_candidates.update(item_names)
+        if self.dependencies is not None:
+            self.dependencies.update(all_candidates)
+
+        # -- Labels on this site
+        labels = _fetch_labels(models.LabelCache.on_site, all_candidates)
+        missing = []
+        for name in names:
+            item = _pick_label(candidates[name], labels)
+            if item is None:
+                missing.append(name)
+            else:
+                self._cache_ref(name, self._make_ref(name, item))
+        if not missing:
+            return
+
+        # -- Docstrings missing from the label cache, or reachable
+        #    via aliases
+        unresolved = []
+        for name in missing:
+            if self.dependencies is not None:
+                for item_name in candidates[name]:
+                    self.dependencies.update(_name_prefixes(item_name))
+            item = _resolve_docstring(name, candidates[name])
+            if item is None:
+                unresolved.append(name)
+            else:
+                self._cache_ref(name, self._make_ref(name, item))
+
+        # -- Labels on other sites
+        cross_candidates = set()
+        for name in unresolved:
+            cross_candidates.update(candidates[name])
+        labels = _fetch_labels(models.LabelCache.objects, cross_candidates)
+        for name in unresolved:
+            item = _pick_label(candidates[name], labels)
+            if item is not None:
+                self._cache_ref(name, self._make_ref(name, item))
+            else:
+                self._cache_ref(name, self._fallback_ref(name))
+
+    def _cache_ref(self, name, ref):
+        self.reference_cache[(name, False)] = ref
+        if ref is not None and self.dependencies is not None:
+            self.dependencies.add(ref[1])
+
     resolver.priority = 001
 
+def _fetch_labels(manager, names):
+    """Return a dict of LabelCache items for the given labels"""
+    labels = {}
+    for chunk in chunked(names):
+        for item in manager.filter(label__in=chunk):
+            labels.setdefault(item.label, item)
+    return labels
+
+def _resolve_docstring(name, names):
+    """
+    Return a LabelCache item for the first of `names` resolving to a
+    docstring of the current site, or None.
+
+    """
+    site = Site.objects.get_current()
+    index = models.DocstringNameIndex.get(site)
+    for item_name in names:
+        target = index.resolve(item_name)
+        if target is not None:
+            return models.LabelCache(label=name, target=target, site=site)
+    return None
+
+def _pick_label(names, labels):
+    """Return the label item of the first name found, or None"""
+    for name in names:
+        if name in labels:
+            return labels[name]
+    return None
+
+_interpreted_re = re.compile(r'(?<!`)(?::[a-z]+:)?`([^`]+)`(?!`)')
+_hyperlink_re = re.compile(r'(?<![`\w])([a-zA-Z0-9][\w.-]*)__?(?!\w)')
+_directive_re = re.compile(r'^(\s*)\.\. (toctree|autosummary)::\s*$')
+
+def collect_reference_names(text):
+    """
+    Return the names likely to be looked up when rendering `text`.
+
+    Roles resolve their targets already while parsing, so the names are
+    found by scanning the source text instead of the doctree. Spurious
+    names are harmless: they only end up as unused cache entries.
+
+    """
+    names = set()
+    for content in _interpreted_re.findall(text):
+        link = rst_sphinx.split_ref_text(content)[1]
+        names.add(link)
+        names.add(docutils.nodes.fully_normalize_name(content))
+    for name in _hyperlink_re.findall(text):
+        names.add(docutils.nodes.fully_normalize_name(name))
+
+    indent = None
+    for line in text.split("\n"):
+        m = _directive_re.match(line)
+        if m:
+            indent = len(m.group(1))
+        elif indent is not None and line.strip():
+            if len(line) - len(line.lstrip()) <= indent:
+                indent = None
+            elif not line.strip().startswith(':'):
+                names.add(line.split()[0])
+    names.discard('')
+    return names
+
+def _name_prefixes(name):
+    """Return the parent names of a dotted or slashed name"""
+    if '/' in name:
+        sep = '/'
+    else:
+        sep = '.'
+    parts = name.split(sep)
+    return [sep.join(parts[:j]) for j in range(1, len(parts))]
+
 def make_target_id(text):
     """Generate a good-for-HTML identifier based on given text"""
     # disambiguate UPPERCASE parts from CamelCase or lowercase parts
@@ -128,11 +288,26 @@ def make_target_id(text):
 @cache_memoize(max_age=30*24*60*60)
 def render_html(text, resolve_to_wiki=True, resolve_prefixes=[],
                 resolve_suffixes=[]):
+    return _render_html(text, resolve_to_wiki=resolve_to_wiki,
+                        resolve_prefixes=resolve_prefixes,
+                        resolve_suffixes=resolve_suffixes)
+
+def _render_html(text, resolve_to_wiki=True, resolve_prefixes=[],
+                 resolve_suffixes=[], dependencies=None):
+    """
+    Render reStructuredText to HTML.
+
+    If `dependencies` is a set, the names looked up when resolving
+    references are added to it.
+
+    """
     # Fix Django clobbering
     docutils.parsers.rst.roles.DEFAULT_INTERPRETED_ROLE = 'title-reference'
     writer = RstWriter(resolve_to_wiki=resolve_to_wiki,
                        resolve_prefixes=resolve_prefixes,
-                       resolve_suffixes=resolve_suffixes)
+                       resolve_suffixes=resolve_suffixes,
+                       dependencies=dependencies)
+    writer.prefetch(collect_reference_names(text))
     parts = docutils.core.publish_parts(
         text,
         writer=writer,
@@ -142,6 +317,7 @@ def render_html(text, resolve_to_wiki=True, resolve_prefixes=[],
                                   default_role='autolink',
                                   link_base='',
                                   resolve_name=writer._resolve_name,
+                                  render_dependencies=dependencies,
                                   stylesheet_path='',
                                   # security settings:
                                   raw_enabled=0,
@@ -158,9 +334,42 @@ def render_html(text, resolve_to_wiki=True, resolve_prefixes=[],
 from docscrape import (NumpyFunctionDocString, NumpyModuleDocString,
                        NumpyClassDocString)
 
-def render_docstring_html(doc, text):
+# Bump when changes in the rendering code affect the output, to
+# invalidate the bodies stored in RenderCache
+RENDER_VERSION = 1
+
+def render_docstring_html_cached(doc, text, rev):
+    """
+    Same as render_docstring_html, but store the result in the database.
+
+    Parameters
+    ----------
+    doc : Docstring
+    text : str
+        Text of the revision.
+    rev : DocstringRevision or None
+        Revision the text corresponds to, or None for the VCS text.
+
+    """
+    html = models.RenderCache.fetch(doc, rev, RENDER_VERSION)
+    if html is None:
+        dependencies = set()
+        html = render_docstring_html(doc, text, dependencies=dependencies)
+        dependencies.discard(doc.name)
+        models.RenderCache.store(doc, rev, RENDER_VERSION, html,
+                                 dependencies)
+    return html
+
+def _render_body(text, dependencies, **kw):
+    if dependencies is None:
+        return render_html(text, **kw)
+    else:
+        # the memoized output would not record dependencies
+        return _render_html(text, dependencies=dependencies, **kw)
+
+def render_docstring_html(doc, text, dependencies=None):
     if doc.type_code == 'file':
-        return render_sphinx_html(doc, text)
+        return render_sphinx_html(doc, text, dependencies=dependencies)
     
     errors = []
     
@@ -188,7 +397,7 @@ def render_docstring_html(doc, text):
         elif doc.type_code == 'callable':
             docstring = NumpyFunctionDocString(text)
         else:
-            return render_html(text)
+            return _render_body(text, dependencies)
 
         if doc.type_code in ('callable', 'class'):
             had_signature = bool(docstring['Signature'])
@@ -215,7 +424,7 @@ def render_docstring_html(doc, text):
         err_msg = ""
 
     if docstring is None:
-        return err_msg + render_html(text)
+        return err_msg + _render_body(text, dependencies)
     
     # Determine allowed link namespace prefixes
     parts = doc.name.split('.')
@@ -229,9 +438,9 @@ def render_docstring_html(doc, text):
         bases = []
 
     # Docstring body
-    body_html = render_html(unicode(docstring),
-                            resolve_to_wiki=False,
-                            resolve_prefixes=prefixes)
+    body_html = _render_body(unicode(docstring), dependencies,
+                             resolve_to_wiki=False,
+                             resolve_prefixes=prefixes)
 
     # Full HTML output
     t = get_template('docstring/body.html')
@@ -244,7 +453,7 @@ def render_docstring_html(doc, text):
 # Rendering Sphinx documentation
 #------------------------------------------------------------------------------
 
-def render_sphinx_html(doc, text):
+def render_sphinx_html(doc, text, dependencies=None):
     # Determine allowed link namespace prefixes
     parts = doc.name.split('/')
     if len(parts) > 1:
@@ -253,10 +462,10 @@ def render_sphinx_html(doc, text):
         prefixes = []
 
     # Docstring body
-    body_html = render_html(unicode(text),
-                            resolve_to_wiki=False,
-                            resolve_prefixes=prefixes,
-                            resolve_suffixes=['.rst', '.txt'])
+    body_html = _render_body(unicode(text), dependencies,
+                             resolve_to_wiki=False,
+                             resolve_prefixes=prefixes,
+                             resolve_suffixes=['.rst', '.txt'])
 
     # Full HTML output
     t = get_template('docstring/body.html')
@@ -290,7 +290,8 @@ register_generic_role('samp', nodes.literal)
 
 # XXX: :ref: does not work properly
 
-def ref_role(role, rawtext, text, lineno, inliner, options={}, content=[]):
+def split_ref_text(text):
+    """Split the content of a reference role to (text, link)"""
     link = text
 
     m  = re.compile(r'^(.*)\n*<(.*?)>\s*$', re.S).match(text)
@@ -302,7 +303,10 @@ def ref_role(role, rawtext, text, lineno, inliner, options={}, content=[]):
     else:
         m = re.compile(r'^([a-zA-Z0-9._-]*)(.*?)$', re.S).match(text)
         link = m.group(1)
+    return text, link
 
+def ref_role(role, rawtext, text, lineno, inliner, options={}, content=[]):
+    text, link = split_ref_text(text)
     ref = _parse_ref(rawtext, text, link, inliner)
     return [ref], []
 
@@ -337,6 +341,12 @@ def resolve_name(link, inliner, postpone=False):
     uri, name = _resolve(link)
     return uri, name
 
+def add_dependencies(document, names):
+    """Record names the rendered document depends on, if tracked"""
+    dependencies = getattr(document.settings, 'render_dependencies', None)
+    if dependencies is not None:
+        dependencies.update(names)
+
 # Copied from sphinx
 class eqref(nodes.Inline, nodes.TextElement):
     pass
@@ -499,8 +509,13 @@ def auto_directive(dirname, arguments, options, content, lineno,
     target = arguments[0].strip()
     lines = []
 
+    # The inserted text comes from the target docstring
+    add_dependencies(state.document,
+                     [target] + rst._name_prefixes(target))
+
     try:
         doc = models.Docstring.resolve(target)
+        add_dependencies(state.document, [doc.name])
         ndoc = {'Signature': ''}
         if dirname == 'automodule':
             text = doc.text
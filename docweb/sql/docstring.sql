@@ -0,0 +1,4 @@
+CREATE INDEX docweb_docstring_site_timestamp
+ON docweb_docstring (site_id, timestamp);
+CREATE INDEX docweb_docstring_site_type_timestamp
+ON docweb_docstring (site_id, type_, timestamp);
@@ -0,0 +1,4 @@
+CREATE INDEX docweb_docstringalias_parent_alias
+ON docweb_docstringalias (parent_id, alias);
+CREATE INDEX docweb_docstringalias_target
+ON docweb_docstringalias (target);
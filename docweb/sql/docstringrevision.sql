@@ -0,0 +1,4 @@
+CREATE INDEX docweb_docstringrevision_docstring_revno
+ON docweb_docstringrevision (docstring_id, revno);
+CREATE INDEX docweb_docstringrevision_timestamp
+ON docweb_docstringrevision (timestamp);
@@ -0,0 +1,4 @@
+CREATE UNIQUE INDEX docweb_labelcache_site_label
+ON docweb_labelcache (site_id, label);
+CREATE INDEX docweb_labelcache_target
+ON docweb_labelcache (target);
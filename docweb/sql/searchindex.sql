@@ -0,0 +1,4 @@
+CREATE INDEX docweb_searchindex_term
+ON docweb_searchindex (site_id, kind, term);
+CREATE INDEX docweb_searchindex_name
+ON docweb_searchindex (site_id, kind, name);
@@ -0,0 +1,2 @@
+CREATE INDEX docweb_toctreeancestor_docstring_depth
+ON docweb_toctreeancestor (docstring_id, depth);
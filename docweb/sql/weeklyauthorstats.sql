@@ -0,0 +1,2 @@
+CREATE INDEX docweb_weeklyauthorstats_site_week
+ON docweb_weeklyauthorstats (site_id, week);
@@ -0,0 +1,2 @@
+CREATE INDEX docweb_weeklydocstringstats_site_week
+ON docweb_weeklydocstringstats (site_id, week);
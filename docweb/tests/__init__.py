@@ -16,6 +16,8 @@ from test_functional import *
 from test_docstring import *
 from test_toctreecache import *
 from test_rst import *
+from test_utils import *
+from test_indexes import *
 
 # -- Allow Django test command to find the script tests
 test_dir = os.path.join(os.path.dirname(__file__), '..', '..',
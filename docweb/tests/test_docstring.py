@@ -9,7 +9,8 @@ from StringIO import StringIO
 import lxml.etree as etree
 
 import docweb.models as models
-from docweb.docstring_update import update_docstrings_from_xml
+from docweb.docstring_update import (update_docstrings_from_xml,
+                                     dump_docs_as_xml, _compute_merges)
 
 class LocalTestCase(TestCase):
     def setUp(self):
@@ -146,6 +147,63 @@ class TestMerge(LocalTestCase):
         'docs(dir)': '',
     }
 
+    def test_accept_merges(self):
+        """
+        Check that merges accepted in bulk match automatic_merge
+
+        """
+        self.update_docstrings(self.SIMPLE_DATA_1)
+        for name in ['module.func_conflict', 'docs/file_conflict.rst']:
+            self.edit_docstring(name, 'text edited')
+        self.edit_docstring('module.func_merge', 'text edited\n\nmore')
+        self.edit_docstring('docs/file_merge.rst', 'text edited\n\nmore')
+        self.update_docstrings(self.SIMPLE_DATA_2)
+
+        errors = models.Docstring.accept_merges(
+            self.site, ['module.func_merge', 'docs/file_merge.rst',
+                        'module.func_conflict', 'module.func_noop'],
+            'Author')
+        self.assertEqual(errors, [])
+
+        for name in ['module.func_merge', 'docs/file_merge.rst']:
+            doc = self.get_docstring(name)
+            self.assertEqual(doc.text, 'text edited\n\nmore 2')
+            self.assertEqual(doc.merge_status, models.MERGE_NONE)
+            self.assertEqual(doc.base_doc, 'text\n\nmore 2')
+            self.assertEqual(doc.review, models.REVIEW_BEING_WRITTEN)
+            self.failUnless(doc.dirty)
+            rev = doc.revisions.all()[0]
+            self.assertEqual(doc.cur_revno, rev.revno)
+            self.assertEqual((rev.author, rev.comment), ('Author', 'Merged'))
+            self.assertEqual(rev.text, doc.text)
+
+        doc = self.get_docstring('module.func_conflict')
+        self.assertEqual(doc.text, 'text edited')
+        self.assertEqual(doc.merge_status, models.MERGE_CONFLICT)
+
+    def test_parallel_merge(self):
+        tasks = []
+        for j in xrange(150):
+            tasks.append(("text %d edited\n\nmore" % j, "text\n\nmore",
+                          "text\n\nmore %d" % j, 1))
+            tasks.append(("text %d edited" % j, "text", "text %d" % j, 1))
+        tasks.append(("text", "text", "text", None))
+
+        import multiprocessing
+        serial = _compute_merges(tasks)
+        pool = multiprocessing.Pool(2)
+        try:
+            parallel = _compute_merges(tasks, pool)
+        finally:
+            pool.close()
+            pool.join()
+
+        self.assertEqual(parallel, serial)
+        self.assertEqual(serial[0], (models.MERGE_MERGE, "text\n\nmore",
+                                     "text 0 edited\n\nmore 0"))
+        self.assertEqual(serial[1][0], models.MERGE_CONFLICT)
+        self.assertEqual(serial[-1], (models.MERGE_NONE, "text", None))
+
     def test_dir_file_obsoletion(self):
         """
         Check that deleting/obsoletion of 'file' and 'dir' entries works
@@ -289,6 +347,42 @@ class TestEdit(LocalTestCase):
         doc = self.get_docstring('docs/dir/dir2/b')
         doc = self.get_docstring('docs/dir/dir2')
 
+    def test_edit_caches(self):
+        """
+        Check that edits refresh the label and toctree caches only when
+        the labels or toctrees of a 'file' page change.
+
+        """
+        self.update_docstrings(self.EDIT_DATA_1)
+        doc = self.get_docstring('docs/a')
+
+        timer = doc.edit('text\n\n.. _some-label:\n\nmore', 'Author',
+                         'Comment')
+        phases = [phase for phase, t in timer.timings]
+        self.failUnless('revision' in phases)
+        self.failUnless('label and toctree cache' in phases)
+        self.assertEqual(
+            models.LabelCache.on_site.get(label='some-label').target,
+            'docs/a')
+
+        timer = doc.edit('text edited\n\n.. _some-label:\n\nmore',
+                         'Author', 'Comment')
+        phases = [phase for phase, t in timer.timings]
+        self.failUnless('revision' in phases)
+        self.failUnless('label and toctree cache' not in phases)
+
+        doc = self.get_docstring('docs/a')
+        self.assertEqual(doc.text, 'text edited\n\n.. _some-label:\n\nmore')
+        self.assertEqual(doc.revisions.count(), 3)
+        self.assertEqual(doc.merge_status, models.MERGE_NONE)
+        self.failUnless(doc.dirty)
+
+        # no changes: no new revision
+        timer = doc.edit(doc.text, 'Author', 'Comment')
+        phases = [phase for phase, t in timer.timings]
+        self.failUnless('revision' not in phases)
+        self.assertEqual(doc.revisions.count(), 3)
+
     def test_ok_to_apply(self):
         """
         Check that ok_to_apply gets reset on edit
@@ -310,6 +404,318 @@ class TestEdit(LocalTestCase):
         doc = self.get_docstring('docs/a')
         self.failUnless(doc.ok_to_apply == False)
 
+    def test_current_revision_cache(self):
+        """
+        Check that the denormalized latest-revision fields follow edits
+
+        """
+        self.update_docstrings(self.EDIT_DATA_1)
+        doc = self.get_docstring('docs/a')
+        self.assertEqual(doc.cur_revno, None)
+        self.assertEqual(doc.text, 'text')
+
+        self.edit_docstring('docs/a', 'test edit')
+        doc = self.get_docstring('docs/a')
+        rev = doc.revisions.all()[0]
+        self.assertEqual(doc.cur_revno, rev.revno)
+        self.assertEqual(doc.text, 'test edit')
+        self.assertEqual(doc.review, rev.review_code)
+
+        doc.review = models.REVIEW_PROOFED
+        doc = self.get_docstring('docs/a')
+        rev = doc.revisions.all()[0]
+        self.assertEqual(doc.review, models.REVIEW_PROOFED)
+        self.assertEqual(rev.review_code, models.REVIEW_PROOFED)
+        self.failUnless(doc.ok_to_apply)
+        self.failUnless(rev.ok_to_apply)
+
+class TestUpdate(LocalTestCase):
+
+    UPDATE_DATA_1 = {
+        'module(module)': '',
+        'module.func(callable)': 'text',
+        'module.func_alias(alias)': 'module.func',
+        'module.obj(object)': 'text',
+    }
+    UPDATE_DATA_2 = {
+        'module(module)': '',
+        'module.func(callable)': 'text 2',
+        'module.obj2(object)': 'text',
+    }
+
+    def test_repeated_update(self):
+        """
+        Check that pulling the same or changed data updates docstrings
+        and aliases correctly
+
+        """
+        for data in [self.UPDATE_DATA_1, self.UPDATE_DATA_1,
+                     self.UPDATE_DATA_2, self.UPDATE_DATA_1]:
+            self.update_docstrings(data)
+            doc = self.get_docstring('module')
+            aliases = sorted((a.alias, a.target) for a in doc.contents.all())
+            expected = sorted((k[:k.index('(')].split('.')[-1],
+                               k[:k.index('(')])
+                              for k in data.keys() if k.startswith('module.')
+                              and not k.endswith('(alias)'))
+            if data is self.UPDATE_DATA_1:
+                expected.append(('func_alias', 'module.func'))
+                expected.sort()
+            self.assertEqual(aliases, expected)
+
+            doc = self.get_docstring('module.func')
+            self.assertEqual(doc.text, data['module.func(callable)'])
+            self.assertEqual(doc.argspec, '(foo)')
+            self.assertEqual(doc.merge_status, models.MERGE_NONE)
+            self.failIf(doc.dirty)
+
+        self.assertRaises(models.Docstring.DoesNotExist,
+                          self.get_docstring, 'module.obj2')
+
+    def test_get_children(self):
+        """
+        Check that the children of a docstring are grouped by type
+
+        """
+        self.update_docstrings(self.UPDATE_DATA_1)
+        self.edit_docstring('module.obj', 'edited')
+        doc = self.get_docstring('module.obj')
+        doc.review = models.REVIEW_REVISED
+        doc.save()
+
+        doc = self.get_docstring('module')
+        children = doc.get_children()
+        self.assertEqual(sorted(children.keys()), ['callable', 'object'])
+        self.assertEqual([(c.alias, c.target, c.direct_child)
+                          for c in children['callable']],
+                         [('func', 'module.func', True),
+                          ('func_alias', 'module.func', True)])
+        self.assertEqual([(c.alias, c.status_code)
+                          for c in children['object']],
+                         [('obj', models.REVIEW_STATUS_CODES[
+                             models.REVIEW_REVISED])])
+        self.assertEqual(doc.child_modules, [])
+
+    def test_toctree_chain(self):
+        """
+        Check that the toctree ancestry follows pulls and edits
+
+        """
+        data = {
+            'module(module)': '',
+            'module.func(callable)': 'text',
+            'docs(dir)': '',
+            'docs/index.rst(file)': '.. toctree::\n\n   intro\n',
+            'docs/intro.rst(file)': ('.. toctree::\n\n   index\n\n'
+                                     '.. autosummary::\n   :toctree:\n\n'
+                                     '   module.func\n'),
+        }
+        self.update_docstrings(data)
+
+        def get_chain(name):
+            doc = models.Docstring.on_site.get(name=name)
+            return [d.name for d in models.ToctreeCache.get_chain(doc)]
+
+        # the index page is in a cycle
+        self.assertEqual(get_chain('docs/index.rst'),
+                         ['docs/intro.rst', 'docs/index.rst'])
+        self.assertEqual(get_chain('module.func'),
+                         ['docs/index.rst', 'docs/intro.rst', 'module.func'])
+
+        self.edit_docstring('docs/index.rst', 'no toctree')
+        self.assertEqual(get_chain('docs/index.rst'),
+                         ['docs/intro.rst', 'docs/index.rst'])
+        self.assertEqual(get_chain('module.func'),
+                         ['docs/intro.rst', 'module.func'])
+        self.assertEqual(get_chain('docs/intro.rst'), ['docs/intro.rst'])
+
+        # edits move the whole subtree below the page
+        self.edit_docstring('docs/index.rst', '.. toctree::\n\n   intro\n')
+        self.assertEqual(get_chain('docs/intro.rst'),
+                         ['docs/index.rst', 'docs/intro.rst'])
+        self.assertEqual(get_chain('module.func'),
+                         ['docs/index.rst', 'docs/intro.rst', 'module.func'])
+
+        # ... as a full rebuild would
+        def get_rows():
+            return sorted(models.ToctreeAncestor.objects.values_list(
+                'docstring', 'ancestor', 'depth'))
+        rows = get_rows()
+        models.ToctreeCache.update_ancestors(self.site)
+        self.assertEqual(get_rows(), rows)
+
+    def test_pull_timestamp(self):
+        """
+        Check that pulls record their timestamp, and that obsoletion is
+        decided by it
+
+        """
+        self.update_docstrings(self.UPDATE_DATA_1)
+        self.update_docstrings(self.UPDATE_DATA_2)
+
+        timestamp = models.PullMetadata.objects.get(site=self.site).timestamp
+        self.assertEqual(models.Docstring.get_current_timestamp(), timestamp)
+
+        doc = models.Docstring.on_site.get(name='module.obj2')
+        self.assertEqual(doc.timestamp, timestamp)
+        self.failIf(doc.is_obsolete)
+        doc = models.Docstring.on_site.get(name='module.obj')
+        self.failUnless(doc.is_obsolete)
+        self.assertEqual(
+            sorted(models.Docstring.get_non_obsolete().values_list(
+                'name', flat=True)),
+            ['module', 'module.func', 'module.obj2'])
+
+        # without a recorded pull, the newest docstring timestamp is used
+        models.PullMetadata.objects.all().delete()
+        models.PullMetadata.clear_cache()
+        self.assertEqual(models.Docstring.get_current_timestamp(), timestamp)
+
+    def test_incremental_update(self):
+        """
+        Check that incremental pulls produce the same docstrings and
+        label cache as full pulls
+
+        """
+        def get_state():
+            docs = sorted((d.name, d.text, d.timestamp == timestamp)
+                          for d in models.Docstring.on_site.all()
+                          for timestamp in [
+                              models.Docstring.get_current_timestamp()])
+            labels = sorted((l.label, l.target)
+                            for l in models.LabelCache.on_site.all())
+            return docs, labels
+
+        sequence = [self.UPDATE_DATA_1, self.UPDATE_DATA_2,
+                    self.UPDATE_DATA_2, self.UPDATE_DATA_1]
+
+        states = {}
+        for incremental in (False, True):
+            models.Docstring.on_site.all().delete()
+            models.LabelCache.on_site.all().delete()
+            states[incremental] = []
+            for data in sequence:
+                update_docstrings_from_xml(self.site, form_test_xml(data),
+                                           incremental=incremental)
+                states[incremental].append(get_state())
+        self.assertEqual(states[False], states[True])
+
+    def test_file_page_caches(self):
+        """
+        Check that pulls cache the labels, toctrees and titles of 'file'
+        pages, without duplicating labels
+
+        """
+        data = {
+            'module(module)': '',
+            'module.func(callable)': 'text',
+            'docs(dir)': '',
+            'docs/index.rst(file)': ('Index\n=====\n\n.. _index-label:\n\n'
+                                     '.. toctree::\n\n   intro\n\n'
+                                     '.. module:: module\n\n'
+                                     '.. function:: func\n'),
+            'docs/intro.rst(file)': '.. _index-label:\n\ntext',
+        }
+        for incremental in (False, True, True):
+            update_docstrings_from_xml(self.site, form_test_xml(data),
+                                       incremental=incremental)
+
+            labels = sorted((l.label, l.target)
+                            for l in models.LabelCache.on_site.all())
+            self.assertEqual(len(labels), len(set(l for l, t in labels)))
+            self.failUnless(('module', 'module') in labels)
+            self.failUnless(('module.func', 'module.func') in labels)
+            self.failUnless(('index-label', 'docs/index.rst') in labels or
+                            ('index-label', 'docs/intro.rst') in labels)
+
+            doc = self.get_docstring('docs/index.rst')
+            self.assertEqual(doc.title, 'Index')
+            children = sorted(t.child.name
+                              for t in doc.toctree_children.all())
+            self.assertEqual(children, ['docs/intro.rst', 'module'])
+
+    def test_dump(self):
+        """
+        Check that the XML dump round-trips the pulled data
+
+        """
+        self.update_docstrings(self.UPDATE_DATA_1)
+        self.edit_docstring('module.func', 'edited')
+
+        out = StringIO()
+        dump_docs_as_xml(out)
+        out.seek(0)
+        root = etree.parse(out).getroot()
+
+        els = dict((el.attrib['id'], el) for el in root)
+        self.assertEqual(sorted(els.keys()),
+                         ['module', 'module.func', 'module.obj'])
+        self.assertEqual(els['module.func'].text, 'edited')
+        self.assertEqual(els['module.func'].attrib['argspec'], '(foo)')
+        refs = sorted((r.attrib['name'], r.attrib['ref'])
+                      for r in els['module'].findall('ref'))
+        self.assertEqual(refs, [('func', 'module.func'),
+                                ('func_alias', 'module.func'),
+                                ('obj', 'module.obj')])
+
+    def test_resolve(self):
+        """
+        Check that name resolution follows aliases, and sees the
+        changes made by pulls
+
+        """
+        resolve = models.Docstring.resolve
+
+        self.update_docstrings(self.UPDATE_DATA_1)
+        self.assertEqual(resolve('module.func_alias').name, 'module.func')
+        self.assertEqual(resolve('module.func').name, 'module.func')
+        self.assertRaises(models.Docstring.DoesNotExist,
+                          resolve, 'module.obj2')
+
+        self.update_docstrings(self.UPDATE_DATA_2)
+        self.assertEqual(resolve('module.obj2').name, 'module.obj2')
+        self.assertRaises(models.Docstring.DoesNotExist,
+                          resolve, 'module.func_alias')
+
+    def test_name_index_token(self):
+        """
+        Check that the name index is kept until its token in the
+        database changes
+
+        """
+        self.update_docstrings(self.UPDATE_DATA_1)
+        index = models.DocstringNameIndex.get(self.site)
+        self.failUnless(models.DocstringNameIndex.get(self.site) is index)
+        self.failUnless(models.PullMetadata.get_names_token(self.site))
+
+        # as done by a pull in another process
+        models.PullMetadata.objects.filter(site=self.site).update(
+            names_token='other')
+        models.PullMetadata.clear_cache()
+        self.failIf(models.DocstringNameIndex.get(self.site) is index)
+
+        # new docstrings change the token
+        index = models.DocstringNameIndex.get(self.site)
+        timestamp = models.Docstring.get_current_timestamp()
+        doc = models.Docstring(name='docs', type_code='dir', source_doc='',
+                               base_doc='', timestamp=timestamp,
+                               site=self.site)
+        doc.save()
+        self.failIf(models.DocstringNameIndex.get(self.site) is index)
+        self.assertEqual(models.Docstring.resolve('docs').name, 'docs')
+
+    def test_timings(self):
+        """
+        Check that the update reports timings for its phases
+
+        """
+        timer = update_docstrings_from_xml(
+            self.site, form_test_xml(self.UPDATE_DATA_1))
+        phases = [phase for phase, t in timer.timings]
+        for phase in ['parse', 'diff', 'write', 'merge', 'label cache']:
+            self.failUnless(phase in phases, phase)
+
+
 # -----------------------------------------------------------------------------
 # Utilities
 # -----------------------------------------------------------------------------
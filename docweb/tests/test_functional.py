@@ -3,10 +3,12 @@ Functional tests for Pydocweb: these go through real-use patterns with
 the Django web client.
 
 """
-import os, sys, re
+import os, sys, re, datetime
 from django.test import TestCase
 from django.conf import settings
 
+import docweb.models as models
+
 PASSWORD='asdfasd'
 
 class AccessTests(TestCase):
@@ -170,6 +172,92 @@ class DocstringTests(TestCase):
         self.assertContains(response, 'sample_module')
         self.assertContains(response, 'sample_module.sample1')
 
+    def test_docstring_index_review(self):
+        doc = models.Docstring.on_site.get(name='sample_module.sample1.func1')
+        doc.edit('New text', 'Editor Editorer', 'Comment')
+        doc.review = models.REVIEW_PROOFED
+        response = self.client.get('/docs/')
+        self.assertContains(
+            response,
+            '<td class="proofed"><a href="/docs/sample_module.sample1.func1/">')
+
+    def test_docstring_stats(self):
+        doc = models.Docstring.on_site.get(name='sample_module.sample1.func1')
+        doc.edit('Some new words in here', 'Editor Editorer', 'Comment')
+        doc.review = models.REVIEW_NEEDS_REVIEW
+
+        rev = doc.revisions.all()[0]
+        self.failUnless(rev.words_changed > 0)
+
+        week = models.get_week_start(rev.timestamp)
+        stats = models.WeeklyDocstringStats.objects.get(docstring=doc)
+        self.assertEqual(stats.week, week)
+        self.assertEqual(stats.end_rev, rev.revno)
+        self.assertEqual(stats.start_rev, None)
+        self.assertEqual(stats.review_code, models.REVIEW_NEEDS_REVIEW)
+        self.assertEqual(stats.words, rev.words_changed)
+
+        author_stats = models.WeeklyAuthorStats.objects.get(week=week)
+        self.assertEqual(author_stats.author, 'Editor Editorer')
+
+        # unimportant edits count no words
+        doc.review = models.REVIEW_UNIMPORTANT
+        stats = models.WeeklyDocstringStats.objects.get(docstring=doc)
+        self.assertEqual(stats.review_code, models.REVIEW_UNIMPORTANT)
+        self.assertEqual(stats.words, 0)
+        author_stats = models.WeeklyAuthorStats.objects.get(week=week)
+        self.assertEqual(author_stats.words, 0)
+
+        doc.review = models.REVIEW_NEEDS_REVIEW
+        stats = models.WeeklyDocstringStats.objects.get(docstring=doc)
+        self.assertEqual(stats.words, rev.words_changed)
+        author_stats = models.WeeklyAuthorStats.objects.get(week=week)
+        self.assertEqual(author_stats.words, rev.words_changed)
+
+        # rebuilding from scratch gives the same result
+        models.rebuild_weekly_stats(doc.site)
+        stats = models.WeeklyDocstringStats.objects.get(docstring=doc)
+        self.assertEqual(stats.end_rev, rev.revno)
+        self.assertEqual(stats.review_code, models.REVIEW_NEEDS_REVIEW)
+        self.assertEqual(stats.words, rev.words_changed)
+
+        response = self.client.get('/stats/')
+        self.assertContains(response, 'Editor Editorer')
+        self.assertContains(response, 'sample_module.sample1.func1')
+
+    def test_compute_weekly_stats(self):
+        T = datetime.datetime
+        needs_review = models.REVIEW_NEEDS_REVIEW
+        unimportant = models.REVIEW_UNIMPORTANT
+        revisions = [
+            # Monday 2010-01-04 -- Sunday 2010-01-10
+            ('a', 1, 'alice', needs_review, 10, T(2010, 1, 4, 10, 0)),
+            ('b', 2, 'bob', unimportant, 5, T(2010, 1, 6, 12, 0)),
+            ('a', 3, 'bob', needs_review, -3, T(2010, 1, 10, 23, 59, 59)),
+            # Monday 2010-01-11
+            ('a', 4, 'alice', needs_review, 7, T(2010, 1, 11, 0, 0)),
+            ('c', 5, 'bob', needs_review, 2, T(2010, 1, 12, 8, 0)),
+        ]
+        start_revs = {'c': 0}
+        weeks = models.compute_weekly_stats(revisions, start_revs)
+
+        self.assertEqual(len(weeks), 2)
+
+        week, docstrings, authors = weeks[0]
+        self.assertEqual(week, T(2010, 1, 4))
+        self.assertEqual(docstrings, {'a': [10, None, 3, needs_review],
+                                      'b': [0, None, 2, unimportant]})
+        self.assertEqual(authors, {'alice': 10, 'bob': 0})
+
+        week, docstrings, authors = weeks[1]
+        self.assertEqual(week, T(2010, 1, 11))
+        self.assertEqual(docstrings, {'a': [7, 3, 4, needs_review],
+                                      'c': [2, 0, 5, needs_review]})
+        self.assertEqual(authors, {'alice': 7, 'bob': 2})
+
+        # the last revisions of closed weeks are carried over
+        self.assertEqual(start_revs, {'a': 3, 'b': 2, 'c': 0})
+
     def test_docstring_page(self):
         response = self.client.get('/docs/sample_module/')
         self.assertContains(response, 'sample1')
@@ -577,6 +665,12 @@ class PatchTests(TestCase):
 class SearchTests(TestCase):
     fixtures = ['tests/docstrings.json', 'tests/wiki.json']
 
+    def setUp(self):
+        # Fixtures bypass the updates of the search index
+        site = models.Site.objects.get_current()
+        models.SearchIndex.index_docstrings(site)
+        models.SearchIndex.index_wiki_pages(site)
+
     def test_search_page(self):
         response = self.client.get('/search/')
         self.assertContains(response, '<form action="/search/"')
@@ -601,6 +695,80 @@ class SearchTests(TestCase):
                                      })
         self.assertContains(response, '>Help Edit Docstring</a>')
 
+    def test_search_pages(self):
+        import pydocweb.docweb.views_search as views_search
+        old_size = views_search.SEARCH_PAGE_SIZE
+        views_search.SEARCH_PAGE_SIZE = 2
+        try:
+            response = self.client.get('/search/',
+                                       {'type_code': 'any', 'fulltext': '*'})
+            self.assertContains(response, '>sample_module</a>')
+            self.assertContains(response, '>sample_module.sample1</a>')
+            self.assertContains(response, '(1 more)')
+            next_url = re.search('href="([^"]*after=[^"]*)"',
+                                 response.content).group(1)
+            response = self.client.get(
+                '/search/' + next_url.replace('&amp;', '&'))
+            self.assertContains(response, '>sample_module.sample1.func1</a>')
+            self.failIf('>sample_module</a>' in response.content)
+        finally:
+            views_search.SEARCH_PAGE_SIZE = old_size
+
+    def test_search_index(self):
+        doc = models.Docstring.on_site.get(name='sample_module.sample1.func1')
+        doc.edit('Frobnicate the frobnicator.', 'author', 'comment')
+        doc = models.Docstring.on_site.get(name='sample_module.sample1')
+        doc.edit('Frobnicate.\n\nFrobnicate more.', 'author', 'comment')
+
+        # ranking, and only current texts
+        names = [r[0] for r in models.Docstring.fulltext_search('frobnicate')]
+        self.assertEqual(names, ['sample_module.sample1',
+                                 'sample_module.sample1.func1'])
+        self.assertEqual(models.Docstring.fulltext_search('docstring'), [])
+
+        # prefixes, all words required, and inversion
+        names = [r[0] for r in models.Docstring.fulltext_search('frob*')]
+        self.assertEqual(len(names), 2)
+        names = [r[0] for r in models.Docstring.fulltext_search(
+            'frobnicate frobnicator')]
+        self.assertEqual(names, ['sample_module.sample1.func1'])
+        names = [r[0] for r in models.Docstring.fulltext_search(
+            'frobnicate', invert=True)]
+        self.assertEqual(names, ['sample_module'])
+
+        # snippets
+        site = models.Site.objects.get_current()
+        snippets = models.SearchIndex.get_snippets(
+            site, models.SearchIndex.DOCSTRING,
+            ['sample_module.sample1.func1'], 'frobnicator')
+        self.assertEqual(snippets['sample_module.sample1.func1'],
+                         'Frobnicate the <strong class="match">'
+                         'frobnicator</strong>.')
+
+        # name matches rank first
+        names = [r[0] for r in models.Docstring.fulltext_search('func1')]
+        self.assertEqual(names, ['sample_module.sample1.func1'])
+        doc.edit('Frobnicate.\n\nSee func1.', 'author', 'comment')
+        names = [r[0] for r in models.Docstring.fulltext_search('func1')]
+        self.assertEqual(names, ['sample_module.sample1.func1',
+                                 'sample_module.sample1'])
+
+        # wiki pages
+        page = models.WikiPage.on_site.get(name='Front Page')
+        page.edit('Frobnicate!', 'author', 'comment')
+        names = [r[0] for r in models.WikiPage.fulltext_search('frobnicate')]
+        self.assertEqual(names, ['Front Page'])
+
+        # wiki pages with no text
+        empty = models.WikiPage(name='Empty Page', site=page.site)
+        empty.save()
+        names = [r[0] for r in models.WikiPage.fulltext_search('')]
+        self.failUnless('Empty Page' in names)
+        self.failIf('Front Page' in names)
+        page.edit('', 'author', 'comment')
+        names = [r[0] for r in models.WikiPage.fulltext_search('')]
+        self.failUnless('Front Page' in names)
+
 
 def _follow_redirect(response, data={}):
     if response.status_code not in (301, 302):
@@ -0,0 +1,96 @@
+"""
+Query plan regression tests: check that the frequent queries use
+indexes instead of scanning whole tables.
+
+"""
+from django.test import TestCase
+from django.conf import settings
+from django.db import connection
+
+import docweb.models as models
+from docweb.docstring_update import update_docstrings_from_xml
+from test_docstring import form_test_xml
+
+class TestIndexes(TestCase):
+
+    DATA = {
+        'module(module)': '',
+        'module.func(callable)': 'text',
+        'module.Class(class)': 'text',
+        'docs(dir)': '',
+        'docs/index.rst(file)': '.. toctree::\n\n   intro\n',
+        'docs/intro.rst(file)': 'text',
+    }
+
+    def setUp(self):
+        self.site = models.Site.objects.get_current()
+        update_docstrings_from_xml(self.site, form_test_xml(self.DATA))
+
+    def test_resolve(self):
+        models.DocstringNameIndex.get(self.site)
+        queries = record_queries(models.Docstring.resolve, 'module.func')
+        self.assertUsesIndexes(queries)
+
+    def test_get_non_obsolete(self):
+        queries = record_queries(
+            lambda: list(models.Docstring.get_non_obsolete()))
+        self.assertUsesIndexes(queries)
+
+    def test_get_children(self):
+        doc = models.Docstring.on_site.get(name='module')
+        queries = record_queries(doc.get_children)
+        self.assertEqual(len(queries), 1)
+        self.assertUsesIndexes(queries)
+
+    def test_get_chain(self):
+        doc = models.Docstring.on_site.get(name='docs/intro.rst')
+        chain = []
+        queries = record_queries(
+            lambda: chain.extend(models.ToctreeCache.get_chain(doc)))
+        self.assertEqual([d.name for d in chain],
+                         ['docs/index.rst', 'docs/intro.rst'])
+        self.assertEqual(len(queries), 1)
+        self.assertUsesIndexes(queries)
+
+    def assertUsesIndexes(self, queries):
+        """Fail if the SQLite query plan of a query has a table scan"""
+        self.failUnless(queries)
+        if 'sqlite' not in settings.DATABASES['default']['ENGINE']:
+            return
+        cursor = connection.cursor()
+        for sql, params in queries:
+            cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+            for row in cursor.fetchall():
+                detail = row[-1].upper()
+                if (detail.startswith('SCAN') or detail.startswith('TABLE')) \
+                       and 'INDEX' not in detail \
+                       and 'PRIMARY KEY' not in detail:
+                    self.fail("Table scan (%s) in query: %s" % (row[-1], sql))
+
+class QueryRecorder(object):
+    """Database cursor wrapper recording the SELECT queries executed"""
+    def __init__(self, cursor, queries):
+        self.cursor = cursor
+        self.queries = queries
+
+    def execute(self, sql, params=()):
+        if sql.strip().upper().startswith('SELECT'):
+            self.queries.append((sql, params))
+        return self.cursor.execute(sql, params)
+
+    def __getattr__(self, name):
+        return getattr(self.cursor, name)
+
+    def __iter__(self):
+        return iter(self.cursor)
+
+def record_queries(func, *args):
+    """Call func(*args) and return the SELECT queries it executed"""
+    queries = []
+    get_cursor = connection.cursor
+    connection.cursor = lambda: QueryRecorder(get_cursor(), queries)
+    try:
+        func(*args)
+    finally:
+        del connection.cursor
+    return queries
@@ -33,3 +33,126 @@ class RstTests(TestCase):
         html = rst.render_html(':review:`sample_module.sample1.func1`',
                                cache_max_age=0)
         self.failUnless('class="proofed' in html)
+
+    def test_render_cache(self):
+        """Check that rendered docstrings are cached and invalidated"""
+        doc = models.Docstring.on_site.get(name='sample_module.sample1.func1')
+        html = rst.render_docstring_html_cached(doc, doc.text, None)
+        self.assertEqual(models.RenderCache.fetch(doc, None,
+                                                  rst.RENDER_VERSION),
+                         html)
+
+        # a new revision is cached separately
+        doc.edit('New text', 'author', 'comment')
+        text, rev = doc.get_rev_text('cur')
+        self.assertEqual(models.RenderCache.fetch(doc, rev,
+                                                  rst.RENDER_VERSION),
+                         None)
+        html = rst.render_docstring_html_cached(doc, text, rev)
+        self.failUnless('New text' in html)
+        self.assertEqual(models.RenderCache.fetch(doc, rev,
+                                                  rst.RENDER_VERSION),
+                         html)
+
+        # storing again does not duplicate the body, and only the
+        # body of the current text is kept besides the stored one
+        models.RenderCache.store(doc, rev, rst.RENDER_VERSION, html)
+        rst.render_docstring_html_cached(doc, doc.source_doc, None)
+        self.assertEqual(
+            sorted(models.RenderCache.objects.filter(
+                docstring=doc).values_list('revno', flat=True)),
+            [None, rev.revno])
+
+        doc.edit('Newer text', 'author', 'comment')
+        text, rev = doc.get_rev_text('cur')
+        rst.render_docstring_html_cached(doc, text, rev)
+        self.assertEqual(
+            list(models.RenderCache.objects.filter(
+                docstring=doc).values_list('revno', flat=True)),
+            [rev.revno])
+
+        # invalidation
+        models.RenderCache.invalidate([doc.name])
+        self.assertEqual(models.RenderCache.fetch(doc, rev,
+                                                  rst.RENDER_VERSION),
+                         None)
+
+    def test_render_dependencies(self):
+        """Check that rendered pages are invalidated when link targets change"""
+        page = models.Docstring.on_site.get(name='sample_module.sample1')
+        func1 = models.Docstring.on_site.get(name='sample_module.sample1.func1')
+        page.edit(':obj:`sample_module.sample1.func1`, '
+                  ':obj:`sample_module.sample1.func2`', 'author', 'comment')
+
+        def render():
+            text, rev = page.get_rev_text('cur')
+            return rst.render_docstring_html_cached(page, text, rev)
+
+        def is_cached():
+            text, rev = page.get_rev_text('cur')
+            return models.RenderCache.fetch(page, rev,
+                                            rst.RENDER_VERSION) is not None
+
+        # changes in a resolved target
+        html = render()
+        self.failUnless('/docs/sample_module.sample1.func1/' in html)
+        self.failIf('/docs/sample_module.sample1.func2/' in html)
+        self.failUnless(is_cached())
+        func1.edit('New text', 'author', 'comment')
+        self.failIf(is_cached())
+
+        # unrelated changes
+        render()
+        models.LabelCache.cache_docstring(func1)
+        self.failUnless(is_cached())
+
+        # appearance of a missing target
+        func2 = models.Docstring(name='sample_module.sample1.func2',
+                                 type_code='callable', site=func1.site,
+                                 timestamp=func1.timestamp,
+                                 file_name=func1.file_name, line_number=0,
+                                 source_doc='', base_doc='')
+        func2.save()
+        models.LabelCache.cache_docstring(func2)
+        self.failIf(is_cached())
+        html = render()
+        self.failUnless('/docs/sample_module.sample1.func2/' in html)
+
+    def test_prefetch(self):
+        """Check that batched name resolution agrees with _resolve_name"""
+        names = ['sample_module.sample1.func1', 'sample1.func1',
+                 'sample_module.sample1_alias.func1', 'nonexistent',
+                 'Wiki Page']
+        prefixes = ['sample_module.']
+
+        writer = rst.RstWriter(resolve_to_wiki=True,
+                               resolve_prefixes=prefixes,
+                               dependencies=set())
+        writer.prefetch(names)
+        self.failUnless(('sample_module.sample1.func1', False)
+                        in writer.reference_cache)
+
+        expected = rst.RstWriter(resolve_to_wiki=True,
+                                 resolve_prefixes=prefixes,
+                                 dependencies=set())
+        for name in names:
+            try:
+                ref = expected._resolve_name(name)
+            except ValueError:
+                ref = None
+            try:
+                self.assertEqual(writer._resolve_name(name), ref)
+            except ValueError:
+                self.assertEqual(None, ref)
+        self.assertEqual(writer.dependencies, expected.dependencies)
+
+    def test_collect_reference_names(self):
+        text = (":obj:`numpy.foo` and `bar`_ and ``literal`` and "
+                ":ref:`Title <baz>`\n\n"
+                ".. toctree::\n   :maxdepth: 2\n\n   intro\n   routines.rst\n\n"
+                "quux")
+        names = rst.collect_reference_names(text)
+        for name in ['numpy.foo', 'bar', 'baz', 'intro', 'routines.rst']:
+            self.failUnless(name in names, name)
+        self.failIf('literal' in names)
+        self.failIf('quux' in names)
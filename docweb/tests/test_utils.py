@@ -0,0 +1,104 @@
+import random
+from django.test import TestCase
+
+from docweb.utils import (diff_sequences, diff_words, unified_diff,
+                          count_words_changed, html_diff_text, merge_3way)
+
+class DiffTests(TestCase):
+    def _check_opcodes(self, a, b):
+        opcodes = diff_sequences(a, b)
+        i = j = 0
+        result = []
+        for tag, i1, i2, j1, j2 in opcodes:
+            self.assertEqual((i1, j1), (i, j))
+            if tag == 'equal':
+                self.assertEqual(a[i1:i2], b[j1:j2])
+            result.extend(b[j1:j2])
+            i, j = i2, j2
+        self.assertEqual((i, j), (len(a), len(b)))
+        self.assertEqual(result, b)
+        return opcodes
+
+    def test_diff_sequences(self):
+        self.assertEqual(diff_sequences([], []), [])
+        self.assertEqual(diff_sequences("abc", "abc"),
+                         [('equal', 0, 3, 0, 3)])
+        self.assertEqual(diff_sequences("abxc", "abyc"),
+                         [('equal', 0, 2, 0, 2), ('replace', 2, 3, 2, 3),
+                          ('equal', 3, 4, 3, 4)])
+
+        rnd = random.Random(1234)
+        for k in xrange(200):
+            a = [rnd.choice("abcd") for j in xrange(rnd.randint(0, 40))]
+            b = list(a)
+            for j in xrange(rnd.randint(0, 5)):
+                b.insert(rnd.randint(0, len(b)), rnd.choice("abcde"))
+                if b and rnd.random() < 0.5:
+                    del b[rnd.randint(0, len(b) - 1)]
+            self._check_opcodes(a, b)
+
+    def test_repeated_words(self):
+        words = ("the %s of the array" % w for w in ["sum", "product"] * 500)
+        old_text = " ".join(words)
+        new_text = old_text.replace("the sum of", "the total sum of", 1)
+        self.assertEqual(diff_words(old_text, new_text), (1, 0))
+        self.assertEqual(count_words_changed(old_text, new_text), 1)
+        self.assertEqual(diff_words(new_text, old_text), (0, 1))
+
+    def test_unified_diff(self):
+        a = ["%d\n" % j for j in xrange(20)]
+        b = list(a)
+        b[10] = "x\n"
+        self.assertEqual(unified_diff(a, b, 'a', 'b'),
+                         ['--- a\n', '+++ b\n', '@@ -8,7 +8,7 @@\n',
+                          ' 7\n', ' 8\n', ' 9\n', '-10\n', '+x\n',
+                          ' 11\n', ' 12\n', ' 13\n'])
+        self.assertEqual(unified_diff(a, a), [])
+
+    def test_html_diff_intraline(self):
+        a = "Sum of array elements.\n\na : array_like\n    Input <data>.\n"
+        b = "Sum of the array elements.\n\na : ndarray\n    Input <data>.\n"
+        html = html_diff_text(a, b)
+        self.failUnless('<span class="diff-add">+a : ndarray\n</span>'
+                        in html)
+        self.failUnless('&lt;data&gt;' in html)
+
+        html = html_diff_text(a, b, intraline=True)
+        self.failUnless('<span class="diff-add">+Sum of '
+                        '<span class="diff-add-word">the </span>'
+                        'array elements.\n</span>' in html)
+        self.failUnless('<span class="diff-del">-a : '
+                        '<span class="diff-del-word">array_like</span>\n'
+                        '</span>' in html)
+        self.failUnless('&lt;data&gt;' in html)
+        self.assertEqual(html_diff_text(a, a, intraline=True), "")
+
+class MergeTests(TestCase):
+    def test_merge_clean(self):
+        base = "a\nb\nc\nd\ne\n"
+        mine = "a\nb edited\nc\nd\ne\n"
+        other = "a\nb\nc\nd\ne 2\nf\n"
+        self.assertEqual(merge_3way(mine, base, other),
+                         ("a\nb edited\nc\nd\ne 2\nf", False))
+        self.assertEqual(merge_3way(mine, base, mine),
+                         ("a\nb edited\nc\nd\ne", False))
+
+    def test_merge_conflict(self):
+        base = "a\nb\nc\n"
+        mine = "a\nb web\nc\n"
+        other = "a\nb vcs\nc\n"
+        self.assertEqual(merge_3way(mine, base, other),
+                         ("a\n"
+                          "<<<<<<< new vcs version\n"
+                          "b vcs\n"
+                          "=======\n"
+                          "b web\n"
+                          ">>>>>>> web version\n"
+                          "c", True))
+
+    def test_merge_non_ascii(self):
+        base = u"\u00e4\nb\nc\n"
+        mine = u"\u00e4 \u2202\nb\nc\n"
+        other = u"\u00e4\nb\nc \u2203\n"
+        self.assertEqual(merge_3way(mine, base, other),
+                         (u"\u00e4 \u2202\nb\nc \u2203", False))
@@ -1,8 +1,8 @@
+import re
 import time
-import difflib
+import bisect
 import cgi
-import tempfile
-import subprocess
+import hashlib
 import cPickle as pickle
 
 from django.shortcuts import render_to_response, get_object_or_404
@@ -86,62 +86,419 @@ def merge_3way(mine, base, other):
         Whether a conflict occurred in merge.
 
     """
-    # 1. Try to use Bzr's merge tool
-    try:
-        from bzrlib.merge3 import Merge3
-        mg = Merge3(base.splitlines(), other.splitlines(), mine.splitlines())
-        lines = mg.merge_lines(name_b="web version",
-                               name_a="new vcs version",
-                               name_base="old vcs version",
-                               reprocess=True)
-        text = strip_spurious_whitespace("\n".join(
-            map(lambda x: x.rstrip(), lines)))
-        return text, ("<<<<<<<" in text)
-    except ImportError:
-        pass
-
-    # 2. Fall back to merge command
-    f1 = tempfile.NamedTemporaryFile()
-    f2 = tempfile.NamedTemporaryFile()
-    f3 = tempfile.NamedTemporaryFile()
-    f1.write(mine.encode('iso-8859-1'))
-    f2.write(base.encode('iso-8859-1'))
-    f3.write(other.encode('iso-8859-1'))
-    f1.flush()
-    f2.flush()
-    f3.flush()
-
-    p = subprocess.Popen(['merge', '-p',
-                          '-L', 'web version',
-                          '-L', 'old vcs version',
-                          '-L', 'new vcs version',
-                          f1.name, f2.name, f3.name],
-                         stdout=subprocess.PIPE,
-                         stderr=subprocess.PIPE)
-    out, err = p.communicate()
-    if p.returncode != 0:
-        return out.decode('iso-8859-1'), True
-    else:
-        return out.decode('iso-8859-1'), False
+    lines, conflict = merge3_lines(base.splitlines(), other.splitlines(),
+                                   mine.splitlines(),
+                                   name_a="new vcs version",
+                                   name_b="web version")
+    text = strip_spurious_whitespace("\n".join(
+        map(lambda x: x.rstrip(), lines)))
+    return text, conflict
 
-def diff_text(text_a, text_b, label_a="previous", label_b="current"):
-    if isinstance(text_a, unicode):
-        text_a = text_a.encode('utf-8')
-    if isinstance(text_b, unicode):
-        text_b = text_b.encode('utf-8')
-    
-    lines_a = text_a.splitlines(1)
-    lines_b = text_b.splitlines(1)
-    if not lines_a: lines_a = [""]
-    if not lines_b: lines_b = [""]
-    if not lines_a[-1].endswith('\n'): lines_a[-1] += "\n"
-    if not lines_b[-1].endswith('\n'): lines_b[-1] += "\n"
-    return "".join(difflib.unified_diff(lines_a, lines_b,
-                                        fromfile=label_a,
-                                        tofile=label_b))
+def merge3_lines(base, a, b, name_a="a", name_b="b"):
+    """
+    Merge the changes from `base` to `a` and from `base` to `b`,
+    in the manner of diff3 / bzr's Merge3 with reprocessing.
+
+    Conflicting regions are output as::
+
+        <<<<<<< name_a
+        ...
+        =======
+        ...
+        >>>>>>> name_b
+
+    Returns
+    -------
+    lines : list of str
+        Merged lines.
+    conflict : bool
+        Whether there were conflicts.
+
+    """
+    out = []
+    conflict = False
+    for region in _merge3_regions(base, a, b):
+        what = region[0]
+        if what == 'unchanged':
+            out.extend(base[region[1]:region[2]])
+        elif what in ('a', 'same'):
+            out.extend(a[region[1]:region[2]])
+        elif what == 'b':
+            out.extend(b[region[1]:region[2]])
+        else:
+            conflict = True
+            out.append('<<<<<<< ' + name_a)
+            out.extend(a[region[1]:region[2]])
+            out.append('=======')
+            out.extend(b[region[3]:region[4]])
+            out.append('>>>>>>> ' + name_b)
+    return out, conflict
+
+def _matching_blocks(a, b):
+    return [(i1, j1, i2 - i1) for tag, i1, i2, j1, j2 in diff_sequences(a, b)
+            if tag == 'equal']
+
+def _merge3_sync_regions(base, a, b):
+    """
+    Return regions ``(base1, base2, a1, a2, b1, b2)`` where all three
+    texts agree, ending with an empty region at the end of the texts.
+
+    """
+    amatches = _matching_blocks(base, a)
+    bmatches = _matching_blocks(base, b)
+
+    regions = []
+    ia = ib = 0
+    while ia < len(amatches) and ib < len(bmatches):
+        abase, amatch, alen = amatches[ia]
+        bbase, bmatch, blen = bmatches[ib]
+
+        start = max(abase, bbase)
+        end = min(abase + alen, bbase + blen)
+        if start < end:
+            asub = amatch + (start - abase)
+            bsub = bmatch + (start - bbase)
+            regions.append((start, end, asub, asub + end - start,
+                            bsub, bsub + end - start))
+
+        if abase + alen < bbase + blen:
+            ia += 1
+        else:
+            ib += 1
+
+    regions.append((len(base), len(base), len(a), len(a), len(b), len(b)))
+    return regions
+
+def _merge3_regions(base, a, b):
+    """
+    Yield the merge regions: ``('unchanged', z1, z2)``,
+    ``('a' | 'b' | 'same', i1, i2)`` or
+    ``('conflict', a1, a2, b1, b2)``.
+
+    Conflicts are reprocessed so that lines on which `a` and `b` agree
+    are not part of them.
+
+    """
+    iz = ia = ib = 0
+    for zmatch, zend, amatch, aend, bmatch, bend in \
+            _merge3_sync_regions(base, a, b):
+        if amatch > ia or bmatch > ib:
+            if a[ia:amatch] == b[ib:bmatch]:
+                yield 'same', ia, amatch
+            else:
+                equal_a = (a[ia:amatch] == base[iz:zmatch])
+                equal_b = (b[ib:bmatch] == base[iz:zmatch])
+                if equal_a and not equal_b:
+                    yield 'b', ib, bmatch
+                elif equal_b and not equal_a:
+                    yield 'a', ia, amatch
+                else:
+                    for region in _merge3_reprocess(a, ia, amatch,
+                                                    b, ib, bmatch):
+                        yield region
+
+        if zend > zmatch:
+            yield 'unchanged', zmatch, zend
+            iz, ia, ib = zend, aend, bend
+        else:
+            iz, ia, ib = zmatch, amatch, bmatch
+
+def _merge3_reprocess(a, a1, a2, b, b1, b2):
+    """Split a conflict region on the lines both sides agree on"""
+    for i, j, n in _matching_blocks(a[a1:a2], b[b1:b2]):
+        i += a1
+        j += b1
+        if a1 < i or b1 < j:
+            yield 'conflict', a1, i, b1, j
+        yield 'same', i, i + n
+        a1, b1 = i + n, j + n
+    if a1 < a2 or b1 < b2:
+        yield 'conflict', a1, a2, b1, b2
+
+# -- Diffing
+
+#: Lengths of runs of items tried as anchors, in order
+_ANCHOR_WIDTHS = (1, 2, 4, 8)
+
+#: Largest edit distance for which gaps between anchors are diffed
+_MAX_EDIT_DISTANCE = 1000
+
+def diff_sequences(a, b):
+    """
+    Compute a diff between two sequences of hashable items.
+
+    Uses patience diff: items occurring exactly once on both sides
+    anchor the alignment, and the gaps between anchors are diffed
+    recursively. If there are no unique items, unique runs of 2, 4 or
+    8 items are tried instead. Gaps with no anchors are diffed with Myers'
+    algorithm, and treated as replaced if they differ by more than
+    _MAX_EDIT_DISTANCE items. This avoids the slowdown of
+    difflib.SequenceMatcher on long inputs with many repeated items.
+
+    Returns
+    -------
+    opcodes : list of (tag, i1, i2, j1, j2)
+        As in difflib.SequenceMatcher.get_opcodes.
+
+    """
+    matches = []
+    stack = [(0, len(a), 0, len(b))]
+    while stack:
+        a1, a2, b1, b2 = stack.pop()
+
+        # common head and tail
+        while a1 < a2 and b1 < b2 and a[a1] == b[b1]:
+            matches.append((a1, b1))
+            a1 += 1
+            b1 += 1
+        while a1 < a2 and b1 < b2 and a[a2-1] == b[b2-1]:
+            a2 -= 1
+            b2 -= 1
+            matches.append((a2, b2))
+        if a1 == a2 or b1 == b2:
+            continue
+
+        anchors = None
+        for width in _ANCHOR_WIDTHS:
+            if width > min(a2 - a1, b2 - b1):
+                break
+            anchors = _unique_anchors(a, a1, a2, b, b1, b2, width)
+            if anchors:
+                break
+        if anchors:
+            for i, j in anchors:
+                for k in xrange(width):
+                    matches.append((i + k, j + k))
+                stack.append((a1, i, b1, j))
+                a1, b1 = i + width, j + width
+            stack.append((a1, a2, b1, b2))
+        else:
+            gap_matches = _myers_matches(a, a1, a2, b, b1, b2)
+            if gap_matches is not None:
+                matches.extend(gap_matches)
+
+    matches.sort()
+
+    opcodes = []
+    i = j = 0
+    for mi, mj in matches:
+        if i < mi or j < mj:
+            if i < mi and j < mj:
+                tag = 'replace'
+            elif i < mi:
+                tag = 'delete'
+            else:
+                tag = 'insert'
+            opcodes.append((tag, i, mi, j, mj))
+        if opcodes and opcodes[-1][0] == 'equal':
+            tag, i1, i2, j1, j2 = opcodes[-1]
+            opcodes[-1] = (tag, i1, mi + 1, j1, mj + 1)
+        else:
+            opcodes.append(('equal', mi, mi + 1, mj, mj + 1))
+        i, j = mi + 1, mj + 1
+    if i < len(a) and j < len(b):
+        opcodes.append(('replace', i, len(a), j, len(b)))
+    elif i < len(a):
+        opcodes.append(('delete', i, len(a), j, j))
+    elif j < len(b):
+        opcodes.append(('insert', i, i, j, len(b)))
+    return opcodes
+
+def _unique_anchors(a, a1, a2, b, b1, b2, width=1):
+    """
+    Return the longest increasing chain of non-overlapping (i, j)
+    pairs of runs of `width` items unique in both a[a1:a2] and
+    b[b1:b2].
+
+    """
+    positions = {}
+    for i in xrange(a1, a2 - width + 1):
+        if width == 1:
+            item = a[i]
+        else:
+            item = tuple(a[i:i+width])
+        if item in positions:
+            positions[item] = None
+        else:
+            positions[item] = i
+    pairs = {}
+    for j in xrange(b1, b2 - width + 1):
+        if width == 1:
+            item = b[j]
+        else:
+            item = tuple(b[j:j+width])
+        i = positions.get(item)
+        if i is None:
+            continue
+        if item in pairs:
+            pairs[item] = None
+        else:
+            pairs[item] = (i, j)
+    pairs = [p for p in pairs.itervalues() if p is not None]
+    if not pairs:
+        return []
+    pairs.sort()
+
+    # longest increasing subsequence in j (patience sorting)
+    tails = []
+    tail_idx = []
+    back = [None] * len(pairs)
+    for k, (i, j) in enumerate(pairs):
+        pos = bisect.bisect_left(tails, j)
+        if pos > 0:
+            back[k] = tail_idx[pos-1]
+        if pos == len(tails):
+            tails.append(j)
+            tail_idx.append(k)
+        else:
+            tails[pos] = j
+            tail_idx[pos] = k
+
+    chain = []
+    k = tail_idx[-1]
+    while k is not None:
+        chain.append(pairs[k])
+        k = back[k]
+    chain.reverse()
+
+    anchors = []
+    for i, j in chain:
+        if anchors and (i < anchors[-1][0] + width
+                        or j < anchors[-1][1] + width):
+            continue
+        anchors.append((i, j))
+    return anchors
+
+def _myers_matches(a, a1, a2, b, b1, b2):
+    """
+    Return the (i, j) pairs of a longest common subsequence, using
+    the O(ND) algorithm of Myers. Returns None if the edit distance
+    exceeds _MAX_EDIT_DISTANCE.
+
+    """
+    n = a2 - a1
+    m = b2 - b1
+    v = {1: 0}
+    trace = []
+    for d in xrange(min(n + m, _MAX_EDIT_DISTANCE) + 1):
+        trace.append(v.copy())
+        for k in xrange(-d, d + 1, 2):
+            if k == -d or (k != d and v[k-1] < v[k+1]):
+                x = v[k+1]
+            else:
+                x = v[k-1] + 1
+            y = x - k
+            while x < n and y < m and a[a1 + x] == b[b1 + y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                return _myers_backtrack(trace, n, m, a1, b1)
+    return None
+
+def _myers_backtrack(trace, x, y, a1, b1):
+    matches = []
+    for d in xrange(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k-1] < v[k+1]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k]
+        prev_y = prev_x - prev_k
+        while x > prev_x and y > prev_y:
+            x -= 1
+            y -= 1
+            matches.append((a1 + x, b1 + y))
+        x, y = prev_x, prev_y
+    matches.reverse()
+    return matches
+
+def group_opcodes(opcodes, n=3):
+    """
+    Group opcodes into hunks with `n` lines of context, as in
+    difflib.SequenceMatcher.get_grouped_opcodes.
 
+    """
+    codes = list(opcodes)
+    if not codes:
+        codes = [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    groups = []
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > 2*n:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            groups.append(group)
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        groups.append(group)
+    return groups
+
+def _format_range(start, stop):
+    """Format a hunk line range in the unified diff format"""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return '%d' % beginning
+    if not length:
+        beginning -= 1
+    return '%d,%d' % (beginning, length)
+
+def diff_hunks(lines_a, lines_b, n=3):
+    """
+    Compute a unified diff as a list of hunks.
+
+    Returns
+    -------
+    hunks : list of (header, lines)
+        `header` is the ``@@ ... @@`` line, and `lines` a list of
+        ``(tag, line)`` with tag one of ``' '``, ``'-'``, ``'+'``.
+
+    """
+    hunks = []
+    for group in group_opcodes(diff_sequences(lines_a, lines_b), n):
+        i1, i2 = group[0][1], group[-1][2]
+        j1, j2 = group[0][3], group[-1][4]
+        header = '@@ -%s +%s @@\n' % (_format_range(i1, i2),
+                                      _format_range(j1, j2))
+        lines = []
+        for tag, i1, i2, j1, j2 in group:
+            if tag == 'equal':
+                lines.extend((' ', line) for line in lines_a[i1:i2])
+                continue
+            if tag in ('replace', 'delete'):
+                lines.extend(('-', line) for line in lines_a[i1:i2])
+            if tag in ('replace', 'insert'):
+                lines.extend(('+', line) for line in lines_b[j1:j2])
+        hunks.append((header, lines))
+    return hunks
+
+def unified_diff(lines_a, lines_b, fromfile='', tofile='', n=3):
+    """
+    Return a list of unified diff lines, as difflib.unified_diff
+    but computed with `diff_sequences`.
+
+    """
+    out = []
+    for header, lines in diff_hunks(lines_a, lines_b, n):
+        if not out:
+            out.append('--- %s\n' % fromfile)
+            out.append('+++ %s\n' % tofile)
+        out.append(header)
+        out.extend(tag + line for tag, line in lines)
+    return out
 
-def html_diff_text(text_a, text_b, label_a="previous", label_b="current"):
+def _diff_lines(text_a, text_b):
     if isinstance(text_a, unicode):
         text_a = text_a.encode('utf-8')
     if isinstance(text_b, unicode):
@@ -153,26 +510,213 @@ def html_diff_text(text_a, text_b, label_a="previous", label_b="current"):
     if not lines_b: lines_b = [""]
     if not lines_a[-1].endswith('\n'): lines_a[-1] += "\n"
     if not lines_b[-1].endswith('\n'): lines_b[-1] += "\n"
+    return lines_a, lines_b
 
-    out = []
-    for line in difflib.unified_diff(lines_a, lines_b,
-                                     fromfile=label_a,
-                                     tofile=label_b):
-        if line.startswith('@'):
-            out.append('<hr/>%s' % cgi.escape(line))
-        elif line.startswith('+++'):
-            out.append('<span class="diff-add">%s</span>'%cgi.escape(line))
-        elif line.startswith('---'):
-            out.append('<span class="diff-del">%s</span>'%cgi.escape(line))
-        elif line.startswith('+'):
-            out.append('<span class="diff-add">%s</span>'%cgi.escape(line))
-        elif line.startswith('-'):
-            out.append('<span class="diff-del">%s</span>'%cgi.escape(line))
+def diff_text(text_a, text_b, label_a="previous", label_b="current"):
+    lines_a, lines_b = _diff_lines(text_a, text_b)
+    return "".join(unified_diff(lines_a, lines_b,
+                                fromfile=label_a,
+                                tofile=label_b))
+
+
+def html_diff_text(text_a, text_b, label_a="previous", label_b="current",
+                   intraline=False):
+    """
+    Render a unified diff of two texts as HTML.
+
+    Parameters
+    ----------
+    intraline : bool, optional
+        Whether to also highlight the changed words within
+        replaced lines.
+
+    """
+    lines_a, lines_b = _diff_lines(text_a, text_b)
+    hunks = diff_hunks(lines_a, lines_b)
+    if not hunks:
+        return ""
+
+    out = ['<span class="diff-del">%s</span>' % cgi.escape(
+               '--- %s\n' % label_a),
+           '<span class="diff-add">%s</span>' % cgi.escape(
+               '+++ %s\n' % label_b)]
+    for header, lines in hunks:
+        out.append('<hr/>%s' % cgi.escape(header))
+        if intraline:
+            lines = _intraline_lines(lines)
         else:
-            out.append('<span class="diff-nop">%s</span>'%cgi.escape(line))
-    if out:
-        out.append('<hr/>')
+            lines = [(tag, cgi.escape(line)) for tag, line in lines]
+        for tag, line in lines:
+            if tag == '+':
+                out.append('<span class="diff-add">+%s</span>' % line)
+            elif tag == '-':
+                out.append('<span class="diff-del">-%s</span>' % line)
+            else:
+                out.append('<span class="diff-nop"> %s</span>' % line)
+    out.append('<hr/>')
     return "".join(out)
 
+_intraline_split_re = re.compile(r'(\s+|\w+)')
+
+def _intraline_lines(lines):
+    """
+    Escape diff lines to HTML, marking changed words in runs of
+    removed lines followed by added lines.
+
+    """
+    out = []
+    k = 0
+    while k < len(lines):
+        if lines[k][0] != '-':
+            out.append((lines[k][0], cgi.escape(lines[k][1])))
+            k += 1
+            continue
+
+        removed = []
+        while k < len(lines) and lines[k][0] == '-':
+            removed.append(lines[k][1])
+            k += 1
+        added = []
+        while k < len(lines) and lines[k][0] == '+':
+            added.append(lines[k][1])
+            k += 1
+
+        pairs = zip(removed, added)
+        marked = [_intraline_pair(old, new) for old, new in pairs]
+        out.extend(('-', old) for old, new in marked)
+        out.extend(('-', cgi.escape(line)) for line in removed[len(pairs):])
+        out.extend(('+', new) for old, new in marked)
+        out.extend(('+', cgi.escape(line)) for line in added[len(pairs):])
+    return out
+
+def _intraline_pair(old_line, new_line):
+    """Return HTML for a pair of lines, with the changed words marked"""
+    a = [w for w in _intraline_split_re.split(old_line) if w]
+    b = [w for w in _intraline_split_re.split(new_line) if w]
+    old_out = []
+    new_out = []
+    for tag, i1, i2, j1, j2 in diff_sequences(a, b):
+        old_part = cgi.escape("".join(a[i1:i2]))
+        new_part = cgi.escape("".join(b[j1:j2]))
+        if tag == 'equal':
+            old_out.append(old_part)
+            new_out.append(new_part)
+            continue
+        if old_part.strip():
+            old_part = '<span class="diff-del-word">%s</span>' % old_part
+        if new_part.strip():
+            new_part = '<span class="diff-add-word">%s</span>' % new_part
+        old_out.append(old_part)
+        new_out.append(new_part)
+    return "".join(old_out), "".join(new_out)
+
+#: Time to keep rendered diffs of fixed revisions in the cache
+DIFF_CACHE_AGE = 7*24*3600
+
+def cached_html_diff(key, text_a, text_b, label_a="previous",
+                     label_b="current", intraline=False):
+    """
+    Render a diff as `html_diff_text`, memoized in the cache.
+
+    Parameters
+    ----------
+    key : tuple
+        Identifies the compared texts, e.g. the revision numbers.
+        Must change whenever the texts do.
+
+    """
+    site = Site.objects.get_current()
+    cache_key = 'html_diff_%d__%s' % (site.id, hashlib.md5(repr(
+        (key, label_a, label_b, intraline))).hexdigest())
+    html = cache.get(cache_key)
+    if html is None:
+        html = html_diff_text(text_a, text_b, label_a=label_a,
+                              label_b=label_b, intraline=intraline)
+        cache.set(cache_key, html, DIFF_CACHE_AGE)
+    return html
+
+_nonjunk_re = re.compile("[^a-zA-Z \n]")
+
+def split_words(text):
+    """Split text to words for diffing, ignoring punctuation and digits"""
+    return _nonjunk_re.sub('', text).split()
+
+def diff_words(text_a, text_b):
+    """
+    Compare the words in two texts.
+
+    Returns
+    -------
+    inserted : int
+        Number of words in `text_b` not matched in `text_a`.
+    deleted : int
+        Number of words in `text_a` not matched in `text_b`.
+
+    """
+    a = split_words(text_a)
+    b = split_words(text_b)
+    matched = sum(i2 - i1 for tag, i1, i2, j1, j2 in diff_sequences(a, b)
+                  if tag == 'equal')
+    return len(b) - matched, len(a) - matched
+
+def count_words_changed(old_text, new_text):
+    """
+    Return the number of words in `new_text` that are not matched
+    by words in `old_text`.
+
+    """
+    inserted, deleted = diff_words(old_text, new_text)
+    return inserted
+
+def chunked(seq, size=500):
+    """
+    Split a sequence into lists of at most `size` items.
+
+    Useful for keeping ``IN (...)`` clauses below the bound-parameter
+    limits of the database backends.
+
+    """
+    chunk = []
+    for item in seq:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+class PhaseTimer(object):
+    """
+    Record wall-clock durations of consecutive named phases.
+
+    Call ``mark(name)`` at the end of each phase; ``str(timer)``
+    gives a printable summary. Time of phases marked several times
+    with the same name is accumulated.
+
+    """
+    def __init__(self):
+        self.timings = []
+        self._start = time.time()
+
+    def mark(self, phase):
+        """Finish the current phase, naming it `phase`"""
+        now = time.time()
+        for j, (name, t) in enumerate(self.timings):
+            if name == phase:
+                self.timings[j] = (name, t + now - self._start)
+                break
+        else:
+            self.timings.append((phase, now - self._start))
+        self._start = now
+
+    @property
+    def total(self):
+        return sum(t for phase, t in self.timings)
+
+    def __str__(self):
+        lines = ["%-24s %8.2f s" % (phase, t) for phase, t in self.timings]
+        lines.append("%-24s %8.2f s" % ("total", self.total))
+        return "\n".join(lines)
+
 def strip_spurious_whitespace(text):
     return ("\n".join([x.rstrip() for x in text.split("\n")])).strip()
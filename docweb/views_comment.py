@@ -124,8 +124,11 @@ def ok_to_apply(request, name, revision=None):
                 doc.save()
             else:
                 rev = doc.revisions.get(revno=int(revision))
-                rev.ok_to_apply = ok
-                rev.save()
+                if rev.revno == doc.cur_revno:
+                    doc.ok_to_apply = ok
+                else:
+                    rev.ok_to_apply = ok
+                    rev.save()
         except (ValueError, TypeError, KeyError,
                 DocstringRevision.DoesNotExist):
             # invalid input
@@ -4,7 +4,7 @@ import socket
 from pydocweb.docweb.utils import *
 from pydocweb.docweb.models import *
 from pydocweb.docweb.docstring_update import \
-     update_docstrings, patch_against_source
+     update_docstrings, patch_against_source, iter_docs_as_xml
 
 #------------------------------------------------------------------------------
 # Control
@@ -37,12 +37,12 @@ def patch(request):
     return render_template(request, "patch.html",
                            dict(changed=docs))
 
-@cache_page(60*15)
 @cache_control(public=True, max_age=60*15)
 def dump(request):
-    response = HttpResponse(mimetype="application/xml")
+    # Stream the dump; the response is not stored in the server-side
+    # cache, as that would need the whole document in memory.
+    response = HttpResponse(iter_docs_as_xml(), mimetype="application/xml")
     response['Content-Disposition'] = 'attachment; filename=dump.xml'
-    dump_docs_as_xml(response)
     return response
 
 @permission_required('docweb.change_docstring')
@@ -52,13 +52,9 @@ def merge(request):
     """
     errors = []
     if request.method == 'POST':
-        ok = request.POST.keys()
-        for obj in Docstring.on_site.filter(merge_status=MERGE_MERGE,
-                                            name__in=ok):
-            try:
-                obj.automatic_merge(author=request.user.username)
-            except RuntimeError, e:
-                errors.append("%s: %s" % (obj.name, str(e)))
+        site = Site.objects.get_current()
+        errors = Docstring.accept_merges(site, request.POST.keys(),
+                                         author=request.user.username)
 
     conflicts = Docstring.on_site.filter(merge_status=MERGE_CONFLICT)
     merged = Docstring.on_site.filter(merge_status=MERGE_MERGE)
@@ -86,8 +82,9 @@ def periodic_update(request, key):
         raise Http404()
     
     site = Site.objects.get_current()
-    update_docstrings(site)
-    return HttpResponse('Done.')
+    timer = update_docstrings(
+        site, incremental=getattr(settings, 'PULL_INCREMENTAL', False))
+    return HttpResponse('Done.\n\n%s\n' % timer, mimetype="text/plain")
 
 def match_ip(address, mask):
     """Check if an ip address matches the specified net mask"""
@@ -1,6 +1,7 @@
-import os
+import os, hashlib
 
 from django.conf import settings
+from django.db import transaction
 
 import pydocweb.docweb.rst as rst
 from pydocweb.docweb.utils import *
@@ -12,20 +13,7 @@ from pydocweb.docweb.views_comment import ReviewForm
 #------------------------------------------------------------------------------
 
 def index(request):
-    # needed for speed! accessing the .review property is too slow
-    review_map = {}
-    from django.db import connection
-    cursor = connection.cursor()
-    cursor.execute("""SELECT name, review FROM docweb_docstring""")
-    for name, review in cursor.fetchall():
-        review_map[name] = review
-    cursor.execute("""SELECT docstring_id, review FROM docweb_docstringrevision
-                      GROUP BY docstring_id ORDER BY timestamp""")
-    for name, review in cursor.fetchall():
-        review_map[name] = review
-
-    # continue pseudo-normally
-    entries = Docstring.get_non_obsolete()
+    entries = Docstring.get_review_index()
     review_sort_order = {
         REVIEW_PROOFED: 0,
         REVIEW_NEEDS_PROOF: 1,
@@ -36,12 +24,15 @@ def index(request):
         REVIEW_NEEDS_EDITING: 6,
         REVIEW_UNIMPORTANT: 7,
     }
-    entries = [dict(name=c.name,
-                    statuscode=REVIEW_STATUS_CODES[review_map[c.name]],
-                    sort_code=(review_sort_order[review_map[c.name]], c.name),
-                    status=(REVIEW_STATUS_NAMES[review_map[c.name]],),
+    # reversing the URL for each of the entries would be slow
+    url_head, url_tail = reverse(view, args=['NAME']).split('NAME')
+    entries = [dict(name=name,
+                    url=url_head + name + url_tail,
+                    statuscode=REVIEW_STATUS_CODES[review],
+                    sort_code=(review_sort_order[review], name),
+                    status=(REVIEW_STATUS_NAMES[review],),
                     )
-               for c in entries]
+               for name, type_code, review in entries]
     entries.sort(key=lambda x: x['sort_code'])
     return render_template(request, 'docstring/index.html',
                            dict(entries=entries))
@@ -62,8 +53,8 @@ def view(request, name):
     # display the entry
     try:
         text, revision = doc.get_rev_text(request.GET.get('revision'))
+        body = rst.render_docstring_html_cached(doc, text, revision)
         if not request.GET.get('revision'): revision = None
-        body = rst.render_docstring_html(doc, text)
     except DocstringRevision.DoesNotExist:
         raise Http404()
 
@@ -93,6 +84,7 @@ def view(request, name):
                   line_number=doc.line_number,
                   revision=revision,
                   toctree_chain=ToctreeCache.get_chain(doc)[:-1],
+                  children=doc.get_children(),
                   )
 
     if doc.type_code == 'dir':
@@ -109,7 +101,7 @@ def view(request, name):
         return render_template(request, 'docstring/merge.html', params)
     elif revision is None and doc.merge_status == MERGE_MERGE:
         merged = doc.get_merge()
-        merge_html = html_diff_text(doc.revisions.all()[0].text, merged)
+        merge_html = html_diff_text(doc.text, merged)
         params['merge_html'] = merge_html
         return render_template(request, 'docstring/merge.html', params)
     else:
@@ -131,6 +123,7 @@ class EditForm(forms.Form):
         return self.cleaned_data
 
 @permission_required('docweb.change_docstring')
+@transaction.commit_on_success
 def edit(request, name):
     doc = get_object_or_404(Docstring, name=name)
 
@@ -278,11 +271,24 @@ def diff(request, name, rev1, rev2):
     else:
         name2 = "VCS"
 
-    diff = html_diff_text(text1, text2, label_a=name1, label_b=name2)
+    intraline = bool(request.GET.get('intraline'))
+    diff = cached_html_diff(('docstring', _diff_key(rev1, text1),
+                             _diff_key(rev2, text2)),
+                            text1, text2, label_a=name1, label_b=name2,
+                            intraline=intraline)
 
     return render_template(request, 'docstring/diff.html',
                            dict(name=name, name1=name1, name2=name2,
-                                rev1=rev1, rev2=rev2, diff_html=diff))
+                                rev1=rev1, rev2=rev2, diff_html=diff,
+                                intraline=intraline))
+
+def _diff_key(rev, text):
+    """Cache key for a revision text: the VCS text may change on pulls"""
+    if rev is not None:
+        return rev.revno
+    if isinstance(text, unicode):
+        text = text.encode('utf-8')
+    return 'vcs-' + hashlib.md5(text).hexdigest()
 
 def diff_prev(request, name, rev2):
     doc = get_object_or_404(Docstring, name=name)
@@ -1,3 +1,5 @@
+from django.utils.http import urlencode
+
 from pydocweb.docweb.utils import *
 from pydocweb.docweb.models import *
 
@@ -13,33 +15,87 @@ class SearchForm(forms.Form):
                 ('callable', 'Callable'),
                 ('object', 'Object')]
     fulltext = forms.CharField(required=False,
-            help_text="Use % as a wild characted; as in an SQL LIKE search")
+            help_text="Words to search for; end a word with * to match "
+                      "all words beginning with it")
     invert = forms.BooleanField(required=False,
             help_text="Find non-matching items")
     type_code = forms.CharField(widget=forms.Select(choices=_choices),
                                 label="Item type")
 
+# Number of results shown per page
+SEARCH_PAGE_SIZE = 50
+
 def search(request):
-    docstring_results = []
-    wiki_results = []
+    docstring_results = None
+    wiki_results = None
 
     if request.method == 'POST':
         form = SearchForm(request.POST)
-        if form.is_valid():
-            data = form.cleaned_data
-            if data['fulltext'] != '':
-                data['fulltext'] = '%%%s%%' % data['fulltext']
-            if data['type_code'] != 'wiki':
-                docstring_results = Docstring.fulltext_search(
-                    data['fulltext'], data['invert'], data['type_code'])
-            if data['type_code'] in ('any', 'wiki'):
-                wiki_results = WikiPage.fulltext_search(data['fulltext'],
-                                                        data['invert'])
+    elif 'fulltext' in request.GET:
+        form = SearchForm(request.GET)
     else:
         form = SearchForm()
 
+    if form.is_bound and form.is_valid():
+        data = form.cleaned_data
+        site = Site.objects.get_current()
+        query = dict(fulltext=data['fulltext'],
+                     type_code=data['type_code'])
+        if data['invert']:
+            query['invert'] = '1'
+
+        if data['type_code'] != 'wiki':
+            docstring_results = _get_results_page(
+                request, 'after', query,
+                Docstring.fulltext_search(data['fulltext'], data['invert'],
+                                          data['type_code']),
+                site, SearchIndex.DOCSTRING, data['fulltext'],
+                'pydocweb.docweb.views_docstring.view')
+        if data['type_code'] in ('any', 'wiki'):
+            wiki_results = _get_results_page(
+                request, 'wiki_after', query,
+                WikiPage.fulltext_search(data['fulltext'], data['invert']),
+                site, SearchIndex.WIKI, data['fulltext'],
+                'pydocweb.docweb.views_wiki.view')
+
     return render_template(request, 'search.html',
                            dict(form=form,
                                 docstring_results=docstring_results,
                                 wiki_results=wiki_results))
 
+def _get_results_page(request, cursor_param, query, results, site, kind,
+                      fulltext, view_name):
+    """
+    Pick the page of ranked results following the cursor given in the
+    request, and fetch snippets for it.
+
+    The cursor is the score and the name of the last item on the
+    previous page, so that pages stay consistent when items are added.
+
+    """
+    cursor = request.GET.get(cursor_param)
+    if cursor and '|' in cursor:
+        score, name = cursor.split('|', 1)
+        try:
+            key = (-float(score), name)
+            results = [r for r in results if (-r[1], r[0]) > key]
+        except ValueError:
+            pass
+
+    page = results[:SEARCH_PAGE_SIZE]
+    if len(results) > SEARCH_PAGE_SIZE:
+        last = page[-1]
+        next_query = dict(query)
+        next_query[cursor_param] = '%r|%s' % (last[1], last[0])
+        next_url = '?' + urlencode(next_query)
+    else:
+        next_url = None
+
+    snippets = SearchIndex.get_snippets(site, kind,
+                                        [name for name, score in page],
+                                        fulltext)
+    items = [dict(name=name, snippet=snippets.get(name, ''),
+                  url=reverse(view_name, args=[name]))
+             for name, score in page]
+    return dict(entries=items, next_url=next_url,
+                more=len(results) - len(page))
@@ -1,4 +1,4 @@
-import datetime, difflib, re
+import datetime
 
 from pydocweb.docweb.utils import *
 from pydocweb.docweb.models import *
@@ -81,20 +81,13 @@ def stats(request):
                                 height=height,
                                 ))
 
-@cache_memoize(max_age=60*15)
 def _get_stats_info():
     """
     Generate information needed by the stats page.
     """
-    # Basic history statistics
-    edits = _get_edits()
-
     HEIGHT = 200
 
-    if not edits:
-        stats = []
-    else:
-        stats = _get_weekly_stats(edits)
+    stats = _get_weekly_stats()
 
     # Generate bar graph for period history
     for period in stats:
@@ -143,12 +136,28 @@ def _get_stats_info():
     
     return stats, HEIGHT
 
-def _get_weekly_stats(edits):
-    """Return a list of PeriodStats summarizing weekly statistics"""
+def _get_weekly_stats():
+    """
+    Return a list of PeriodStats summarizing weekly statistics.
+
+    The per-week figures are precomputed in WeeklyDocstringStats and
+    WeeklyAuthorStats; only the cumulative review counts are
+    accumulated here.
+
+    """
+    site = Site.objects.get_current()
+
+    doc_weeks = list(WeeklyDocstringStats.objects.filter(
+        site=site).order_by('week').values_list(
+        'week', 'docstring', 'words', 'start_rev', 'end_rev', 'review_code'))
+    author_weeks = list(WeeklyAuthorStats.objects.filter(
+        site=site).order_by('week').values_list('week', 'author', 'words'))
+
+    if not doc_weeks:
+        return []
+
     review_status = {}
     review_counts = {}
-    docstring_status = {}
-    docstring_start_rev = {}
 
     author_map = get_author_map()
     author_map['xml-import'] = "Imported"
@@ -156,63 +165,70 @@ def _get_weekly_stats(edits):
     for j in REVIEW_STATUS_NAMES.keys():
         review_counts[j] = 0
 
-    for docstring in Docstring.on_site.all():
-        review_status[docstring.name] = docstring.review_code
-        review_counts[docstring.review_code] += 1
-        docstring_start_rev[docstring.name] = 'vcs'
+    for name, review_code in Docstring.on_site.values_list('name',
+                                                           'review_code'):
+        review_status[name] = review_code
+        review_counts[review_code] += 1
 
-    # Periodical review statistics
+    # Periodical review statistics: a single forward sweep over the
+    # week-ordered rows
     time_step = datetime.timedelta(days=7)
 
     period_stats = []
 
-    remaining_edits = list(edits)
-    remaining_edits.sort(key=lambda x: x[0])
-
-    t = edits[0][0] - time_step # start from monday
-    t = datetime.datetime(t.year, t.month, t.day)
-    start_time = t - datetime.timedelta(days=t.weekday())
+    start_time = doc_weeks[0][0] - time_step
+    i_doc = 0
+    i_author = 0
 
     while start_time <= datetime.datetime.now():
         end_time = start_time + time_step
 
+        docstring_edits = {}
+        docstring_status = {}
+        docstring_start_rev = {}
         docstring_end_rev = {}
         author_edits = {}
-        docstring_edits = {}
 
-        while remaining_edits and remaining_edits[0][0] < end_time:
-            timestamp, n_edits, rev = remaining_edits.pop(0)
+        while i_doc < len(doc_weeks) and doc_weeks[i_doc][0] < end_time:
+            week, name, words, start_rev, end_rev, review_code = \
+                  doc_weeks[i_doc]
+            i_doc += 1
 
-            if rev.review_code == REVIEW_UNIMPORTANT: n_edits = 0
+            if name not in review_status:
+                continue
 
-            docstring_end_rev[rev.docstring.name] = rev.revno
+            review_counts[review_status[name]] -= 1
+            if review_code == REVIEW_NEEDS_EDITING:
+                review_status[name] = REVIEW_BEING_WRITTEN
+            else:
+                review_status[name] = review_code
+            review_counts[review_status[name]] += 1
 
-            review_counts[review_status[rev.docstring.name]] -= 1
-            if rev.review_code == REVIEW_NEEDS_EDITING:
-                review_status[rev.docstring.name] = REVIEW_BEING_WRITTEN
+            docstring_edits[name] = words
+            docstring_status[name] = review_code
+            if start_rev is None:
+                docstring_start_rev[name] = 'vcs'
             else:
-                review_status[rev.docstring.name] = rev.review_code
-            review_counts[review_status[rev.docstring.name]] += 1
+                docstring_start_rev[name] = start_rev
+            docstring_end_rev[name] = end_rev
 
-            if n_edits <= 0: n_edits = 0
+        while (i_author < len(author_weeks)
+               and author_weeks[i_author][0] < end_time):
+            week, author, words = author_weeks[i_author]
+            i_author += 1
 
-            author = author_map.get(rev.author, rev.author)
+            author = author_map.get(author, author)
             author_edits.setdefault(author, 0)
-            author_edits[author] += n_edits
-
-            docstring_edits.setdefault(rev.docstring.name, 0)
-            docstring_edits[rev.docstring.name] += n_edits
-            docstring_status[rev.docstring.name] = rev.review_code
+            author_edits[author] += words
 
         period_stats.append(PeriodStats(start_time, end_time,
                                         author_edits,
                                         docstring_edits,
-                                        dict(docstring_status),
+                                        docstring_status,
                                         dict(review_counts),
-                                        dict(docstring_start_rev),
+                                        docstring_start_rev,
                                         docstring_end_rev,))
         start_time = end_time
-        docstring_start_rev.update(docstring_end_rev)
 
     return period_stats
 
@@ -236,34 +252,3 @@ class PeriodStats(object):
                                                      self.docstring_edits,
                                                      self.docstring_status,
                                                      self.review_counts)
-
-def _get_edits():
-    """Return a list of tuples (timestamp, n_words, docstringrevision)"""
-    site = Site.objects.get_current()
-    objects = DocstringRevision.objects.filter(docstring__site=site)
-    revisions = objects.all().order_by('docstring', 'timestamp')
-
-    last_text = None
-    last_docstring = None
-
-    edits = []
-
-    nonjunk_re = re.compile("[^a-zA-Z \n]")
-
-    for rev in revisions:
-        if last_docstring != rev.docstring or last_text is None:
-            last_text = rev.text
-            last_docstring = rev.docstring
-            continue
-
-        a = nonjunk_re.sub('', last_text).split()
-        b = nonjunk_re.sub('', rev.text).split()
-        sm = difflib.SequenceMatcher(a=a, b=b)
-        ratio = sm.ratio()
-        n_edits = len(b) - (len(a) + len(b))*.5*ratio
-
-        edits.append((rev.timestamp, n_edits, rev))
-        last_text = rev.text
-        last_docstring = rev.docstring
-
-    return edits
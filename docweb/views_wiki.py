@@ -136,11 +136,15 @@ def diff(request, name, rev1, rev2):
     name1 = str(rev1.revno)
     name2 = str(rev2.revno)
 
-    diff = html_diff_text(rev1.text, rev2.text, label_a=name1, label_b=name2)
+    intraline = bool(request.GET.get('intraline'))
+    diff = cached_html_diff(('wiki', rev1.revno, rev2.revno),
+                            rev1.text, rev2.text,
+                            label_a=name1, label_b=name2,
+                            intraline=intraline)
 
     return render_template(request, 'wiki/diff.html',
                            dict(name=name, name1=name1, name2=name2,
-                                diff_html=diff))
+                                diff_html=diff, intraline=intraline))
 
 def diff_prev(request, name, rev2):
     site = Site.objects.get_current()
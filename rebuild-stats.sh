@@ -0,0 +1,8 @@
+#!/bin/sh
+DOMAIN="$1"
+if test "$DOMAIN" = ""; then
+    echo "Usage: $0 DOMAIN"
+    exit
+fi
+
+PYTHONPATH="$PWD/..:$PYTHONPATH" DJANGO_SETTINGS_MODULE="pydocweb.settings" python -c "import pydocweb.docweb.models as m; site = m.Site.objects.get(domain='$1'); m.rebuild_weekly_stats(site)"
@@ -0,0 +1,81 @@
+#!/usr/bin/env python
+"""
+Benchmark the weekly statistics aggregation on a synthetic edit history.
+
+Usage: DJANGO_SETTINGS_MODULE=pydocweb.settings benchmark-stats.py
+
+"""
+import sys, time, random, optparse, datetime
+
+import pydocweb.docweb.models as models
+
+def main():
+    p = optparse.OptionParser()
+    p.add_option("--revisions", action="store", type="int",
+                 dest="revisions", default=200000,
+                 help="Number of revisions [default: %default]")
+    p.add_option("--weeks", action="store", type="int",
+                 dest="weeks", default=300,
+                 help="Number of weeks [default: %default]")
+    p.add_option("--docstrings", action="store", type="int",
+                 dest="docstrings", default=5000,
+                 help="Number of docstrings [default: %default]")
+    p.add_option("--compare", action="store_true", dest="compare",
+                 help="Also time the old list.pop(0) replay")
+    options, args = p.parse_args()
+
+    revisions = make_history(options.revisions, options.weeks,
+                             options.docstrings)
+
+    start = time.time()
+    weeks = models.compute_weekly_stats(revisions)
+    print "sweep:  %8.2f s  (%d weeks)" % (time.time() - start, len(weeks))
+
+    if options.compare:
+        start = time.time()
+        replay_pop(revisions)
+        print "replay: %8.2f s" % (time.time() - start)
+
+def make_history(n_revisions, n_weeks, n_docstrings):
+    """Return a list of revision tuples sorted by timestamp"""
+    random.seed(1234)
+    t0 = datetime.datetime(2008, 1, 7)
+    span = n_weeks * 7 * 24 * 3600
+    review_codes = models.REVIEW_STATUS_NAMES.keys()
+
+    revisions = []
+    for revno in xrange(n_revisions):
+        t = t0 + datetime.timedelta(seconds=random.randint(0, span - 1))
+        revisions.append(('doc%d' % random.randint(0, n_docstrings - 1),
+                          revno,
+                          'author%d' % random.randint(0, 50),
+                          random.choice(review_codes),
+                          random.uniform(-10, 100),
+                          t))
+    revisions.sort(key=lambda x: x[5])
+    return revisions
+
+def replay_pop(revisions):
+    """The previous algorithm: pop edits off the front of a list"""
+    remaining = list(revisions)
+    t = remaining[0][5]
+    start_time = models.get_week_start(t)
+    step = datetime.timedelta(days=7)
+    stats = []
+    while remaining:
+        end_time = start_time + step
+        docstrings = {}
+        authors = {}
+        while remaining and remaining[0][5] < end_time:
+            name, revno, author, review_code, words, timestamp = \
+                  remaining.pop(0)
+            if review_code == models.REVIEW_UNIMPORTANT or words <= 0:
+                words = 0
+            authors[author] = authors.get(author, 0) + words
+            docstrings[name] = docstrings.get(name, 0) + words
+        stats.append((start_time, docstrings, authors))
+        start_time = end_time
+    return stats
+
+if __name__ == "__main__":
+    main()
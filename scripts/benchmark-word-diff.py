@@ -0,0 +1,72 @@
+#!/usr/bin/env python
+"""
+Benchmark the word-level diff used for edit statistics against the
+previous difflib.SequenceMatcher approach.
+
+Usage: DJANGO_SETTINGS_MODULE=pydocweb.settings benchmark-word-diff.py
+
+"""
+import sys, time, random, optparse, difflib
+
+from pydocweb.docweb.utils import diff_words, split_words
+
+def main():
+    p = optparse.OptionParser()
+    p.add_option("--words", action="store", type="int", dest="words",
+                 default=20000,
+                 help="Number of words in the document [default: %default]")
+    p.add_option("--vocabulary", action="store", type="int",
+                 dest="vocabulary", default=200,
+                 help="Number of distinct words [default: %default]")
+    p.add_option("--edits", action="store", type="int", dest="edits",
+                 default=50,
+                 help="Number of edited spots [default: %default]")
+    p.add_option("--repeat", action="store", type="int", dest="repeat",
+                 default=3,
+                 help="Number of repetitions [default: %default]")
+    options, args = p.parse_args()
+
+    old_text, new_text = make_texts(options.words, options.vocabulary,
+                                    options.edits)
+
+    for name, func in [('SequenceMatcher', sequence_matcher_words),
+                       ('diff_words', lambda a, b: diff_words(a, b)[0])]:
+        start = time.time()
+        for j in xrange(options.repeat):
+            result = func(old_text, new_text)
+        elapsed = (time.time() - start) / options.repeat
+        print "%-16s %8.3f s  (%.1f words inserted)" % (name, elapsed,
+                                                        result)
+
+def make_texts(n_words, n_vocabulary, n_edits):
+    """
+    Return a long text with many repeated words, as in the ufunc
+    docstrings, and an edited version of it.
+
+    """
+    random.seed(1234)
+    vocabulary = ['word' + chr(ord('a') + j % 26) * (1 + j // 26)
+                  for j in xrange(n_vocabulary)]
+    words = [random.choice(vocabulary) for j in xrange(n_words)]
+    old_text = " ".join(words)
+
+    for j in xrange(n_edits):
+        pos = random.randint(0, len(words) - 1)
+        if random.random() < 0.5:
+            words[pos:pos+3] = [random.choice(vocabulary)
+                                for k in xrange(random.randint(0, 6))]
+        else:
+            words.insert(pos, random.choice(vocabulary))
+    new_text = " ".join(words)
+    return old_text, new_text
+
+def sequence_matcher_words(old_text, new_text):
+    """The previous edit size computation"""
+    a = split_words(old_text)
+    b = split_words(new_text)
+    sm = difflib.SequenceMatcher(a=a, b=b)
+    ratio = sm.ratio()
+    return len(b) - (len(a) + len(b))*.5*ratio
+
+if __name__ == "__main__":
+    main()
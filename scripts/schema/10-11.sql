@@ -0,0 +1,2 @@
+CREATE INDEX docweb_docstring_site_timestamp
+ON docweb_docstring (site_id, timestamp);
@@ -0,0 +1,12 @@
+CREATE TABLE docweb_searchindex (
+    id integer NOT NULL PRIMARY KEY @AUTO_INCREMENT@,
+    site_id integer NOT NULL REFERENCES django_site (id),
+    kind varchar(1) NOT NULL,
+    name varchar(256) NOT NULL,
+    term varchar(64) NOT NULL,
+    weight integer NOT NULL
+);
+CREATE INDEX docweb_searchindex_term
+ON docweb_searchindex (site_id, kind, term);
+CREATE INDEX docweb_searchindex_name
+ON docweb_searchindex (site_id, kind, name);
@@ -0,0 +1,16 @@
+"""
+Fill the full-text search index of the existing docstrings and wiki
+pages. Pulls and edits only index what they change.
+
+"""
+from django.db import transaction
+from pydocweb.docweb.models import Site, SearchIndex
+
+@transaction.commit_on_success
+def main():
+    for site in Site.objects.all():
+        SearchIndex.index_docstrings(site)
+        SearchIndex.index_wiki_pages(site)
+
+if __name__ == "__main__":
+    main()
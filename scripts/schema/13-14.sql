@@ -0,0 +1,27 @@
+ALTER TABLE docweb_docstringrevision ADD COLUMN words_changed
+double precision NULL;
+
+CREATE TABLE docweb_weeklydocstringstats (
+    id integer NOT NULL PRIMARY KEY @AUTO_INCREMENT@,
+    site_id integer NOT NULL REFERENCES django_site (id),
+    week datetime NOT NULL,
+    docstring_id varchar(256) NOT NULL REFERENCES docweb_docstring (name),
+    words double precision NOT NULL,
+    start_rev integer NULL,
+    end_rev integer NOT NULL,
+    review integer NOT NULL
+);
+CREATE INDEX docweb_weeklydocstringstats_site_week
+ON docweb_weeklydocstringstats (site_id, week);
+CREATE INDEX docweb_weeklydocstringstats_docstring_id
+ON docweb_weeklydocstringstats (docstring_id);
+
+CREATE TABLE docweb_weeklyauthorstats (
+    id integer NOT NULL PRIMARY KEY @AUTO_INCREMENT@,
+    site_id integer NOT NULL REFERENCES django_site (id),
+    week datetime NOT NULL,
+    author varchar(256) NOT NULL,
+    words double precision NOT NULL
+);
+CREATE INDEX docweb_weeklyauthorstats_site_week
+ON docweb_weeklyauthorstats (site_id, week);
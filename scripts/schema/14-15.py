@@ -0,0 +1,15 @@
+"""
+Compute the words changed in the existing revisions, and the weekly
+statistics of all sites. Edits only update the week they fall in.
+
+"""
+from django.db import transaction
+from pydocweb.docweb.models import Site, rebuild_weekly_stats
+
+@transaction.commit_on_success
+def main():
+    for site in Site.objects.all():
+        rebuild_weekly_stats(site)
+
+if __name__ == "__main__":
+    main()
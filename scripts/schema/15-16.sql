@@ -0,0 +1,8 @@
+-- Labels are unique per site; drop duplicates left by earlier versions
+DELETE FROM docweb_labelcache WHERE id NOT IN (
+    SELECT id FROM (
+        SELECT MIN(id) AS id FROM docweb_labelcache GROUP BY site_id, label
+    ) AS keep
+);
+CREATE UNIQUE INDEX docweb_labelcache_site_label
+ON docweb_labelcache (site_id, label);
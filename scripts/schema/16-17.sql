@@ -0,0 +1,19 @@
+CREATE INDEX docweb_labelcache_target
+ON docweb_labelcache (target);
+CREATE INDEX docweb_docstringalias_parent_alias
+ON docweb_docstringalias (parent_id, alias);
+CREATE INDEX docweb_docstringalias_target
+ON docweb_docstringalias (target);
+CREATE INDEX docweb_docstring_site_type_timestamp
+ON docweb_docstring (site_id, type_, timestamp);
+CREATE INDEX docweb_docstringrevision_docstring_revno
+ON docweb_docstringrevision (docstring_id, revno);
+CREATE INDEX docweb_docstringrevision_timestamp
+ON docweb_docstringrevision (timestamp);
+
+-- Tables created by schema steps lack the foreign key indexes that
+-- syncdb creates for new installations
+CREATE INDEX docweb_toctreecache_parent
+ON docweb_toctreecache (parent_id);
+CREATE INDEX docweb_toctreecache_child
+ON docweb_toctreecache (child_id);
@@ -0,0 +1,10 @@
+ALTER TABLE docweb_pullmetadata ADD COLUMN timestamp datetime NULL;
+UPDATE docweb_pullmetadata SET timestamp = (
+    SELECT MAX(d.timestamp) FROM docweb_docstring AS d
+    WHERE d.site_id = docweb_pullmetadata.site_id);
+-- sites without docstrings have no pull to record
+DELETE FROM docweb_pullmetadata WHERE timestamp IS NULL;
+INSERT INTO docweb_pullmetadata (site_id, timestamp)
+SELECT site_id, MAX(timestamp) FROM docweb_docstring
+WHERE site_id NOT IN (SELECT site_id FROM docweb_pullmetadata)
+GROUP BY site_id;
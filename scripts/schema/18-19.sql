@@ -0,0 +1,11 @@
+CREATE TABLE docweb_toctreeancestor (
+    id integer NOT NULL PRIMARY KEY @AUTO_INCREMENT@,
+    docstring_id varchar(256) NOT NULL REFERENCES docweb_docstring (name),
+    ancestor_id varchar(256) NOT NULL REFERENCES docweb_docstring (name),
+    depth integer NOT NULL,
+    site_id integer NOT NULL REFERENCES django_site (id)
+);
+CREATE INDEX docweb_toctreeancestor_docstring_depth
+ON docweb_toctreeancestor (docstring_id, depth);
+CREATE INDEX docweb_toctreeancestor_site_id
+ON docweb_toctreeancestor (site_id);
@@ -0,0 +1,14 @@
+"""
+Compute the toctree ancestry of the pages of all sites.
+
+"""
+from django.db import transaction
+from pydocweb.docweb.models import Site, ToctreeCache
+
+@transaction.commit_on_success
+def main():
+    for site in Site.objects.all():
+        ToctreeCache.update_ancestors(site)
+
+if __name__ == "__main__":
+    main()
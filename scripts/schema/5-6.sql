@@ -0,0 +1,21 @@
+-- Denormalized latest-revision columns for docweb_docstring
+ALTER TABLE docweb_docstring ADD COLUMN cur_revno integer NULL
+DEFAULT NULL;
+ALTER TABLE docweb_docstring ADD COLUMN cur_text text NULL;
+ALTER TABLE docweb_docstring ADD COLUMN cur_review integer NULL
+DEFAULT NULL;
+ALTER TABLE docweb_docstring ADD COLUMN cur_ok_to_apply bool NOT NULL
+DEFAULT FALSE;
+
+UPDATE docweb_docstring SET cur_revno = (
+    SELECT MAX(r.revno) FROM docweb_docstringrevision AS r
+    WHERE r.docstring_id = docweb_docstring.name);
+
+UPDATE docweb_docstring SET
+    cur_text = (SELECT r.text FROM docweb_docstringrevision AS r
+                WHERE r.revno = docweb_docstring.cur_revno),
+    cur_review = (SELECT r.review FROM docweb_docstringrevision AS r
+                  WHERE r.revno = docweb_docstring.cur_revno),
+    cur_ok_to_apply = (SELECT r.ok_to_apply FROM docweb_docstringrevision AS r
+                       WHERE r.revno = docweb_docstring.cur_revno)
+WHERE cur_revno IS NOT NULL;
@@ -0,0 +1,2 @@
+ALTER TABLE docweb_docstring ADD COLUMN source_hash varchar(32) NULL
+DEFAULT NULL;
@@ -0,0 +1,10 @@
+CREATE TABLE docweb_rendercache (
+    id integer NOT NULL PRIMARY KEY @AUTO_INCREMENT@,
+    docstring_id varchar(256) NOT NULL REFERENCES docweb_docstring (name),
+    revno integer NULL,
+    source_hash varchar(32) NOT NULL,
+    version integer NOT NULL,
+    html text NOT NULL
+);
+CREATE INDEX docweb_rendercache_docstring_id
+ON docweb_rendercache (docstring_id);
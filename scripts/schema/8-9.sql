@@ -0,0 +1,9 @@
+CREATE TABLE docweb_renderdependency (
+    id integer NOT NULL PRIMARY KEY @AUTO_INCREMENT@,
+    docstring_id varchar(256) NOT NULL REFERENCES docweb_docstring (name),
+    name varchar(256) NOT NULL
+);
+CREATE INDEX docweb_renderdependency_docstring_id
+ON docweb_renderdependency (docstring_id);
+CREATE INDEX docweb_renderdependency_name
+ON docweb_renderdependency (name);
@@ -0,0 +1,5 @@
+CREATE TABLE docweb_pullmetadata (
+    id integer NOT NULL PRIMARY KEY @AUTO_INCREMENT@,
+    site_id integer NOT NULL UNIQUE REFERENCES django_site (id),
+    names_token varchar(64) NULL
+);
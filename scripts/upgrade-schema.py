@@ -6,7 +6,7 @@ Upgrades Pydocweb database schema to the current version.
 
 """
 from optparse import OptionParser
-import os, glob, re, sys, subprocess
+import os, glob, re, sys
 
 BASEDIR = os.path.abspath(os.path.dirname(__file__))
 
@@ -56,7 +56,7 @@ def upgrade(verbose=True):
         if script.endswith('.sql'):
             run_sql(script, verbose=verbose)
         elif script.endswith('.py'):
-            run_python(script)
+            run_python(script, verbose=verbose)
         else:
             raise RuntimeError("Unknown upgrade script %s. "
                                "This is a bug, please report." % script)
@@ -67,9 +67,15 @@ def upgrade(verbose=True):
 
     do_print("-- All done. You may need to re-pull docstrings from sources.")
 
-def run_python(*args):
-    cmd = [sys.executable] + list(args)
-    subprocess.call(cmd)
+def run_python(filename, verbose=True):
+    # Run in this process, so that the script uses the same database
+    # connection, and its errors stop the upgrade
+    from django.db import transaction
+
+    if verbose:
+        print "-- Running %s" % os.path.basename(filename)
+    execfile(filename, {'__name__': '__main__', '__file__': filename})
+    transaction.commit_unless_managed()
 
 def run_sql(filename, verbose=True):
     from django.db import connection, transaction
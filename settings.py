@@ -90,6 +90,17 @@ CACHE_BACKEND = 'file://' + relative_dir('cache')   # file cache
 PULL_TRIGGER_KEY = "PHqTx8XuAhwIJMkqFdkhFazuCgRr3dz4"
 PULL_TRIGGER_IPS = "127.0.0.1"
 
+# Periodic pulls can be incremental: only docstrings whose contents in
+# VCS changed since the previous pull are then processed. The "Pull from
+# sources" button on the control page always does a full update.
+PULL_INCREMENTAL = True
+
+# Number of worker processes used for computing merges when a pull run
+# from the command line (update-docstrings.sh) changes many docstrings.
+# None means the number of CPUs; 1 disables the process pool. Pulls
+# started from the web server always compute the merges in-process.
+PULL_MERGE_PROCESSES = 1
+
 #------------------------------------------------------------------------------
 # Standard Django settings
 #------------------------------------------------------------------------------
@@ -6,4 +6,4 @@ if test "$DOMAIN" = ""; then
 fi
 
 umask 0002
-PYTHONPATH="$PWD/..:$PYTHONPATH" DJANGO_SETTINGS_MODULE="pydocweb.settings" python -c "import pydocweb.docweb.docstring_update as m; m.update_docstrings(models.Site.objects.get(domain='$1'))"
+PYTHONPATH="$PWD/..:$PYTHONPATH" DJANGO_SETTINGS_MODULE="pydocweb.settings" python -c "import pydocweb.docweb.docstring_update as m; print m.update_docstrings(m.Site.objects.get(domain='$1'), incremental=getattr(m.settings, 'PULL_INCREMENTAL', False), merge_processes=getattr(m.settings, 'PULL_MERGE_PROCESSES', 1))"